@@ -1,34 +1,133 @@
+import asyncio
+import hmac
 import logging
 import time
 import json
-from typing import Dict, Any, Optional
-from fastapi import FastAPI, HTTPException, Request, status
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, Set
+from fastapi import FastAPI, Depends, Header, HTTPException, Request, Response, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
-from contextlib import asynccontextmanager
-from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager, suppress
+from pydantic import BaseModel, Field, ValidationError
+from starlette.background import BackgroundTask
+from starlette.routing import Match
 from .models.chat import ChatCompletionRequest, ChatCompletionResponse, ErrorResponse, Message
 from .models.eye_doctor import (
     EyeDoctorRequest, 
     EyeDoctorResponse, 
     AIRecommendationRequest, 
-    AIRecommendationResponse
+    AIRecommendationResponse,
+    RecommendationJobResponse
 )
-from .services.llm_service import llm_service
+from .services.llm_service import llm_service, chunk_usage, record_usage, DeadlineExceededError
+from .services.circuit_breaker import circuit_breakers, CircuitOpenError
+from .services.answer_cache import answer_cache
+from .services.faq_store import faq_store
+from .services.formulary import formulary
+from .services.session_store import session_store
+from .services.model_router import model_router, router_settings
+from .services.token_budget import token_budget, token_budget_settings
+from .services.passthrough import passthrough_proxy, openai_error
+from .services.job_queue import job_queue, QueueFullError
+from .services.audit_log import audit_log
 from .utils.config import settings
+from .utils.metrics import metrics
+from .utils.recorder import recorder
+from .utils.structured_output import parse_recommendations
+from .utils.references import extract_references
+from .utils.reasoning import ReasoningFilter
+from .utils.prompts import choose_prompt_variant
+from .utils.deadline import Deadline, set_deadline
+from .utils.idempotency import IdempotencyMiddleware, idempotency_store
+from .utils.config_center import config_center
+from .utils.load_monitor import load_monitor
+from .utils.profiling import (
+    loop_lag_monitor,
+    profiler,
+    profile_response_type,
+    ProfilerBusyError,
+    PROFILE_MODES,
+    PROFILE_FORMATS,
+    PROFILE_SORT_KEYS
+)
 from .utils.register2nacos_config import init_app
 # Configure logging
 logging.basicConfig(level=getattr(logging, settings.log_level.upper()))
 logger = logging.getLogger(__name__)
 
+def reconfigure_services(changed: Set[str]):
+    """Push changed runtime settings into the components that copied them at startup"""
+    if changed & {"openai_api_key", "openai_api_base", "openai_default_model"}:
+        llm_service.reconfigure()
+    if changed & {"answer_cache_size", "answer_cache_ttl_seconds"}:
+        answer_cache.resize(settings.answer_cache_size, settings.answer_cache_ttl_seconds)
+    if changed & {"cache_l2_max_entries", "cache_l2_ttl_seconds"} and answer_cache.l2 is not None:
+        answer_cache.l2.resize(settings.cache_l2_max_entries, settings.cache_l2_ttl_seconds)
+    if changed & {"idempotency_max_entries", "idempotency_ttl_seconds"}:
+        idempotency_store.resize(settings.idempotency_max_entries, settings.idempotency_ttl_seconds)
+    if changed & {"session_max_sessions", "session_max_turns", "session_max_chars", "session_ttl_seconds"}:
+        session_store.resize(settings.session_max_sessions, settings.session_max_turns,
+                             settings.session_max_chars, settings.session_ttl_seconds)
+    if any(field.startswith(("model_", "route_")) or field == "intent_tiers" for field in changed):
+        model_router.configure(**router_settings())
+    if any(field.startswith("token_budget_") for field in changed):
+        token_budget.configure(**token_budget_settings())
+    if any(field.startswith("circuit_") for field in changed):
+        circuit_breakers.reconfigure()
+    if any(field.startswith("load_") for field in changed):
+        load_monitor.max_in_flight = settings.load_max_in_flight
+        load_monitor.latency_target_seconds = settings.load_latency_target_seconds
+        load_monitor.hysteresis = settings.load_weight_hysteresis
+        load_monitor.min_weight = settings.load_min_weight
+    if changed & {"faq_store_path", "faq_refresh_seconds"}:
+        faq_store.path = settings.faq_store_path
+        faq_store.refresh_seconds = settings.faq_refresh_seconds
+        faq_store.load()
+    if any(field.startswith("formulary_") for field in changed):
+        formulary.path = settings.formulary_path
+        formulary.refresh_seconds = settings.formulary_refresh_seconds
+        formulary.unknown_action = settings.formulary_unknown_action
+        formulary.load()
+    if "job_ttl_seconds" in changed:
+        job_queue.ttl_seconds = settings.job_ttl_seconds
+    if "record_path" in changed:
+        recorder.path = settings.record_path
+    if changed & {"loop_lag_interval_seconds", "loop_lag_threshold_seconds"}:
+        loop_lag_monitor.reconfigure(settings.loop_lag_interval_seconds, settings.loop_lag_threshold_seconds)
+    if "log_level" in changed:
+        logging.getLogger().setLevel(getattr(logging, settings.log_level.upper()))
+
+config_center.add_listener(reconfigure_services)
+
 # Define application lifecycle manager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup event
     logger.info("Starting up ChatGPT API Service")
+    # Runtime config overrides are applied before anything is loaded from the settings
+    background_tasks = await config_center.start()
+    # The refresh loops also run while disabled, so a path set at runtime is picked up
+    faq_store.load()
+    background_tasks.append(asyncio.create_task(faq_store.refresh_periodically()))
+    formulary.load()
+    background_tasks.append(asyncio.create_task(formulary.refresh_periodically()))
+    background_tasks.extend(job_queue.start())
+    background_tasks.append(asyncio.create_task(load_monitor.update_periodically()))
+    if loop_lag_monitor.enabled:
+        loop_lag_monitor.start()
     yield
     # Shutdown event
     logger.info("Shutting down ChatGPT API Service")
+    for task in background_tasks:
+        task.cancel()
+    loop_lag_monitor.stop()
+    await passthrough_proxy.close()
+    await answer_cache.close()
+    await asyncio.to_thread(session_store.close)
+    await asyncio.to_thread(recorder.close)
+    await asyncio.to_thread(audit_log.close)
 
 # Create FastAPI application
 app = FastAPI(
@@ -46,15 +145,39 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Record responses of requests carrying an Idempotency-Key (runs inside the logging middleware below)
+app.add_middleware(IdempotencyMiddleware)
 # Initialize Nacos configuration
 init_app()
+def route_label(scope) -> str:
+    """Route template of a request that hasn't been routed yet, or "unmatched" """
+    for route in app.router.routes:
+        if route.matches(scope)[0] == Match.FULL:
+            return route.path
+    return "unmatched"
+
 # Add request processing middleware for logging and performance monitoring
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     start_time = time.time()
+    # Don't start work the caller has already given up on
+    deadline = Deadline.from_headers(request.headers)
+    if deadline is not None:
+        if deadline.expired:
+            metrics.inc("deadline_rejected_total", path=route_label(request.scope))
+            return JSONResponse(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                content=ErrorResponse(message="Request deadline already passed").model_dump(),
+            )
+        set_deadline(deadline)
     response = await call_next(request)
     process_time = time.time() - start_time
     logger.info(f"Request path: {request.url.path} - Processed in {process_time:.4f} seconds")
+    # Label by route template so path parameters don't explode metric cardinality;
+    # requests matching no route (404s, scanners) share one label
+    route_path = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.observe("http_request_seconds", process_time, path=route_path)
+    metrics.inc("http_requests_total", path=route_path, status=response.status_code)
     return response
 
 # Exception handler
@@ -69,20 +192,132 @@ async def generic_exception_handler(request: Request, exc: Exception):
         ).model_dump(),
     )
 
+def reasoning_event(payload: Dict[str, Any]) -> str:
+    """Format reasoning text as a separate SSE event so answer consumers can ignore it"""
+    return f"event: reasoning\ndata: {json.dumps(payload)}\n\n"
+
+def recommendations_event(content: str) -> str:
+    """Validate the complete recommendations content, repairing truncated JSON locally"""
+    try:
+        recommendations, _ = parse_recommendations(content)
+        if formulary.enabled:
+            formulary.check(recommendations)
+        return f"data: {json.dumps(recommendations)}\n\n"
+    except ValueError as e:
+        logger.error(f"Error parsing recommendations JSON: {str(e)}")
+        return f"data: {json.dumps({'error': 'Invalid recommendations format'})}\n\n"
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
 
+# Readiness endpoint
+@app.get("/ready")
+async def readiness_check():
+    """Report the instance load state last published to Nacos; 503 while saturated"""
+    load_status = load_monitor.status()
+    if load_status["state"] == "saturated":
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=load_status)
+    return load_status
+
+# Metrics endpoint
+@app.get("/metrics")
+async def get_metrics():
+    """Return in-process counters, gauges, latency histograms and process CPU time"""
+    return metrics.snapshot()
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Allow admin endpoints only with the configured ADMIN_TOKEN"""
+    if not settings.admin_token or not hmac.compare_digest(x_admin_token or "", settings.admin_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin token required")
+
+@app.get("/config/history", dependencies=[Depends(require_admin)])
+async def get_config_history():
+    """Return the runtime config version, active overrides and change history (secrets masked)"""
+    return config_center.status()
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def capture_profile(
+    seconds: float = 10,
+    mode: str = "sampling",
+    format: Optional[str] = None,
+    hz: int = 100,
+    sort: str = "cumulative",
+    all_threads: bool = False
+):
+    """
+    Profile the event loop for the given number of seconds
+    
+    mode=cprofile returns a pstats report (format=text) or a binary pstats dump
+    (format=pstats); mode=sampling returns collapsed stacks for flamegraph.pl or
+    speedscope (format=collapsed).
+    """
+    if mode not in PROFILE_MODES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"mode must be one of {', '.join(PROFILE_MODES)}")
+    fmt = format or ("collapsed" if mode == "sampling" else "text")
+    if (mode == "sampling") != (fmt == "collapsed") or fmt not in PROFILE_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"format {fmt} is not available for mode {mode}")
+    if mode == "cprofile" and sort not in PROFILE_SORT_KEYS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"sort must be one of {', '.join(PROFILE_SORT_KEYS)}")
+    seconds = min(max(seconds, 0.1), settings.profile_max_seconds)
+    try:
+        if mode == "cprofile":
+            body = await profiler.capture_cprofile(seconds, fmt, sort=sort)
+        else:
+            body = await profiler.capture_samples(seconds, min(max(hz, 1), 1000), all_threads=all_threads)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    media_type, headers = profile_response_type(fmt)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+@app.get("/admin/audit", dependencies=[Depends(require_admin)])
+async def search_audit_log(
+    response_id: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 100
+):
+    """
+    Look up audited prompts and answers by response ID and/or time range
+    
+    since and until are Unix timestamps; only the compressed batches holding
+    matching records are read.
+    """
+    if not audit_log.enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Audit log is not enabled")
+    if response_id is None and since is None and until is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Give a response_id or a time range")
+    records = await asyncio.to_thread(audit_log.search, response_id, since, until, min(max(limit, 1), 1000))
+    return {"records": records}
+
+@app.get("/admin/loop-stalls", dependencies=[Depends(require_admin)])
+async def get_loop_stalls():
+    """Return the most recent event loop stalls with the blocking stack"""
+    return {
+        "threshold_seconds": loop_lag_monitor.threshold_seconds,
+        "stalls": list(reversed(loop_lag_monitor.stalls)),
+    }
+
 # Chat endpoint
 @app.post("/api/chat/completions", response_model=ChatCompletionResponse)
-async def chat_completions(request: ChatCompletionRequest):
+async def chat_completions(request: ChatCompletionRequest, response: Response):
     """
     Process chat completion requests
     
     Receives a request with message history, calls the OpenAI API, and returns the AI-generated response
     """
+    if recorder.enabled:
+        recorder.begin("/api/chat/completions", request.model_dump(exclude_unset=True))
+    response_id = audit_log.begin("/api/chat/completions")
+    response.headers["X-Response-Id"] = response_id
     try:
+        # Relay the upstream SSE bytes unchanged instead of re-emitting parsed content
+        if request.stream and settings.chat_stream_passthrough:
+            proxied = await passthrough_proxy.forward(request.model_dump(exclude_none=True))
+            proxied.headers["X-Response-Id"] = response_id
+            return proxied
+        
         result = await llm_service.get_chat_completion(
             messages=request.messages,
             model=request.model,
@@ -95,20 +330,45 @@ async def chat_completions(request: ChatCompletionRequest):
         if request.stream and result.get("stream"):
             async def generate():
                 try:
+                    reasoning_filter = ReasoningFilter()
                     async for chunk in result["stream"]:
-                        content = chunk.choices[0].delta.content or ""
-                        yield f"data: {content}\n\n"
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta
+                        reasoning, content = reasoning_filter.feed(delta)
+                        if chunk.choices[0].finish_reason is not None:
+                            content += reasoning_filter.flush()[1]
+                        if settings.reasoning_mode == "keep":
+                            content = delta.content or ""
+                        elif reasoning and settings.reasoning_mode == "event":
+                            yield reasoning_event({"content": reasoning})
+                        if content:
+                            yield f"data: {content}\n\n"
+                    metrics.inc("reasoning_chars_total", reasoning_filter.reasoning_chars, endpoint="chat")
                 except Exception as e:
                     logger.error(f"Error in streaming: {str(e)}")
                     yield f"data: [ERROR] {str(e)}\n\n"
                 finally:
                     yield "data: [DONE]\n\n"
                     
-            return StreamingResponse(generate(), media_type="text/event-stream")
+            # Release the upstream call even if the client left before the stream started
+            return StreamingResponse(generate(), media_type="text/event-stream", headers={"X-Response-Id": response_id},
+                                     background=BackgroundTask(result["stream"].aclose))
             
         # Handle regular response
         return result
         
+    except DeadlineExceededError as e:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=str(e)
+        )
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(settings.circuit_open_seconds)}
+        )
     except Exception as e:
         logger.error(f"Error in chat completion: {str(e)}")
         raise HTTPException(
@@ -116,6 +376,145 @@ async def chat_completions(request: ChatCompletionRequest):
             detail=str(e)
         )
 
+# OpenAI-compatible passthrough endpoint
+@app.post("/v1/chat/completions")
+async def openai_chat_completions(request: Request):
+    """
+    Forward an OpenAI chat completion request to the upstream as-is
+    
+    The upstream response (SSE stream or JSON) is relayed byte for byte, so
+    OpenAI SDK clients can use this service as their base URL. Errors use the
+    OpenAI error format.
+    """
+    try:
+        payload = json.loads(await request.body())
+    except ValueError:
+        return openai_error(400, "Request body is not valid JSON", "invalid_request_error")
+    if not isinstance(payload, dict) or not isinstance(payload.get("messages"), list):
+        return openai_error(400, "Request body must be an object with a messages list", "invalid_request_error")
+    response_id = audit_log.begin("/v1/chat/completions")
+    try:
+        proxied = await passthrough_proxy.forward(payload)
+        proxied.headers["X-Response-Id"] = response_id
+        return proxied
+    except DeadlineExceededError as e:
+        return openai_error(504, str(e), "deadline_exceeded")
+    except CircuitOpenError as e:
+        return openai_error(503, str(e), "upstream_unavailable",
+                            headers={"Retry-After": str(settings.circuit_open_seconds)})
+
+def faq_answer(request: EyeDoctorRequest, history, response_id: str) -> Optional[Dict[str, Any]]:
+    """Serve common first-turn questions from the precomputed FAQ store"""
+    faq_entry = faq_store.lookup(request) if faq_store.enabled and not history else None
+    if not faq_entry:
+        return None
+    if request.session_id:
+        session_store.append(request.session_id, request.question, faq_entry["content"])
+    audit_log.record([{"role": "user", "content": request.question}], faq_entry["content"],
+                     source="faq", finish_reason="stop")
+    return {
+        "response_id": response_id,
+        "session_id": request.session_id,
+        "content": faq_entry["content"],
+        "references": faq_entry.get("references", []),
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+def route_model(request: EyeDoctorRequest, history):
+    """Route to a model tier unless the caller pinned a model; returns (model, tier)"""
+    if request.model is not None or not model_router.enabled:
+        return request.model, None
+    history_turns = len(history if history is not None else request.previous_conversations or ())
+    tier, model = model_router.route(request, history_turns)
+    return model, tier
+
+async def eye_doctor_stream_events(request: EyeDoctorRequest, stream, response_id: str, start_time: float, tier,
+                                   variant: str):
+    """
+    Turn an upstream eye doctor stream into response chunks
+    
+    Yields ("reasoning", payload) and ("chunk", payload) tuples. The final chunk
+    (is_complete) carries references, timestamp and usage.
+    """
+    layout = settings.prompt_layout
+    chunk_id = 0
+    content_parts = []
+    usage = None
+    final_chunk = None
+    reasoning_filter = ReasoningFilter()
+    
+    async for chunk in stream:
+        usage = chunk_usage(chunk) or usage
+        # Usage-only chunks carry no choices
+        if not chunk.choices:
+            continue
+        
+        # Check if this is the last chunk
+        is_complete = chunk.choices[0].finish_reason is not None
+        
+        # Keep reasoning out of the answer, references and session history
+        delta = chunk.choices[0].delta
+        reasoning, content = reasoning_filter.feed(delta)
+        if is_complete:
+            content += reasoning_filter.flush()[1]
+        if content and not content_parts:
+            # Time to the first answer token, not to the first reasoning token
+            ttft = time.perf_counter() - start_time
+            metrics.observe("eye_doctor_ttft_seconds", ttft, layout=layout, variant=variant)
+            if tier:
+                model_router.observe(tier, "ttft", ttft)
+        if content:
+            content_parts.append(content)
+        if settings.reasoning_mode == "keep":
+            content = delta.content or ""
+        elif reasoning and settings.reasoning_mode == "event":
+            yield "reasoning", {"response_id": response_id, "content": reasoning}
+        if not content and not is_complete:
+            continue
+        chunk_id += 1
+        
+        # Create response chunk
+        response_chunk = {
+            "response_id": response_id,
+            "session_id": request.session_id,
+            "chunk_id": chunk_id,
+            "content": content,
+            "is_complete": is_complete
+        }
+        
+        # Hold the last chunk until the stream ends so a trailing usage chunk can be attached
+        if is_complete:
+            final_chunk = response_chunk
+            continue
+            
+        yield "chunk", response_chunk
+    
+    # The upstream was cut off at the caller's deadline
+    if final_chunk is None and getattr(stream, "truncated", False):
+        final_chunk = {
+            "response_id": response_id,
+            "session_id": request.session_id,
+            "chunk_id": chunk_id + 1,
+            "content": reasoning_filter.flush()[1],
+            "is_complete": True,
+            "truncated": True
+        }
+    
+    # For the last chunk, include references, timestamp and usage
+    if final_chunk is not None:
+        if tier:
+            model_router.observe(tier, "latency", time.perf_counter() - start_time)
+        answer = "".join(content_parts)
+        if request.session_id:
+            session_store.append(request.session_id, request.question, answer)
+        final_chunk["references"] = extract_references(answer)
+        final_chunk["created_at"] = datetime.now(timezone.utc).isoformat()
+        if usage:
+            final_chunk["usage"] = usage
+            record_usage(usage, layout=layout, variant=variant)
+        yield "chunk", final_chunk
+    metrics.inc("reasoning_chars_total", reasoning_filter.reasoning_chars, endpoint="eye_doctor")
+
 # Eye Doctor chat endpoint
 @app.post("/api/eye-doctor/chat", response_model=EyeDoctorResponse)
 async def eye_doctor_chat(request: EyeDoctorRequest):
@@ -125,73 +524,58 @@ async def eye_doctor_chat(request: EyeDoctorRequest):
     Receives patient data and question, constructs specialized prompts,
     calls the LLM, and returns a formatted response
     """
+    if recorder.enabled:
+        recorder.begin("/api/eye-doctor/chat", request.model_dump(exclude_unset=True))
+    
+    # Fill in patient context and history kept for the session
+    history = None
+    if request.session_id:
+        try:
+            request, history = await session_store.prepare(request)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
     try:
-        import uuid
-        from datetime import datetime, timezone
-        
         # Generate a unique response ID
-        response_id = str(uuid.uuid4())
+        response_id = audit_log.begin("/api/eye-doctor/chat", str(uuid.uuid4()))
+        start_time = time.perf_counter()
+        layout = settings.prompt_layout
+        
+        # Serve common first-turn questions from the precomputed FAQ store
+        response = faq_answer(request, history, response_id)
+        if response:
+            if request.stream:
+                async def generate_faq():
+                    yield f"data: {json.dumps(dict(response, chunk_id=1, is_complete=True))}\n\n"
+                    yield "data: [DONE]\n\n"
+                return StreamingResponse(generate_faq(), media_type="text/event-stream")
+            return response
         
-        # Convert request to dictionary
-        request_data = request.model_dump()
+        model, tier = route_model(request, history)
+        variant = choose_prompt_variant(settings.prompt_variant, request.session_id)
         
         # Call the eye doctor completion service
         result = await llm_service.get_eye_doctor_completion(
-            request_data=request_data,
-            model=request.model,
+            request=request,
+            model=model,
             temperature=request.temperature,
             max_tokens=request.max_tokens,
-            stream=request.stream
+            stream=request.stream,
+            history=history,
+            prompt_variant=variant
         )
         
         # Handle streaming response
         if request.stream and result.get("stream"):
             async def generate():
                 try:
-                    chunk_id = 0
-                    complete_content = ""
-                    
-                    async for chunk in result["stream"]:
-                        chunk_id += 1
-                        content = chunk.choices[0].delta.content or ""
-                        complete_content += content
-                        
-                        # Check if this is the last chunk
-                        is_complete = chunk.choices[0].finish_reason is not None
-                        
-                        # Create response chunk
-                        response_chunk = {
-                            "response_id": response_id,
-                            "chunk_id": chunk_id,
-                            "content": content,
-                            "is_complete": is_complete
-                        }
-                        
-                        # For the last chunk, include references and timestamp
-                        if is_complete:
-                            # Extract references if they exist
-                            references = []
-                            # Simple reference extraction logic - could be more sophisticated
-                            if "参考资料" in complete_content:
-                                ref_section = complete_content.split("参考资料")[-1]
-                                ref_lines = [line.strip() for line in ref_section.split("\n") if line.strip()]
-                                for line in ref_lines:
-                                    parts = line.split(",")
-                                    if len(parts) >= 2:
-                                        ref = {"title": parts[0].strip("- ")}
-                                        if len(parts) > 1:
-                                            ref["source"] = parts[1].strip()
-                                        if len(parts) > 2:
-                                            try:
-                                                ref["year"] = int(parts[2].strip())
-                                            except ValueError:
-                                                pass
-                                        references.append(ref)
-                            
-                            response_chunk["references"] = references
-                            response_chunk["created_at"] = datetime.now(timezone.utc).isoformat()
-                            
-                        yield f"data: {json.dumps(response_chunk)}\n\n"
+                    async for kind, payload in eye_doctor_stream_events(
+                        request, result["stream"], response_id, start_time, tier, variant
+                    ):
+                        if kind == "reasoning":
+                            yield reasoning_event(payload)
+                        else:
+                            yield f"data: {json.dumps(payload)}\n\n"
                         
                 except Exception as e:
                     logger.error(f"Error in streaming: {str(e)}")
@@ -199,38 +583,31 @@ async def eye_doctor_chat(request: EyeDoctorRequest):
                 finally:
                     yield "data: [DONE]\n\n"
                     
-            return StreamingResponse(generate(), media_type="text/event-stream")
+            return StreamingResponse(generate(), media_type="text/event-stream",
+                                     background=BackgroundTask(result["stream"].aclose))
             
         # Handle regular response
         if result.get("message"):
             # Extract content from message
-            content = result["message"].content
+            content = result["message"]["content"]
             
-            # Extract references if they exist
-            references = []
-            # Simple reference extraction logic - could be more sophisticated
-            if "参考资料" in content:
-                ref_section = content.split("参考资料")[-1]
-                ref_lines = [line.strip() for line in ref_section.split("\n") if line.strip()]
-                for line in ref_lines:
-                    parts = line.split(",")
-                    if len(parts) >= 2:
-                        ref = {"title": parts[0].strip("- ")}
-                        if len(parts) > 1:
-                            ref["source"] = parts[1].strip()
-                        if len(parts) > 2:
-                            try:
-                                ref["year"] = int(parts[2].strip())
-                            except ValueError:
-                                pass
-                        references.append(ref)
+            latency = time.perf_counter() - start_time
+            metrics.observe("eye_doctor_latency_seconds", latency, layout=layout, variant=variant)
+            if tier:
+                model_router.observe(tier, "latency", latency)
+            record_usage(result.get("usage"), layout=layout, variant=variant)
+            if request.session_id:
+                session_store.append(request.session_id, request.question, content)
             
             # Create response
             response = {
                 "response_id": response_id,
+                "session_id": request.session_id,
                 "content": content,
-                "references": references,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "references": extract_references(content),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "usage": result.get("usage"),
+                "truncated": result.get("truncated")
             }
             
             return response
@@ -240,6 +617,17 @@ async def eye_doctor_chat(request: EyeDoctorRequest):
             detail="Failed to generate response"
         )
         
+    except DeadlineExceededError as e:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=str(e)
+        )
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(settings.circuit_open_seconds)}
+        )
     except Exception as e:
         logger.error(f"Error in eye doctor chat: {str(e)}")
         raise HTTPException(
@@ -247,22 +635,136 @@ async def eye_doctor_chat(request: EyeDoctorRequest):
             detail=str(e)
         )
 
+# Client message types of the eye doctor WebSocket
+WS_MESSAGE_TYPES = ("chat", "cancel")
+
+# Eye Doctor WebSocket endpoint
+@app.websocket("/ws/eye-doctor")
+async def eye_doctor_websocket(websocket: WebSocket):
+    """
+    Multiplex eye doctor conversations over one WebSocket connection
+    
+    Client messages:
+        {"type": "chat", "request_id": "...", "request": {<eye doctor request>}}
+        {"type": "cancel", "request_id": "..."}
+    Server messages carry the request_id and a type of "chunk" (same fields as the
+    SSE chunks, the last one has is_complete), "reasoning", "error" or "cancelled".
+    """
+    await websocket.accept()
+    metrics.gauge_add("ws_connections", 1)
+    # Bounded outbox: producers wait when the client reads slowly, which in turn
+    # stops them reading from the upstream
+    outbox: asyncio.Queue = asyncio.Queue(maxsize=settings.ws_send_queue_size)
+    streams: Dict[str, asyncio.Task] = {}
+    
+    async def send(message: Dict[str, Any]):
+        await outbox.put(json.dumps(message))
+    
+    async def sender():
+        while True:
+            await websocket.send_text(await outbox.get())
+    
+    async def run_chat(request_id: str, body: Dict[str, Any]):
+        try:
+            request = EyeDoctorRequest(**body)
+            history = None
+            if request.session_id:
+                request, history = await session_store.prepare(request)
+            
+            response_id = audit_log.begin("/ws/eye-doctor", str(uuid.uuid4()))
+            start_time = time.perf_counter()
+            response = faq_answer(request, history, response_id)
+            if response:
+                await send(dict(response, type="chunk", request_id=request_id, chunk_id=1, is_complete=True))
+                return
+            
+            model, tier = route_model(request, history)
+            variant = choose_prompt_variant(settings.prompt_variant, request.session_id)
+            result = await llm_service.get_eye_doctor_completion(
+                request=request,
+                model=model,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens,
+                stream=True,
+                history=history,
+                prompt_variant=variant
+            )
+            async for kind, payload in eye_doctor_stream_events(
+                request, result["stream"], response_id, start_time, tier, variant
+            ):
+                await send(dict(payload, type=kind, request_id=request_id))
+        except asyncio.CancelledError:
+            # Never wait here: a full outbox would keep the cancelled task alive
+            with suppress(asyncio.QueueFull):
+                outbox.put_nowait(json.dumps({"type": "cancelled", "request_id": request_id}))
+            raise
+        except (ValidationError, ValueError) as e:
+            await send({"type": "error", "request_id": request_id, "error": str(e)})
+        except Exception as e:
+            logger.error(f"Error in eye doctor websocket stream: {str(e)}")
+            await send({"type": "error", "request_id": request_id, "error": str(e)})
+        finally:
+            streams.pop(request_id, None)
+            metrics.gauge_add("ws_streams", -1)
+    
+    sender_task = asyncio.create_task(sender())
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+            except ValueError:
+                await send({"type": "error", "request_id": None, "error": "Invalid JSON message"})
+                continue
+            if not isinstance(message, dict):
+                metrics.inc("ws_messages_total", type="unknown")
+                await send({"type": "error", "request_id": None, "error": "Message must be a JSON object"})
+                continue
+            message_type = message.get("type")
+            request_id = message.get("request_id")
+            if not isinstance(request_id, str):
+                request_id = None
+            metrics.inc("ws_messages_total", type=message_type if message_type in WS_MESSAGE_TYPES else "unknown")
+            
+            if message_type == "cancel":
+                task = streams.get(request_id)
+                if task is not None:
+                    task.cancel()
+            elif message_type == "chat":
+                if not request_id or request_id in streams:
+                    await send({"type": "error", "request_id": request_id, "error": "Missing or duplicate request_id"})
+                elif len(streams) >= settings.ws_max_streams:
+                    await send({"type": "error", "request_id": request_id, "error": "Too many concurrent requests on this connection"})
+                else:
+                    metrics.gauge_add("ws_streams", 1)
+                    streams[request_id] = asyncio.create_task(run_chat(request_id, message.get("request") or {}))
+            else:
+                await send({"type": "error", "request_id": request_id, "error": f"Unknown message type: {message_type}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in list(streams.values()):
+            task.cancel()
+        sender_task.cancel()
+        metrics.gauge_add("ws_connections", -1)
+
 # AI recommendation endpoint
 @app.post("/api/eye-doctor/recommendations", response_model=AIRecommendationResponse)
-async def get_ai_recommendations(request: AIRecommendationRequest):
+async def get_ai_recommendations(request: AIRecommendationRequest, response: Response):
     """
     Get AI-generated medication and treatment recommendations
     
     Receives patient data and diagnosis information, analyzes it using the LLM,
     and returns recommended medications and treatment plan
     """
+    if recorder.enabled:
+        recorder.begin("/api/eye-doctor/recommendations", request.model_dump(exclude_unset=True))
+    response_id = audit_log.begin("/api/eye-doctor/recommendations")
+    response.headers["X-Response-Id"] = response_id
     try:
-        # Convert request to dictionary
-        request_data = request.model_dump()
-        
         # Call the eye doctor recommendation service
+        start_time = time.perf_counter()
         result = await llm_service.get_eye_doctor_recommendations(
-            request_data=request_data,
+            request=request,
             stream=request.stream
         )
         
@@ -270,25 +772,34 @@ async def get_ai_recommendations(request: AIRecommendationRequest):
         if request.stream and result.get("stream"):
             async def generate():
                 try:
-                    complete_content = ""
+                    content_parts = []
+                    reasoning_filter = ReasoningFilter()
                     
                     async for chunk in result["stream"]:
-                        content = chunk.choices[0].delta.content or ""
-                        complete_content += content
+                        if not chunk.choices:
+                            continue
                         
                         # Check if this is the last chunk
                         is_complete = chunk.choices[0].finish_reason is not None
                         
+                        # Only answer tokens are part of the recommendations JSON
+                        reasoning, content = reasoning_filter.feed(chunk.choices[0].delta)
                         if is_complete:
-                            try:
-                                # Parse the complete content as JSON
-                                recommendations = json.loads(complete_content)
-                                yield f"data: {json.dumps(recommendations)}\n\n"
-                            except json.JSONDecodeError as e:
-                                logger.error(f"Error parsing recommendations JSON: {str(e)}")
-                                yield f"data: {json.dumps({'error': 'Invalid recommendations format'})}\n\n"
-                        else:
+                            content += reasoning_filter.flush()[1]
+                        content_parts.append(content)
+                        if reasoning and settings.reasoning_mode == "event":
+                            yield reasoning_event({"content": reasoning})
+                        
+                        if is_complete:
+                            metrics.observe("recommendation_latency_seconds", time.perf_counter() - start_time,
+                                            variant=result["prompt_variant"])
+                            yield recommendations_event("".join(content_parts))
+                        elif content:
                             yield f"data: {content}\n\n"
+                    
+                    # Cut off at the caller's deadline: return what can be salvaged
+                    if getattr(result["stream"], "truncated", False):
+                        yield recommendations_event("".join(content_parts))
                         
                 except Exception as e:
                     logger.error(f"Error in streaming: {str(e)}")
@@ -296,7 +807,8 @@ async def get_ai_recommendations(request: AIRecommendationRequest):
                 finally:
                     yield "data: [DONE]\n\n"
                     
-            return StreamingResponse(generate(), media_type="text/event-stream")
+            return StreamingResponse(generate(), media_type="text/event-stream", headers={"X-Response-Id": response_id},
+                                     background=BackgroundTask(result["stream"].aclose))
             
         # Handle regular response
         if result.get("recommendations"):
@@ -307,6 +819,17 @@ async def get_ai_recommendations(request: AIRecommendationRequest):
             detail="Failed to generate recommendations"
         )
         
+    except DeadlineExceededError as e:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=str(e)
+        )
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(settings.circuit_open_seconds)}
+        )
     except Exception as e:
         logger.error(f"Error in AI recommendations: {str(e)}")
         raise HTTPException(
@@ -314,6 +837,43 @@ async def get_ai_recommendations(request: AIRecommendationRequest):
             detail=str(e)
         )
 
+# Asynchronous recommendation job endpoints
+@app.post(
+    "/api/eye-doctor/recommendations/jobs",
+    response_model=RecommendationJobResponse,
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def submit_recommendation_job(request: AIRecommendationRequest):
+    """
+    Submit a recommendation request for asynchronous processing
+    
+    Returns a job ID immediately; poll GET /api/eye-doctor/recommendations/jobs/{job_id} for the result
+    """
+    try:
+        job = job_queue.submit(request)
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e)
+        )
+    return job.to_dict()
+
+@app.get("/api/eye-doctor/recommendations/jobs/{job_id}", response_model=RecommendationJobResponse)
+async def get_recommendation_job(job_id: str, wait: float = 0):
+    """
+    Get the status and result of a recommendation job
+    
+    With `wait` (seconds, capped by JOB_MAX_WAIT_SECONDS) the call long-polls until
+    the job finishes or the wait time elapses
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job {job_id} not found or expired"
+        )
+    await job_queue.wait(job, min(wait, settings.job_max_wait_seconds))
+    return job.to_dict()
 
 # If this file is run directly
 if __name__ == "__main__":
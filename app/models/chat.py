@@ -19,11 +19,13 @@ class TokenUsage(BaseModel):
     prompt_tokens: int
     completion_tokens: int
     total_tokens: int
+    cached_tokens: Optional[int] = Field(None, description="Prompt tokens served from the upstream prompt cache")
 
 class ChatCompletionResponse(BaseModel):
     """Chat completion response model"""
     message: Message
-    usage: TokenUsage
+    usage: Optional[TokenUsage] = None
+    truncated: Optional[bool] = Field(None, description="Generation was cut off at the caller's deadline")
 
 class ErrorResponse(BaseModel):
     """Error response model"""
@@ -1,28 +1,56 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_serializer, model_validator
+from pydantic.json_schema import SkipJsonSchema
 from typing import Optional, Dict, Any, List
+from .chat import TokenUsage
 
 # Eye Doctor chat model classes
+class PatientMedication(BaseModel):
+    """Medication currently used by the patient"""
+    medication_name: Optional[str] = Field(None, description="Name of the medication")
+    dosage: Optional[str] = Field(None, description="Dosage instructions")
+    frequency: Optional[str] = Field(None, description="Frequency of use")
+    side_effects: Optional[str] = Field(None, description="Potential side effects")
+
+class ConversationTurn(BaseModel):
+    """Single turn of a previous conversation"""
+    # Optional for clients that send turns without a role; such turns are left out of the prompt
+    role: Optional[str] = Field(None, description="Speaker role (user or assistant)")
+    content: Optional[str] = Field(None, description="Message content")
+
 class EyeDoctorRequest(BaseModel):
     """Eye doctor chat request model"""
-    disease_name: str = Field(..., description="Name of the diagnosed disease")
-    disease_category: str = Field(..., description="Category of the disease")
-    result: str = Field(..., description="Examination result")
+    disease_name: Optional[str] = Field(None, description="Name of the diagnosed disease (required without session_id)")
+    disease_category: Optional[str] = Field(None, description="Category of the disease (required without session_id)")
+    result: Optional[str] = Field(None, description="Examination result (required without session_id)")
     remark: Optional[str] = Field(None, description="Additional remarks")
     treatment_plan: Optional[Dict[str, Any]] = Field(None, description="Treatment plan details")
-    medications: Optional[list] = Field(None, description="List of medications")
-    previous_conversations: Optional[list] = Field(None, description="Previous conversation history")
+    medications: Optional[List[PatientMedication]] = Field(None, description="List of medications")
+    previous_conversations: Optional[List[ConversationTurn]] = Field(None, description="Previous conversation history")
     question: str = Field(..., description="Patient's question")
     model: Optional[str] = Field(None, description="LLM model to use")
     temperature: Optional[float] = Field(0.7, description="Temperature for generation", ge=0.0, le=2.0)
     max_tokens: Optional[int] = Field(None, description="Maximum tokens to generate")
     stream: Optional[bool] = Field(False, description="Whether to stream the response")
+    session_id: Optional[str] = Field(None, description="Server-side session; history and patient context are kept by the service")
+
+    @model_validator(mode="after")
+    def check_patient_context(self):
+        """Patient context may only be omitted when the session already holds it"""
+        if self.session_id is None:
+            missing = [f for f in ("disease_name", "disease_category", "result") if getattr(self, f) is None]
+            if missing:
+                raise ValueError(f"Missing required fields: {', '.join(missing)}")
+        return self
 
 class EyeDoctorResponse(BaseModel):
     """Eye doctor chat response model"""
     response_id: str = Field(..., description="Unique response ID")
+    session_id: Optional[str] = Field(None, description="Session the answer was appended to")
     content: str = Field(..., description="Response content")
     references: Optional[list] = Field(None, description="References used")
     created_at: str = Field(..., description="Response creation timestamp")
+    usage: Optional[TokenUsage] = Field(None, description="Token usage, including cached prompt tokens when reported")
+    truncated: Optional[bool] = Field(None, description="Generation was cut off at the caller's deadline")
 
 class PatientInfo(BaseModel):
     """Patient information model"""
@@ -36,6 +64,18 @@ class Medication(BaseModel):
     dosage: str = Field(..., description="Dosage instructions")
     frequency: str = Field(..., description="Frequency of use")
     side_effects: Optional[str] = Field(None, description="Potential side effects")
+    # Filled in by the formulary check, not by the model (kept out of the structured output schema)
+    formulary_status: SkipJsonSchema[Optional[str]] = Field(None, description="matched, normalized, partial or unknown")
+    original_name: SkipJsonSchema[Optional[str]] = Field(None, description="Name as generated, if it was normalized")
+
+    @model_serializer(mode="wrap")
+    def omit_unchecked_formulary_fields(self, handler):
+        """Leave the formulary fields out of responses until the formulary check sets them"""
+        data = handler(self)
+        for field in ("formulary_status", "original_name"):
+            if data.get(field) is None:
+                data.pop(field, None)
+        return data
 
 class TreatmentPlan(BaseModel):
     """Treatment plan model"""
@@ -53,4 +93,13 @@ class AIRecommendationRequest(BaseModel):
 class AIRecommendationResponse(BaseModel):
     """AI recommendation response model"""
     medications: List[Medication] = Field(..., description="List of recommended medications")
-    treatment_plan: TreatmentPlan = Field(..., description="Recommended treatment plan")
\ No newline at end of file
+    treatment_plan: TreatmentPlan = Field(..., description="Recommended treatment plan")
+
+class RecommendationJobResponse(BaseModel):
+    """Asynchronous recommendation job status model"""
+    job_id: str = Field(..., description="Unique job ID")
+    status: str = Field(..., description="queued, running, succeeded or failed")
+    created_at: str = Field(..., description="Job submission timestamp")
+    finished_at: Optional[str] = Field(None, description="Job completion timestamp")
+    result: Optional[AIRecommendationResponse] = Field(None, description="Recommendations, once the job succeeded")
+    error: Optional[str] = Field(None, description="Error message, if the job failed")
@@ -0,0 +1,22 @@
+"""
+Cache of recent upstream answers.
+
+Successful completions (eye doctor answers, recommendations and chat answers)
+are stored under the hash of the exact upstream prompt (model plus messages).
+The cache is used as a fallback while the upstream circuit is open: a request
+whose prompt was answered recently gets that answer instead of a 503.
+
+Answers are kept in an in-process LRU and, with CACHE_L2_BACKEND, in a cache
+shared by all workers, so an answer produced by one worker is available to the
+others.
+"""
+
+from ..utils.config import settings
+from .cache import MemoryBackend, TieredCache, create_shared_backend
+
+# Create answer cache instance
+answer_cache = TieredCache(
+    "answers",
+    MemoryBackend("answers", settings.answer_cache_size, settings.answer_cache_ttl_seconds),
+    create_shared_backend("answers")
+)
@@ -0,0 +1,355 @@
+"""
+Append-only audit log of every prompt and answer.
+
+Requests only build a record and put it on a bounded in-memory queue; a
+background thread serializes the records, compresses them and writes them to
+segment files under AUDIT_PATH, so retention costs the request path a dict and
+a queue put. Each batch of records is appended as one independently compressed
+gzip member or zstd frame. Both formats allow concatenation, so a whole segment
+still decompresses with gunzip or zstdcat. A segment is closed once it holds
+AUDIT_SEGMENT_MAX_BYTES of uncompressed records or is AUDIT_SEGMENT_MAX_SECONDS
+old; segments are never deleted by the service.
+
+Next to each segment a plain-text index holds one line per record (response_id,
+timestamp, offset and length of the compressed batch), so a lookup by
+response_id or time range decompresses only the batches it needs. Streamed
+answers are recorded once when the stream ends, not per chunk.
+"""
+
+import atexit
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+from ..utils.config import settings
+from ..utils.metrics import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+AUDIT_COMPRESSIONS = ("gzip", "zstd")
+
+# Most records written as one compressed batch
+MAX_BATCH_RECORDS = 1000
+
+SEGMENT_PREFIX = "audit-"
+INDEX_SUFFIX = ".idx"
+
+# Endpoint and response ID of the API request currently being processed
+_current_audit: ContextVar[Optional[Dict[str, str]]] = ContextVar("current_audit", default=None)
+
+# Queue item telling the writer to finish
+_STOP = object()
+
+def answer_from_sse(raw: bytes) -> Tuple[str, Optional[str], Optional[Dict[str, Any]]]:
+    """
+    Reassemble the answer of a relayed OpenAI SSE stream
+
+    Returns:
+        Tuple of (answer text, finish reason, usage)
+    """
+    parts = []
+    finish_reason = None
+    usage = None
+    for event in raw.split(b"\n\n"):
+        event = event.strip()
+        if not event.startswith(b"data:") or event[5:].strip() == b"[DONE]":
+            continue
+        try:
+            chunk = json.loads(event[5:])
+        except ValueError:
+            continue
+        usage = chunk.get("usage") or usage
+        for choice in chunk.get("choices") or ():
+            parts.append((choice.get("delta") or {}).get("content") or "")
+            finish_reason = choice.get("finish_reason") or finish_reason
+    return "".join(parts), finish_reason, usage
+
+def _codec(compression: str):
+    """Return (compress function, segment suffix) for a compression name"""
+    if compression == "zstd":
+        if zstandard is not None:
+            return zstandard.ZstdCompressor(level=3).compress, ".jsonl.zst"
+        logger.warning("AUDIT_COMPRESSION=zstd needs the zstandard package, writing gzip segments instead")
+    return (lambda data: gzip.compress(data, compresslevel=6)), ".jsonl.gz"
+
+def _decompress(segment: str, data: bytes) -> bytes:
+    if segment.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"Reading {segment} needs the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+class _Segment:
+    """A segment file being written, with its index"""
+
+    def __init__(self, directory: str, suffix: str, sequence: int):
+        self.started = time.time()
+        stamp = datetime.fromtimestamp(self.started, timezone.utc).strftime("%Y%m%dT%H%M%S")
+        self.path = os.path.join(directory, f"{SEGMENT_PREFIX}{stamp}-{os.getpid()}-{sequence:04d}{suffix}")
+        self.raw_bytes = 0
+        self._data = open(self.path, "ab")
+        self._index = open(self.path + INDEX_SUFFIX, "a", encoding="utf-8")
+
+    def write(self, records: List[Dict[str, Any]], compress) -> int:
+        """Append records as one compressed batch; returns the compressed size"""
+        raw = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records).encode("utf-8")
+        data = compress(raw)
+        offset = self._data.seek(0, os.SEEK_END)
+        self._data.write(data)
+        self._data.flush()
+        # The index is written after the data so it never points past the end of the segment
+        self._index.write("".join(
+            f"{record['response_id']}\t{record['ts']:.3f}\t{offset}\t{len(data)}\n" for record in records
+        ))
+        self._index.flush()
+        self.raw_bytes += len(raw)
+        return len(data)
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+def search(directory: str, response_id: Optional[str] = None, since: Optional[float] = None,
+           until: Optional[float] = None, limit: int = 100) -> List[Dict[str, Any]]:
+    """
+    Find audit records by response ID and/or time range
+
+    Args:
+        directory: AUDIT_PATH the segments were written to
+        response_id: Only records of this response
+        since: Only records at or after this Unix time
+        until: Only records at or before this Unix time
+        limit: Most records returned
+
+    Returns:
+        Matching records, oldest first
+    """
+    matches = []
+    for segment in sorted(glob.glob(os.path.join(directory, f"{SEGMENT_PREFIX}*.jsonl.*"))):
+        if segment.endswith(INDEX_SUFFIX) or not os.path.exists(segment + INDEX_SUFFIX):
+            continue
+        # Batches of the segment holding a matching record, in file order
+        batches = {}
+        with open(segment + INDEX_SUFFIX, encoding="utf-8") as index:
+            for line in index:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 4:
+                    # A line the writer hasn't finished yet
+                    continue
+                record_id, ts = fields[0], float(fields[1])
+                if response_id is not None and record_id != response_id:
+                    continue
+                # Index times are rounded to the millisecond; records are checked exactly below
+                if (since is not None and ts < since - 0.001) or (until is not None and ts > until + 0.001):
+                    continue
+                batches[int(fields[2])] = int(fields[3])
+        if not batches:
+            continue
+        with open(segment, "rb") as data:
+            for offset, length in sorted(batches.items()):
+                data.seek(offset)
+                for line in _decompress(segment, data.read(length)).splitlines():
+                    record = json.loads(line)
+                    if response_id is not None and record["response_id"] != response_id:
+                        continue
+                    if (since is not None and record["ts"] < since) or (until is not None and record["ts"] > until):
+                        continue
+                    matches.append(record)
+    matches.sort(key=lambda record: record["ts"])
+    return matches[:limit]
+
+class AuditLog:
+    """Buffered audit sink written by a background thread"""
+
+    def __init__(
+        self,
+        path: str,
+        compression: str,
+        segment_max_bytes: int,
+        segment_max_seconds: int,
+        buffer_size: int,
+        flush_seconds: float
+    ):
+        self.path = path
+        self.compression = compression
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_seconds = segment_max_seconds
+        self.buffer_size = buffer_size
+        self.flush_seconds = flush_seconds
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._dropping = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def begin(self, endpoint: str, response_id: Optional[str] = None) -> str:
+        """
+        Mark the start of an API request whose prompts and answers should be audited
+
+        Returns:
+            The response ID the records are indexed by (a new one if none is given)
+        """
+        response_id = response_id or str(uuid.uuid4())
+        if self.enabled:
+            _current_audit.set({"endpoint": endpoint, "response_id": response_id})
+        return response_id
+
+    def record(
+        self,
+        messages: Optional[List[Dict[str, Any]]],
+        answer: Optional[str],
+        model: Optional[str] = None,
+        source: str = "upstream",
+        finish_reason: Optional[str] = None,
+        usage: Optional[Dict[str, Any]] = None,
+        latency: Optional[float] = None,
+        sse: Optional[bytes] = None
+    ):
+        """
+        Queue one prompt and answer for the audit log
+
+        Args:
+            messages: Prompt messages as sent upstream
+            answer: Answer text (None when `sse` is given)
+            model: Model that produced the answer
+            source: upstream, passthrough, cache (circuit fallback) or faq
+            finish_reason: Finish reason, or deadline/malformed/incomplete for cut off answers
+            usage: Token usage, if reported
+            latency: Seconds from the upstream call to the end of the answer
+            sse: Raw relayed SSE stream, reassembled into the answer by the writer
+        """
+        if not self.enabled:
+            return
+        context = _current_audit.get() or {}
+        record = {
+            "ts": time.time(),
+            "response_id": context.get("response_id") or str(uuid.uuid4()),
+            "endpoint": context.get("endpoint"),
+            "source": source,
+            "model": model,
+            "messages": messages,
+            "answer": answer,
+            "finish_reason": finish_reason,
+            "usage": usage,
+            "latency": round(latency, 4) if latency is not None else None,
+        }
+        if sse is not None:
+            record["sse"] = sse
+        try:
+            self._writer_queue().put_nowait(record)
+        except queue.Full:
+            metrics.inc("audit_dropped_total")
+            if not self._dropping:
+                self._dropping = True
+                logger.error("Audit log buffer full, dropping records until the writer catches up")
+
+    def search(self, response_id: Optional[str] = None, since: Optional[float] = None,
+               until: Optional[float] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Find audit records of this instance's AUDIT_PATH (blocking, run it in a thread)"""
+        return search(self.path, response_id, since, until, limit)
+
+    def _writer_queue(self) -> queue.Queue:
+        """Start the writer thread on first use (again in a forked worker)"""
+        if self._thread is None or self._pid != os.getpid():
+            with self._start_lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.buffer_size)
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.close)
+        return self._queue
+
+    def _next_batch(self) -> Tuple[List[Dict[str, Any]], bool]:
+        """Wait for records and collect them for up to flush_seconds; returns (records, stop)"""
+        try:
+            item = self._queue.get(timeout=self.flush_seconds)
+        except queue.Empty:
+            return [], False
+        batch = []
+        flush_at = time.monotonic() + self.flush_seconds
+        while item is not _STOP:
+            batch.append(item)
+            if len(batch) >= MAX_BATCH_RECORDS:
+                break
+            try:
+                item = self._queue.get(timeout=max(flush_at - time.monotonic(), 0))
+            except queue.Empty:
+                break
+        metrics.set_gauge("audit_queue_depth", self._queue.qsize())
+        return batch, item is _STOP
+
+    def _run(self):
+        os.makedirs(self.path, exist_ok=True)
+        compress, suffix = _codec(self.compression)
+        segment = None
+        sequence = 0
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if segment is not None and (segment.raw_bytes >= self.segment_max_bytes
+                                        or time.time() - segment.started >= self.segment_max_seconds):
+                segment.close()
+                segment = None
+            if not batch:
+                continue
+            start_time = time.perf_counter()
+            try:
+                if segment is None:
+                    sequence += 1
+                    segment = _Segment(self.path, suffix, sequence)
+                for record in batch:
+                    sse = record.pop("sse", None)
+                    if sse is not None:
+                        record["answer"], finish_reason, usage = answer_from_sse(sse)
+                        record["finish_reason"] = record["finish_reason"] or finish_reason
+                        record["usage"] = record["usage"] or usage
+                raw_before = segment.raw_bytes
+                compressed = segment.write(batch, compress)
+                metrics.inc("audit_records_total", len(batch))
+                metrics.inc("audit_bytes_total", segment.raw_bytes - raw_before, kind="raw")
+                metrics.inc("audit_bytes_total", compressed, kind="compressed")
+                self._dropping = False
+            except Exception as e:
+                metrics.inc("audit_write_errors_total")
+                logger.error(f"Failed to write {len(batch)} audit records: {str(e)}")
+            metrics.observe("audit_write_seconds", time.perf_counter() - start_time)
+        if segment is not None:
+            segment.close()
+
+    def close(self):
+        """Write the buffered records and stop the writer"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._thread = None
+        self._queue.put(_STOP)
+        thread.join(timeout=30)
+
+# Create audit log instance
+audit_log = AuditLog(
+    settings.audit_path,
+    settings.audit_compression,
+    settings.audit_segment_max_bytes,
+    settings.audit_segment_max_seconds,
+    settings.audit_buffer_size,
+    settings.audit_flush_seconds
+)
@@ -0,0 +1,433 @@
+"""
+Pluggable cache backends and a two-tier cache.
+
+Every uvicorn worker has its own in-process cache, which starts cold and holds
+the same entries as its neighbours, so the hit rate drops as workers are added.
+TieredCache puts the in-process LRU (L1) in front of a shared L2 that all workers
+see:
+
+- sqlite: a WAL-mode SQLite file shared by the workers of one host
+- redis: a networked store speaking the Redis protocol (GET/SET PX/DEL), shared
+  by every pod; cache_server.py is a local stand-in for development and tests
+
+L2 errors never fail a request: they are logged, counted and treated as misses.
+Hits found in L2 are copied into L1. Writes to L2 run in the background, so a
+slow shared store never delays the answer being cached.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from ..utils.config import settings
+from ..utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+L2_BACKENDS = ("none", "sqlite", "redis")
+EVICTION_POLICIES = ("lru", "fifo")
+
+# SQLite puts between removals of expired and excess entries
+SQLITE_PRUNE_INTERVAL = 100
+# Seconds to wait for another worker's write lock before treating the call as a cache error;
+# the calls run on the backend's own thread, and WAL readers never wait for it
+SQLITE_BUSY_TIMEOUT = 1.0
+
+# L2 writes in flight per cache before new ones are dropped
+L2_MAX_PENDING_WRITES = 1000
+
+# Idle connections kept open to the networked store
+REDIS_POOL_SIZE = 8
+
+class CacheBackendError(Exception):
+    """The cache backend could not be reached or returned an error"""
+
+class CacheBackend(ABC):
+    """Key/value store of cached strings with a TTL"""
+
+    name = "backend"
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        """Return the value stored under key, or None if missing or expired"""
+
+    @abstractmethod
+    async def put(self, key: str, value: str):
+        """Store a value under key with the backend's TTL"""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """Remove a key"""
+
+    def resize(self, max_entries: int, ttl_seconds: int):
+        """Change the size limit and TTL (backends that enforce them elsewhere ignore this)"""
+
+    async def close(self):
+        """Release connections or files"""
+
+class MemoryBackend(CacheBackend):
+    """Bounded in-process LRU with a TTL"""
+
+    name = "memory"
+
+    def __init__(self, namespace: str, max_entries: int, ttl_seconds: int):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    async def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def put(self, key: str, value: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    async def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def resize(self, max_entries: int, ttl_seconds: int):
+        """Change the limits, evicting only the least recently used entries beyond the new size"""
+        with self._lock:
+            self.max_entries = max_entries
+            self.ttl_seconds = ttl_seconds
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > max(self.max_entries, 0):
+            self._entries.popitem(last=False)
+        metrics.set_gauge("cache_entries", len(self._entries), cache=self.namespace, tier="l1")
+
+class SQLiteBackend(CacheBackend):
+    """
+    Cache table in a WAL-mode SQLite file shared by the worker processes of a host
+
+    WAL lets readers in every process run concurrently with the single writer.
+    Expired entries and entries beyond max_entries are removed every
+    SQLITE_PRUNE_INTERVAL puts, least recently used first with the lru policy
+    (which costs one write per hit) or oldest first with fifo. All SQLite calls
+    run on a dedicated thread so they never block the event loop.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, namespace: str, path: str, max_entries: int, ttl_seconds: int, eviction: str = "lru"):
+        self.namespace = namespace
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.eviction = eviction
+        self._db = None
+        self._db_pid = None
+        self._executor = None
+        self._executor_pid = None
+        self._puts = 0
+        self._resized = False
+        self._lock = threading.Lock()
+
+    async def _run(self, func, *args):
+        """Run a blocking call on the backend thread (a new one in a forked worker)"""
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sqlite-{self.namespace}")
+            self._executor_pid = os.getpid()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection must not be shared across a fork, so each worker process opens its own
+        if self._db is None or self._db_pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._run(self._get, key)
+
+    async def put(self, key: str, value: str):
+        await self._run(self._put, key, value)
+
+    async def delete(self, key: str):
+        await self._run(self._delete, key)
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._connect()
+                row = db.execute(
+                    "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (self._key(key), now)
+                ).fetchone()
+                if row is not None and self.eviction == "lru":
+                    db.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, self._key(key)))
+        except sqlite3.Error as e:
+            raise CacheBackendError(f"SQLite cache read failed: {str(e)}")
+        return row[0] if row is not None else None
+
+    def _put(self, key: str, value: str):
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._connect()
+                db.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (self._key(key), value, now + self.ttl_seconds, now)
+                )
+                self._puts += 1
+                if self._puts % SQLITE_PRUNE_INTERVAL == 0 or self._resized:
+                    self._resized = False
+                    self._prune(db, now)
+        except sqlite3.Error as e:
+            raise CacheBackendError(f"SQLite cache write failed: {str(e)}")
+
+    def _delete(self, key: str):
+        try:
+            with self._lock:
+                self._connect().execute("DELETE FROM cache WHERE key = ?", (self._key(key),))
+        except sqlite3.Error as e:
+            raise CacheBackendError(f"SQLite cache delete failed: {str(e)}")
+
+    def _prune(self, db: sqlite3.Connection, now: float):
+        """Remove expired entries, then the least recently used (or oldest) beyond max_entries"""
+        db.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        count = db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if count > self.max_entries:
+            db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,)
+            )
+            count = self.max_entries
+        metrics.set_gauge("cache_entries", count, cache=self.namespace, tier="l2")
+
+    def resize(self, max_entries: int, ttl_seconds: int):
+        """Change the limits; the table is pruned to the new size on the next put"""
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._resized = True
+
+    async def close(self):
+        if self._executor is not None and self._executor_pid == os.getpid():
+            await self._run(self._close)
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+class RedisBackend(CacheBackend):
+    """
+    Networked store speaking the Redis protocol (RESP)
+
+    Only GET, SET with PX and DEL are used, so Redis, Valkey, KeyDB or the local
+    stand-in cache_server.py all work. Size limits and eviction are the server's
+    (e.g. maxmemory with allkeys-lru); the TTL is set per key. Every command is
+    bounded by timeout_seconds so a slow store can't delay requests.
+    """
+
+    name = "redis"
+
+    def __init__(self, namespace: str, url: str, ttl_seconds: int, timeout_seconds: float):
+        parsed = urlparse(url)
+        self.namespace = namespace
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.ttl_seconds = ttl_seconds
+        self.timeout_seconds = timeout_seconds
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    def _key(self, key: str) -> str:
+        return f"eye_doctor:{self.namespace}:{key}"
+
+    async def _open(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._roundtrip(reader, writer, "AUTH", self.password)
+        if self.db:
+            await self._roundtrip(reader, writer, "SELECT", str(self.db))
+        return reader, writer
+
+    async def _roundtrip(self, reader, writer, *args: str):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg.encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        writer.write(b"".join(parts))
+        await writer.drain()
+        return await read_reply(reader)
+
+    async def command(self, *args: str):
+        """
+        Run one command on a pooled connection
+
+        Raises:
+            CacheBackendError: On connection errors, timeouts and error replies
+        """
+        connection = self._idle.pop() if self._idle else None
+        try:
+            if connection is None:
+                connection = await asyncio.wait_for(self._open(), self.timeout_seconds)
+            reply = await asyncio.wait_for(self._roundtrip(*connection, *args), self.timeout_seconds)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, CacheBackendError) as e:
+            if connection is not None:
+                connection[1].close()
+            raise CacheBackendError(f"Cache server {self.host}:{self.port} {args[0]} failed: {str(e) or type(e).__name__}")
+        if len(self._idle) < REDIS_POOL_SIZE:
+            self._idle.append(connection)
+        else:
+            connection[1].close()
+        return reply
+
+    async def get(self, key: str) -> Optional[str]:
+        reply = await self.command("GET", self._key(key))
+        return reply.decode("utf-8") if reply is not None else None
+
+    async def put(self, key: str, value: str):
+        await self.command("SET", self._key(key), value, "PX", str(int(self.ttl_seconds * 1000)))
+
+    async def delete(self, key: str):
+        await self.command("DEL", self._key(key))
+
+    def resize(self, max_entries: int, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+
+    async def close(self):
+        while self._idle:
+            self._idle.pop()[1].close()
+
+async def read_reply(reader: asyncio.StreamReader):
+    """Read one RESP reply; bulk strings are returned as bytes"""
+    line = await reader.readuntil(b"\r\n")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode("utf-8")
+    if kind == b"-":
+        raise CacheBackendError(payload.decode("utf-8"))
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b"*":
+        count = int(payload)
+        return None if count < 0 else [await read_reply(reader) for _ in range(count)]
+    raise CacheBackendError(f"Unexpected reply from cache server: {line!r}")
+
+class TieredCache:
+    """In-process L1 in front of an optional shared L2"""
+
+    def __init__(self, namespace: str, l1: MemoryBackend, l2: Optional[CacheBackend] = None):
+        self.namespace = namespace
+        self.l1 = l1
+        self.l2 = l2
+        # Background L2 writes, referenced until they finish
+        self._writes: Set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.l1.enabled or self.l2 is not None
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self.l1.get(key) if self.l1.enabled else None
+        if value is not None:
+            metrics.inc("cache_requests_total", cache=self.namespace, tier="l1", result="hit")
+            return value
+        if self.l2 is None:
+            metrics.inc("cache_requests_total", cache=self.namespace, tier="l1", result="miss")
+            return None
+        try:
+            value = await self.l2.get(key)
+        except CacheBackendError as e:
+            metrics.inc("cache_errors_total", cache=self.namespace, backend=self.l2.name)
+            logger.warning(f"Shared cache unavailable, treating as a miss: {str(e)}")
+            return None
+        metrics.inc("cache_requests_total", cache=self.namespace, tier="l2", result="hit" if value is not None else "miss")
+        if value is not None:
+            await self.l1.put(key, value)
+        return value
+
+    async def put(self, key: str, value: str):
+        """Store in L1 and start the L2 write without waiting for it"""
+        if not value:
+            return
+        await self.l1.put(key, value)
+        if self.l2 is None:
+            return
+        if len(self._writes) >= L2_MAX_PENDING_WRITES:
+            metrics.inc("cache_writes_dropped_total", cache=self.namespace, backend=self.l2.name)
+            return
+        task = asyncio.create_task(self._put_shared(key, value))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _put_shared(self, key: str, value: str):
+        try:
+            await self.l2.put(key, value)
+        except CacheBackendError as e:
+            metrics.inc("cache_errors_total", cache=self.namespace, backend=self.l2.name)
+            logger.warning(f"Failed to store in the shared cache: {str(e)}")
+
+    def resize(self, max_entries: int, ttl_seconds: int):
+        """Change the L1 limits"""
+        self.l1.resize(max_entries, ttl_seconds)
+
+    async def close(self):
+        """Finish the pending L2 writes and close the L2 backend"""
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+        if self.l2 is not None:
+            await self.l2.close()
+
+def create_shared_backend(namespace: str) -> Optional[CacheBackend]:
+    """Build the L2 backend configured by CACHE_L2_BACKEND, or None"""
+    backend = settings.cache_l2_backend
+    if backend == "sqlite":
+        return SQLiteBackend(namespace, settings.cache_sqlite_path, settings.cache_l2_max_entries,
+                             settings.cache_l2_ttl_seconds, settings.cache_l2_eviction)
+    if backend == "redis":
+        return RedisBackend(namespace, settings.cache_redis_url, settings.cache_l2_ttl_seconds,
+                            settings.cache_redis_timeout_seconds)
+    if backend != "none":
+        logger.error(f"Unknown CACHE_L2_BACKEND '{backend}', using the in-process cache only")
+    return None
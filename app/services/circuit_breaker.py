@@ -0,0 +1,176 @@
+"""
+Circuit breakers around the upstream model gateway.
+
+One breaker per (upstream base URL, model). A breaker opens when, over the recent
+window, enough calls were made and the share of failed or slow calls reaches the
+configured rate. While open, calls fail fast with CircuitOpenError; after the open
+period a single probe call is let through (half-open) and its outcome closes or
+reopens the circuit.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Tuple
+
+from ..utils.config import settings
+from ..utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitOpenError(Exception):
+    """The upstream circuit is open; the call was rejected without contacting the upstream"""
+
+class BreakerCall:
+    """Outcome handle of one admitted call; only the first reported outcome counts"""
+
+    __slots__ = ("breaker", "started", "finished")
+
+    def __init__(self, breaker: "CircuitBreaker"):
+        self.breaker = breaker
+        self.started = time.monotonic()
+        self.finished = False
+
+    def succeed(self, latency: float = None):
+        """Report a successful call; latency defaults to the time since admission"""
+        if not self.finished:
+            self.finished = True
+            self.breaker._record(True, time.monotonic() - self.started if latency is None else latency)
+
+    def fail(self):
+        if not self.finished:
+            self.finished = True
+            self.breaker._record(False, time.monotonic() - self.started)
+
+    def release(self):
+        """Give up the call without an outcome (e.g. the caller cancelled it)"""
+        if not self.finished:
+            self.finished = True
+            self.breaker._release()
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker driven by error rate and slow call rate"""
+
+    def __init__(self, name: str, window_seconds: float, min_requests: int, failure_rate: float,
+                 slow_seconds: float, open_seconds: float):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probe_started = None
+        self._outcomes = deque()
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str):
+        logger.warning(f"Upstream circuit {self.name}: {self.state} -> {state}")
+        self.state = state
+        metrics.inc("circuit_transitions_total", circuit=self.name, to=state)
+        metrics.set_gauge("circuit_state", STATE_VALUES[state], circuit=self.name)
+
+    def begin(self) -> BreakerCall:
+        """
+        Admit a call
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with a probe in progress
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now - self._opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+                self._probe_started = None
+            if self.state == HALF_OPEN:
+                # Let one probe through; a probe that never reported back stops blocking after open_seconds
+                if self._probe_started is None or now - self._probe_started >= self.open_seconds:
+                    self._probe_started = now
+                    return BreakerCall(self)
+            if self.state != CLOSED:
+                metrics.inc("circuit_rejected_total", circuit=self.name)
+                retry_after = max(0, int(self.open_seconds - (now - self._opened_at)))
+                raise CircuitOpenError(f"Upstream {self.name} is unavailable, retry in {retry_after}s")
+        return BreakerCall(self)
+
+    def _record(self, success: bool, latency: float):
+        ok = success and latency <= self.slow_seconds
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_started = None
+                if ok:
+                    self._outcomes.clear()
+                    self._transition(CLOSED)
+                else:
+                    self._opened_at = now
+                    self._transition(OPEN)
+                return
+            if self.state == OPEN:
+                return
+
+            self._outcomes.append((now, ok))
+            cutoff = now - self.window_seconds
+            while self._outcomes and self._outcomes[0][0] < cutoff:
+                self._outcomes.popleft()
+            total = len(self._outcomes)
+            if total >= self.min_requests:
+                failures = sum(1 for _, outcome in self._outcomes if not outcome)
+                if failures / total >= self.failure_rate:
+                    self._opened_at = now
+                    self._transition(OPEN)
+
+    def _release(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_started = None
+
+class CircuitBreakerRegistry:
+    """Breakers created on demand per (upstream, model)"""
+
+    def __init__(self):
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, upstream: str, model: str) -> CircuitBreaker:
+        key = (upstream, model)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(key)
+                if breaker is None:
+                    breaker = self._breakers[key] = CircuitBreaker(
+                        name=f"{upstream or 'default'}|{model}", **breaker_settings()
+                    )
+        return breaker
+
+    def reconfigure(self):
+        """Apply the current breaker settings to existing breakers, keeping their state"""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        params = breaker_settings()
+        for breaker in breakers:
+            with breaker._lock:
+                for name, value in params.items():
+                    setattr(breaker, name, value)
+
+def breaker_settings() -> Dict[str, float]:
+    """CircuitBreaker thresholds from the current settings"""
+    return dict(
+        window_seconds=settings.circuit_window_seconds,
+        min_requests=settings.circuit_min_requests,
+        failure_rate=settings.circuit_failure_rate,
+        slow_seconds=settings.circuit_slow_seconds,
+        open_seconds=settings.circuit_open_seconds
+    )
+
+# Create circuit breaker registry instance
+circuit_breakers = CircuitBreakerRegistry()
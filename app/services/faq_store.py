@@ -0,0 +1,129 @@
+"""
+Precomputed FAQ answers for common (disease, intent) pairs.
+
+Answers are generated offline by precompute_faq.py and written to a single JSON
+file together with the questions they answer. The store loads it at startup,
+reloads it when the file changes, and serves first-turn eye doctor questions
+whose disease matches and whose text matches one of those questions after
+normalization (case, width, spacing and punctuation). Treatment and medication
+answers are only served when the request carries no plan or medications of its
+own.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import unicodedata
+from typing import Dict, Any, Optional
+
+from ..utils.config import settings
+from ..utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Intents whose answer depends on the patient's examination findings, which every
+# request carries (given by the caller or kept by the session); they are not served
+FINDINGS_INTENTS = ("explanation", "prognosis")
+
+_SEPARATORS = re.compile(r"[\W_]+")
+
+def faq_key(disease_name: str, intent: str) -> str:
+    """Key of an FAQ entry in the store file"""
+    return f"{disease_name.strip()}|{intent}"
+
+def normalize_question(question: str) -> str:
+    """Normalize a question for matching against the precomputed ones"""
+    return _SEPARATORS.sub("", unicodedata.normalize("NFKC", question).lower())
+
+def question_key(disease_name: str, question: str) -> str:
+    """Key of a (disease, question) pair in the lookup index"""
+    return f"{disease_name.strip()}|{normalize_question(question)}"
+
+class FAQStore:
+    """Read-only store of precomputed answers, reloaded when the file changes"""
+
+    def __init__(self, path: str, refresh_seconds: int):
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.version: Optional[str] = None
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        # question_key -> entry
+        self._questions: Dict[str, Dict[str, Any]] = {}
+        self._mtime: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def load(self) -> bool:
+        """Load the store file if it changed since the last load; returns True on reload"""
+        if not self.enabled:
+            return False
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load FAQ store {self.path}: {str(e)}")
+            return False
+
+        entries = {}
+        questions = {}
+        for key, entry in data.get("entries", {}).items():
+            disease_name, _, intent = key.rpartition("|")
+            if entry.setdefault("intent", intent) in FINDINGS_INTENTS:
+                continue
+            entries[key] = entry
+            for question in entry.get("questions") or ():
+                questions[question_key(disease_name, question)] = entry
+        if entries and not questions:
+            logger.warning(f"FAQ store {self.path} lists no questions, regenerate it with precompute_faq.py")
+
+        # Swap the whole mapping at once so lookups never see a partial update
+        self._entries = entries
+        self._questions = questions
+        self.version = data.get("version")
+        self._mtime = mtime
+        metrics.set_gauge("faq_entries", len(self._entries))
+        logger.info(f"Loaded FAQ store version {self.version} with {len(self._entries)} entries "
+                    f"for {len(questions)} questions")
+        return True
+
+    def lookup(self, request) -> Optional[Dict[str, Any]]:
+        """
+        Return the precomputed answer for an eye doctor request, if one applies
+
+        Only first-turn questions matching a precomputed question are served. The
+        answers were generated without patient details, so treatment and
+        medication answers are not used when the request carries its own plan or
+        medications.
+        """
+        if not self._questions or request.previous_conversations:
+            return None
+        entry = self._questions.get(question_key(request.disease_name, request.question))
+        if entry is None:
+            metrics.inc("faq_lookups_total", result="miss")
+            return None
+        intent = entry.get("intent")
+        if (intent == "treatment" and request.treatment_plan) or (intent == "medication" and request.medications):
+            metrics.inc("faq_lookups_total", result="patient_specific")
+            return None
+        metrics.inc("faq_lookups_total", result="hit")
+        return entry
+
+    async def refresh_periodically(self):
+        """Reload the store file whenever it changes"""
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            self.load()
+
+# Create FAQ store instance
+faq_store = FAQStore(settings.faq_store_path, settings.faq_refresh_seconds)
@@ -0,0 +1,200 @@
+"""
+Drug formulary index for checking recommended medications.
+
+The formulary is a JSON file listing each drug's canonical name together with
+its aliases (generic names, brand names), pinyin and pinyin initials. Names are
+normalized (full-width characters, case, spacing, parenthesized strengths) and
+indexed in an exact-match map and a character trie, so a medication name from the
+model is resolved locally. Exact or alias matches are rewritten to the canonical
+name; a name that only contains a known drug name (e.g. "0.3%左氧氟沙星滴眼液")
+is reported as a partial match but kept as written, since the extra words may
+be a different strength, dosage form or combination product. Unknown drugs are
+flagged or dropped. The file is reloaded when it changes.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import unicodedata
+from typing import Dict, Any, Optional, Tuple
+
+from ..utils.config import settings
+from ..utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Lookup results
+MATCHED = "matched"
+NORMALIZED = "normalized"
+PARTIAL = "partial"
+UNKNOWN = "unknown"
+
+UNKNOWN_ACTIONS = ("flag", "drop")
+
+# Shortest known name accepted as a partial match inside a longer medication name
+MIN_PARTIAL_LENGTH = 2
+
+# Trie node key marking the end of a known name
+_END = "\0"
+
+# Bracketed brand names are dropped, bracketed strengths (anything with a digit) are kept
+_BRACKETED = re.compile(r"[(\[【][^)\]】\d]*[)\]】]")
+_SEPARATORS = re.compile(r"[\W_]+")
+
+def normalize_name(name: str) -> str:
+    """Normalize a medication name for lookup"""
+    name = unicodedata.normalize("NFKC", name).lower()
+    name = _BRACKETED.sub("", name)
+    return _SEPARATORS.sub("", name)
+
+class FormularyIndex:
+    """Immutable lookup structures built from one formulary file"""
+
+    def __init__(self, drugs):
+        self.exact: Dict[str, str] = {}
+        self.trie: Dict[str, Any] = {}
+        self.size = 0
+        for drug in drugs:
+            canonical = drug.get("name")
+            if not canonical:
+                continue
+            self.size += 1
+            names = [canonical] + list(drug.get("aliases", [])) + [drug.get("pinyin") or ""]
+            for name in names:
+                key = normalize_name(name)
+                if key:
+                    self._add(key, canonical)
+                    self._insert(key, canonical)
+            # Initials are too short and ambiguous to search for inside longer names
+            initials = normalize_name(drug.get("initials") or "")
+            if initials:
+                self._add(initials, canonical)
+
+    def _add(self, key: str, canonical: str):
+        previous = self.exact.setdefault(key, canonical)
+        if previous != canonical:
+            logger.warning(f"Formulary name '{key}' is used by both {previous} and {canonical}, keeping {previous}")
+
+    def _insert(self, key: str, canonical: str):
+        node = self.trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node.setdefault(_END, canonical)
+
+    def longest_contained(self, key: str) -> Optional[str]:
+        """Return the drug whose name is the longest known name contained in key"""
+        best_length, best = 0, None
+        for start in range(len(key)):
+            node = self.trie
+            for end in range(start, len(key)):
+                node = node.get(key[end])
+                if node is None:
+                    break
+                length = end - start + 1
+                if _END in node and length > best_length:
+                    best_length, best = length, node[_END]
+        return best if best_length >= MIN_PARTIAL_LENGTH else None
+
+class Formulary:
+    """Formulary lookups, reloaded when the file changes"""
+
+    def __init__(self, path: str, refresh_seconds: int, unknown_action: str):
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.unknown_action = unknown_action
+        self.version: Optional[str] = None
+        self._index = FormularyIndex([])
+        self._mtime: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def load(self) -> bool:
+        """Load the formulary file if it changed since the last load; returns True on reload"""
+        if not self.enabled:
+            return False
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            index = FormularyIndex(data.get("drugs", []))
+        except (OSError, ValueError, AttributeError, TypeError) as e:
+            logger.error(f"Failed to load formulary {self.path}: {str(e)}")
+            return False
+
+        # Build the new index completely before swapping it in
+        self._index = index
+        self.version = data.get("version")
+        self._mtime = mtime
+        metrics.set_gauge("formulary_drugs", index.size)
+        logger.info(f"Loaded formulary version {self.version} with {index.size} drugs")
+        return True
+
+    def lookup(self, name: str) -> Tuple[Optional[str], str]:
+        """
+        Resolve a medication name against the formulary
+
+        Args:
+            name: Medication name as written by the model
+
+        Returns:
+            Tuple of (canonical name or None, MATCHED, NORMALIZED, PARTIAL or UNKNOWN);
+            for PARTIAL the canonical name is the known drug contained in the name
+        """
+        index = self._index
+        key = normalize_name(name or "")
+        canonical = index.exact.get(key)
+        if canonical is not None:
+            return canonical, MATCHED if canonical == name else NORMALIZED
+        canonical = index.longest_contained(key)
+        if canonical is not None:
+            return canonical, PARTIAL
+        return None, UNKNOWN
+
+    def check(self, recommendations: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Normalize the recommended medication names in place
+
+        Exact and alias matches get their canonical name (the model's wording is
+        kept in original_name); partial matches keep the model's name; unknown
+        drugs are flagged, or dropped when FORMULARY_UNKNOWN_ACTION is drop.
+        """
+        if self._mtime is None:
+            # Never loaded (missing or broken file): don't flag every medication as unknown
+            return recommendations
+        checked = []
+        for medication in recommendations.get("medications") or []:
+            name = medication.get("medication_name")
+            canonical, result = self.lookup(name)
+            metrics.inc("formulary_checks_total", result=result)
+            medication["formulary_status"] = result
+            if result == NORMALIZED:
+                medication["original_name"] = name
+                medication["medication_name"] = canonical
+            elif result == PARTIAL:
+                logger.info(f"Recommended medication '{name}' only partially matches formulary drug {canonical}")
+            elif result == UNKNOWN:
+                logger.warning(f"Recommended medication not in formulary: {name}")
+                if self.unknown_action == "drop":
+                    continue
+            checked.append(medication)
+        recommendations["medications"] = checked
+        return recommendations
+
+    async def refresh_periodically(self):
+        """Reload the formulary file whenever it changes"""
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            self.load()
+
+# Create formulary instance
+formulary = Formulary(settings.formulary_path, settings.formulary_refresh_seconds, settings.formulary_unknown_action)
@@ -0,0 +1,148 @@
+"""
+Asynchronous recommendation jobs.
+
+POST /api/eye-doctor/recommendations/jobs enqueues the request and returns a job
+ID at once; a bounded pool of in-process workers runs the recommendation calls and
+callers poll (or long-poll) for the result. Finished jobs are kept for a TTL.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional
+
+from ..utils.config import settings
+from ..utils.metrics import metrics
+from .audit_log import audit_log
+from .llm_service import llm_service
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """The job queue is at capacity"""
+
+class Job:
+    """State of one recommendation job"""
+
+    __slots__ = ("id", "request", "status", "result", "error", "created_at", "finished_at", "enqueued", "done")
+
+    def __init__(self, request):
+        self.id = str(uuid.uuid4())
+        self.request = request
+        self.status = "queued"
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.now(timezone.utc).isoformat()
+        self.finished_at: Optional[str] = None
+        self.enqueued = time.monotonic()
+        self.done = asyncio.Event()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+class JobQueue:
+    """Bounded queue of recommendation jobs served by a fixed number of workers"""
+
+    def __init__(self, workers: int, max_queue: int, ttl_seconds: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ttl_seconds = ttl_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._finished_at: Dict[str, float] = {}
+
+    def start(self):
+        """Start the worker tasks; returns them so the caller can cancel them on shutdown"""
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        tasks.append(asyncio.create_task(self._purge_periodically()))
+        return tasks
+
+    def submit(self, request) -> Job:
+        """
+        Enqueue a recommendation request
+
+        Raises:
+            QueueFullError: If the queue already holds max_queue waiting jobs
+        """
+        job = Job(request)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            metrics.inc("recommendation_jobs_rejected_total")
+            raise QueueFullError("Recommendation job queue is full, please retry later")
+        self._jobs[job.id] = job
+        metrics.inc("recommendation_jobs_total", status="queued")
+        metrics.set_gauge("recommendation_jobs_queued", self._queue.qsize())
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job: Job, timeout: float) -> Job:
+        """Wait up to timeout seconds for the job to finish (long-poll)"""
+        if timeout > 0 and not job.done.is_set():
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            metrics.set_gauge("recommendation_jobs_queued", self._queue.qsize())
+            metrics.observe("recommendation_job_wait_seconds", time.monotonic() - job.enqueued)
+            metrics.gauge_add("recommendation_jobs_running", 1)
+            job.status = "running"
+            start_time = time.monotonic()
+            try:
+                audit_log.begin("/api/eye-doctor/recommendations/jobs", job.id)
+                result = await llm_service.get_eye_doctor_recommendations(request=job.request, stream=False)
+                job.result = result["recommendations"]
+                job.status = "succeeded"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Recommendation job {job.id} failed: {str(e)}")
+                job.error = str(e)
+                job.status = "failed"
+            finally:
+                metrics.gauge_add("recommendation_jobs_running", -1)
+                self._queue.task_done()
+            metrics.observe("recommendation_job_run_seconds", time.monotonic() - start_time)
+            metrics.inc("recommendation_jobs_total", status=job.status)
+            job.request = None
+            job.finished_at = datetime.now(timezone.utc).isoformat()
+            self._finished_at[job.id] = time.monotonic()
+            job.done.set()
+
+    def purge_expired(self):
+        """Forget finished jobs older than the TTL"""
+        cutoff = time.monotonic() - self.ttl_seconds
+        expired = [job_id for job_id, finished in self._finished_at.items() if finished < cutoff]
+        for job_id in expired:
+            del self._finished_at[job_id]
+            self._jobs.pop(job_id, None)
+        metrics.set_gauge("recommendation_jobs_stored", len(self._jobs))
+
+    async def _purge_periodically(self):
+        while True:
+            await asyncio.sleep(min(self.ttl_seconds, 60))
+            self.purge_expired()
+
+# Create job queue instance
+job_queue = JobQueue(
+    workers=settings.job_workers,
+    max_queue=settings.job_queue_size,
+    ttl_seconds=settings.job_ttl_seconds
+)
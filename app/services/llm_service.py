@@ -1,16 +1,226 @@
 from typing import List, Dict, Any, Optional
+import asyncio
 import logging
 import httpx
-import json
-from openai import AsyncOpenAI, APIError, RateLimitError
+import time
+from openai import AsyncOpenAI, APIError, APITimeoutError, BadRequestError, RateLimitError
+from openai.types.chat import ChatCompletionChunk
 from ..utils.config import settings
-from ..models.chat import Message, TokenUsage
-from ..utils.prompts import construct_prompt, construct_recommendation_prompt
+from ..utils.metrics import metrics
+from ..utils.recorder import recorder, upstream_key
+from ..utils.reasoning import strip_reasoning
+from ..utils.deadline import DeadlineStream, current_deadline
+from ..utils.load_monitor import load_monitor
+from ..models.chat import Message
+from ..models.eye_doctor import EyeDoctorRequest, AIRecommendationRequest
+from ..utils.prompts import (
+    construct_messages, construct_recommendation_messages, choose_prompt_variant, classify_intent
+)
+from ..utils.structured_output import (
+    structured_output_params, parse_recommendations, RecommendationStreamValidator
+)
+from .circuit_breaker import circuit_breakers, CircuitOpenError
+from .answer_cache import answer_cache
+from .audit_log import audit_log
+from .formulary import formulary
+from .token_budget import token_budget
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Seconds a replaced upstream client stays open for the calls still using it
+CLIENT_DRAIN_SECONDS = 600
+
+# max_tokens of recommendations until the token budget has enough samples
+RECOMMENDATION_MAX_TOKENS = 1000
+
+def _field(obj, name):
+    """Read a field from an SDK object or a raw dict (for fields the SDK doesn't model)"""
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+def usage_to_dict(usage) -> Optional[Dict[str, Any]]:
+    """
+    Convert upstream token usage to a dict, including cached prompt tokens when reported
+    
+    OpenAI-style upstreams report them as prompt_tokens_details.cached_tokens,
+    DeepSeek-style upstreams as prompt_cache_hit_tokens.
+    """
+    if usage is None:
+        return None
+    result = {
+        "prompt_tokens": _field(usage, "prompt_tokens") or 0,
+        "completion_tokens": _field(usage, "completion_tokens") or 0,
+        "total_tokens": _field(usage, "total_tokens") or 0
+    }
+    cached_tokens = _field(_field(usage, "prompt_tokens_details"), "cached_tokens")
+    if cached_tokens is None:
+        cached_tokens = _field(usage, "prompt_cache_hit_tokens")
+    if cached_tokens is not None:
+        result["cached_tokens"] = cached_tokens
+    return result
+
+def chunk_usage(chunk) -> Optional[Dict[str, Any]]:
+    """Return the usage carried by a streamed chunk, if any"""
+    return usage_to_dict(_field(chunk, "usage"))
+
+def record_usage(usage: Optional[Dict[str, Any]], **labels):
+    """Count prompt and cached prompt tokens"""
+    if not usage:
+        return
+    metrics.inc("prompt_tokens_total", usage["prompt_tokens"], **labels)
+    metrics.inc("cached_prompt_tokens_total", usage.get("cached_tokens") or 0, **labels)
+
+class ClosingStream:
+    """
+    Iterate a stream, closing the upstream HTTP response when the consumer stops or is cancelled
+    
+    Also counts the stream as an in-flight upstream call, reports its time to first
+    token to the load monitor and the circuit breaker, caches the complete answer
+    and audits the answer once the stream ends. `truncated` reads the wrapped
+    stream, so a cut-off at the caller's deadline stays visible to the consumer,
+    and `aclose` gives up the circuit slot and the upstream response even when
+    the stream was never iterated (e.g. the client disconnected first).
+    """
+    
+    def __init__(self, stream, upstream, started: float, call, cache_key: Optional[str] = None,
+                 messages: Optional[List[Dict[str, str]]] = None, model: Optional[str] = None):
+        self._stream = stream
+        self._upstream = upstream
+        self._started = started
+        self._call = call
+        self._cache_key = cache_key
+        self._messages = messages
+        self._model = model
+        self._iterator = None
+        self._released = False
+    
+    @property
+    def truncated(self) -> bool:
+        return getattr(self._stream, "truncated", False)
+    
+    def __aiter__(self):
+        self._iterator = self._iterate()
+        return self._iterator
+    
+    async def _iterate(self):
+        metrics.gauge_add("upstream_in_flight", 1)
+        first = True
+        content_parts = [] if self._cache_key or audit_log.enabled else None
+        finish_reason = None
+        usage = None
+        try:
+            async for chunk in self._stream:
+                if first:
+                    ttft = time.perf_counter() - self._started
+                    load_monitor.observe_latency(ttft)
+                    self._call.succeed(ttft)
+                    first = False
+                if content_parts is not None:
+                    usage = chunk_usage(chunk) or usage
+                    if chunk.choices:
+                        content_parts.append(chunk.choices[0].delta.content or "")
+                        finish_reason = chunk.choices[0].finish_reason or finish_reason
+                        if self._cache_key and chunk.choices[0].finish_reason == "stop":
+                            await answer_cache.put(self._cache_key, strip_reasoning("".join(content_parts)))
+                yield chunk
+            self._call.succeed()
+        except Exception:
+            self._call.fail()
+            raise
+        finally:
+            metrics.gauge_add("upstream_in_flight", -1)
+            await self._release()
+            if audit_log.enabled:
+                if finish_reason is None:
+                    finish_reason = "deadline" if self.truncated else "incomplete"
+                audit_log.record(self._messages, "".join(content_parts), model=self._model,
+                                 finish_reason=finish_reason, usage=usage,
+                                 latency=time.perf_counter() - self._started)
+    
+    async def _release(self):
+        if self._released:
+            return
+        self._released = True
+        self._call.release()
+        response = getattr(self._upstream, "response", None)
+        if response is not None:
+            await response.aclose()
+    
+    async def aclose(self):
+        """Stop the stream, or release its upstream call if it was never iterated"""
+        if self._iterator is not None:
+            await self._iterator.aclose()
+        await self._release()
+
+class BudgetStream:
+    """
+    Report the completion length of a stream to the token budget once it has finished
+    
+    Only the usage chunk gives the exact length (STREAM_INCLUDE_USAGE=true); without
+    it the completion is counted but not sampled, since chunks don't map to tokens.
+    `truncated` and `aclose` are passed through to the wrapped stream.
+    """
+    
+    def __init__(self, stream, intent: str, model: str, source: str):
+        self._stream = stream
+        self.intent = intent
+        self.model = model
+        self.source = source
+    
+    @property
+    def truncated(self) -> bool:
+        return getattr(self._stream, "truncated", False)
+    
+    async def __aiter__(self):
+        usage = None
+        finish_reason = None
+        async for chunk in self._stream:
+            usage = chunk_usage(chunk) or usage
+            if chunk.choices:
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+            yield chunk
+        if finish_reason is not None:
+            completion_tokens = usage["completion_tokens"] if usage else None
+            token_budget.observe(self.intent, self.model, completion_tokens, finish_reason, self.source)
+    
+    async def aclose(self):
+        close = getattr(self._stream, "aclose", None)
+        if close is not None:
+            await close()
+
+async def cached_stream(content: str, model: str):
+    """Replay a cached answer as a single-chunk stream"""
+    yield ChatCompletionChunk.model_validate({
+        "id": "cached",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    })
+
+async def close_client(client):
+    """Close a replaced upstream client"""
+    close = getattr(client, "close", None)
+    if close is not None:
+        try:
+            await close()
+        except Exception as e:
+            logger.warning(f"Error closing previous upstream client: {str(e)}")
+
+class UpstreamBadRequestError(Exception):
+    """The upstream rejected the request parameters (HTTP 400)"""
+
+class DeadlineExceededError(Exception):
+    """The caller's deadline passed before the upstream produced any answer"""
+
+class MalformedOutputError(Exception):
+    """Generation was aborted because the output could no longer match its schema"""
+
 class LLMService:
     """LLM service for interacting with the OpenAI API"""
     
@@ -21,6 +231,33 @@ class LLMService:
             base_url=settings.openai_api_base or None  # Use base_url if provided
         )
         self.default_model = settings.openai_default_model
+        self._client_config = (settings.openai_api_key, settings.openai_api_base)
+        # (model, mode) pairs whose structured output mode the upstream rejected
+        self._unsupported_structured_modes = set()
+    
+    def reconfigure(self):
+        """
+        Apply changed upstream settings at runtime
+        
+        A new client is swapped in when the API key or base URL changed; calls and
+        streams already in flight keep the previous client, which is closed after
+        CLIENT_DRAIN_SECONDS.
+        """
+        self.default_model = settings.openai_default_model
+        client_config = (settings.openai_api_key, settings.openai_api_base)
+        if client_config == self._client_config:
+            return
+        previous = self.client
+        self.client = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_api_base or None
+        )
+        self._client_config = client_config
+        self._unsupported_structured_modes = set()
+        logger.info(f"Switched upstream client to {settings.openai_api_base or 'default base URL'}")
+        asyncio.get_running_loop().call_later(
+            CLIENT_DRAIN_SECONDS, lambda: asyncio.ensure_future(close_client(previous))
+        )
         
     async def get_chat_completion(
         self, 
@@ -46,81 +283,310 @@ class LLMService:
         Raises:
             Exception: Various exceptions related to API errors
         """
+        return await self._create_completion(
+            messages=[{"role": msg.role, "content": msg.content} for msg in messages],
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=stream
+        )
+    
+    async def _create_completion(
+        self,
+        messages: List[Dict[str, str]],
+        model: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        stream: bool = False,
+        extra_params: Optional[Dict[str, Any]] = None,
+        validator=None
+    ) -> Dict[str, Any]:
+        """
+        Send an already assembled message list to the OpenAI API
+        
+        Args:
+            messages: List of role/content dictionaries used as-is in the payload
+            model: Model name to use, defaults to configured model
+            temperature: Controls randomness in generation, defaults to 0.7
+            max_tokens: Maximum number of tokens to generate, defaults to None
+            stream: Whether to use streaming response, defaults to False
+            extra_params: Additional upstream parameters such as response_format or tools
+            validator: Incremental output validator (e.g. RecommendationStreamValidator);
+                a non-streaming call is then streamed internally and aborted early
+            
+        Returns:
+            Dictionary containing the stream, or the generated message and token usage
+            
+        Raises:
+            MalformedOutputError: If the validator rejected the output during generation
+            Exception: Various exceptions related to API errors
+        """
+        model_to_use = model or self.default_model
+        start_time = time.perf_counter()
+        deadline = current_deadline()
+        # Retrying a timed out call can't finish before the caller's deadline
+        client = self.client.with_options(max_retries=0) if deadline is not None else self.client
+        cache_key = f"{model_to_use}:{upstream_key(messages)}" if answer_cache.enabled else None
+        
+        # Fail fast while the upstream circuit is open, unless this prompt was answered recently
+        try:
+            call = circuit_breakers.get(settings.openai_api_base, model_to_use).begin()
+        except CircuitOpenError:
+            cached = await answer_cache.get(cache_key) if cache_key else None
+            if cached is None:
+                raise
+            metrics.inc("circuit_fallback_total", model=model_to_use)
+            logger.warning(f"Upstream circuit open, serving cached answer for model {model_to_use}")
+            audit_log.record(messages, cached, model=model_to_use, source="cache", finish_reason="stop")
+            if stream:
+                return {"stream": cached_stream(cached, model_to_use), "message": None, "usage": None, "cached": True}
+            return {"message": {"role": "assistant", "content": cached}, "usage": None, "finish_reason": "stop",
+                    "cached": True}
+        
+        metrics.gauge_add("upstream_in_flight", 1)
+        handed_off = False
         try:
             # Prepare request parameters
-            model_to_use = model or self.default_model
-            messages_dict = [msg.model_dump() for msg in messages]
-            
             request_params = {
                 "model": model_to_use,
-                "messages": messages_dict,
+                "messages": messages,
                 "temperature": temperature,
             }
             
             if max_tokens is not None:
                 request_params["max_tokens"] = max_tokens
             
+            if extra_params:
+                request_params.update(extra_params)
+            
+            # Fit the generation into the caller's remaining time
+            if deadline is not None:
+                request_params["max_tokens"] = deadline.fit_max_tokens(max_tokens)
+                request_params["timeout"] = max(deadline.remaining(), 0.001)
+            
             # Handle streaming response
             if stream:
                 request_params["stream"] = True
-                stream_response = await self.client.chat.completions.create(**request_params)
+                if settings.stream_include_usage:
+                    request_params["extra_body"] = {"stream_options": {"include_usage": True}}
+                stream_response = await client.chat.completions.create(**request_params)
+                metrics.observe("upstream_open_seconds", time.perf_counter() - start_time, model=model_to_use)
+                response_stream = recorder.wrap_stream(messages, model_to_use, start_time, stream_response)
+                if deadline is not None:
+                    response_stream = DeadlineStream(response_stream, stream_response, deadline)
+                response_stream = ClosingStream(
+                    response_stream, stream_response, start_time, call, cache_key, messages, model_to_use
+                )
+                handed_off = True
                 return {
-                    "stream": stream_response,
+                    "stream": response_stream,
                     "message": None,
                     "usage": None
                 }
             
-            # For non-streaming response
-            response = await self.client.chat.completions.create(**request_params)
+            # With a deadline or a validator, stream internally so the partial answer can be
+            # returned when time runs out, or the generation stopped once the output is unusable
+            if deadline is not None or validator is not None:
+                result = await self._collect_stream(
+                    client, request_params, messages, model_to_use, start_time, deadline, validator
+                )
+                call.succeed()
+                if cache_key and result["finish_reason"] in ("stop", "tool_calls"):
+                    await answer_cache.put(cache_key, result["message"]["content"])
+                return result
             
-            # Process response
-            assistant_message = Message(
-                role="assistant",
-                content=response.choices[0].message.content
-            )
-            
-            # Extract token usage statistics
-            usage = TokenUsage(
-                prompt_tokens=response.usage.prompt_tokens,
-                completion_tokens=response.usage.completion_tokens,
-                total_tokens=response.usage.total_tokens
-            )
+            # For non-streaming response
+            response = await client.chat.completions.create(**request_params)
+            elapsed = time.perf_counter() - start_time
+            metrics.observe("upstream_request_seconds", elapsed, model=model_to_use)
+            choice = response.choices[0]
+            content = choice.message.content
+            # In tool calling mode the answer is carried by the function arguments
+            if choice.message.tool_calls:
+                content = choice.message.tool_calls[0].function.arguments
+            elif settings.reasoning_mode != "keep":
+                content = strip_reasoning(content)
+            usage = usage_to_dict(response.usage)
+            record_usage(usage, model=model_to_use)
+            recorder.record_response(messages, model_to_use, elapsed, response)
+            audit_log.record(messages, content, model=model_to_use, finish_reason=choice.finish_reason,
+                             usage=usage, latency=elapsed)
+            call.succeed(elapsed)
+            if cache_key and choice.finish_reason in ("stop", "tool_calls"):
+                await answer_cache.put(cache_key, content)
             
             return {
-                "message": assistant_message,
-                "usage": usage
+                "message": {
+                    "role": "assistant",
+                    "content": content
+                },
+                "usage": usage,
+                "finish_reason": choice.finish_reason
             }
             
         except RateLimitError as e:
+            # Throttling means the upstream is up and we are sending too much, which the
+            # circuit can't fix; it is not counted as a failure
+            call.release()
+            metrics.inc("upstream_errors_total", model=model_to_use, kind="rate_limit")
             logger.error(f"OpenAI API rate limit exceeded: {str(e)}")
             raise Exception("Rate limit exceeded, please try again later")
+        except BadRequestError as e:
+            metrics.inc("upstream_errors_total", model=model_to_use, kind="bad_request")
+            logger.error(f"OpenAI API rejected the request: {str(e)}")
+            raise UpstreamBadRequestError(f"API error: {str(e)}")
+        except APITimeoutError as e:
+            metrics.inc("upstream_errors_total", model=model_to_use, kind="timeout")
+            if deadline is not None and deadline.expired:
+                # The caller's budget ran out, which says nothing about upstream health
+                call.release()
+                logger.warning("Request deadline passed while waiting for the upstream")
+                raise DeadlineExceededError("Request deadline exceeded")
+            call.fail()
+            logger.error(f"OpenAI API request timed out: {str(e)}")
+            raise Exception("Request timed out, please try again")
         except APIError as e:
+            call.fail()
+            metrics.inc("upstream_errors_total", model=model_to_use, kind="api")
             logger.error(f"OpenAI API error: {str(e)}")
             raise Exception(f"API error: {str(e)}")
         except httpx.ReadTimeout:
+            call.fail()
+            metrics.inc("upstream_errors_total", model=model_to_use, kind="timeout")
             logger.error("Request to OpenAI API timed out")
             raise Exception("Request timed out, please try again")
+        except DeadlineExceededError:
+            call.release()
+            raise
+        except MalformedOutputError:
+            # The upstream answered, the answer just wasn't usable
+            call.succeed()
+            raise
         except Exception as e:
+            call.fail()
+            metrics.inc("upstream_errors_total", model=model_to_use, kind="other")
             logger.error(f"Unexpected error calling OpenAI API: {str(e)}")
             raise Exception(f"Error processing request: {str(e)}")
+        finally:
+            # Streams report their own outcome once consumed; a call without an outcome gives up its slot
+            if not handed_off:
+                call.release()
+            metrics.gauge_add("upstream_in_flight", -1)
+    
+    async def _collect_stream(
+        self,
+        client,
+        request_params: Dict[str, Any],
+        messages: List[Dict[str, str]],
+        model: str,
+        start_time: float,
+        deadline=None,
+        validator=None
+    ) -> Dict[str, Any]:
+        """
+        Run a non-streaming request as a stream that is cut off at the deadline
+        or as soon as the validator rejects the output
+        
+        Returns:
+            Same shape as a non-streaming completion, plus `truncated`
+        
+        Raises:
+            MalformedOutputError: If the validator rejected the output
+        """
+        request_params["stream"] = True
+        if settings.stream_include_usage:
+            request_params["extra_body"] = {"stream_options": {"include_usage": True}}
+        stream_response = await client.chat.completions.create(**request_params)
+        stream = recorder.wrap_stream(messages, model, start_time, stream_response)
+        if deadline is not None:
+            stream = DeadlineStream(stream, stream_response, deadline)
+        first = True
+        
+        content_parts = []
+        usage = None
+        finish_reason = None
+        async for chunk in stream:
+            if first:
+                load_monitor.observe_latency(time.perf_counter() - start_time)
+                first = False
+            usage = chunk_usage(chunk) or usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            # In tool calling mode the answer is carried by the function arguments
+            if choice.delta.tool_calls:
+                function = choice.delta.tool_calls[0].function
+                piece = (function.arguments or "") if function else ""
+            else:
+                piece = choice.delta.content or ""
+            content_parts.append(piece)
+            finish_reason = choice.finish_reason or finish_reason
+            problem = validator.feed(piece) if validator is not None and piece else None
+            if problem:
+                # Stop the upstream generating an answer that can't be used
+                response = getattr(stream_response, "response", None)
+                if response is not None:
+                    await response.aclose()
+                elapsed = time.perf_counter() - start_time
+                metrics.observe("malformed_output_abort_seconds", elapsed, model=model)
+                audit_log.record(messages, "".join(content_parts), model=model, finish_reason="malformed",
+                                 usage=usage, latency=elapsed)
+                logger.warning(f"Aborted generation after {validator.chars} chars ({elapsed:.2f}s): {problem}")
+                raise MalformedOutputError(problem)
+        truncated = deadline is not None and stream.truncated
+        
+        elapsed = time.perf_counter() - start_time
+        metrics.observe("upstream_request_seconds", elapsed, model=model)
+        record_usage(usage, model=model)
+        content = "".join(content_parts)
+        audit_log.record(messages, content, model=model, finish_reason="deadline" if truncated else finish_reason,
+                         usage=usage, latency=elapsed)
+        if settings.reasoning_mode != "keep":
+            content = strip_reasoning(content)
+        if truncated and not content:
+            raise DeadlineExceededError("Request deadline exceeded before any answer was generated")
+        
+        return {
+            "message": {
+                "role": "assistant",
+                "content": content
+            },
+            "usage": usage,
+            "finish_reason": "deadline" if truncated else finish_reason,
+            "truncated": truncated
+        }
+    
+    def _observe_budget(self, result: Dict[str, Any], intent: str, model: str, source: str) -> Dict[str, Any]:
+        """Report the completion length of an upstream answer to the token budget"""
+        if result.get("cached"):
+            return result
+        if result.get("stream") is not None:
+            result["stream"] = BudgetStream(result["stream"], intent, model, source)
+        elif result.get("usage"):
+            token_budget.observe(intent, model, result["usage"]["completion_tokens"], result.get("finish_reason"), source)
+        return result
     
     async def get_eye_doctor_completion(
         self,
-        request_data: Dict[str, Any],
+        request: EyeDoctorRequest,
         model: Optional[str] = None,
         temperature: float = 0.7,
         max_tokens: Optional[int] = None,
-        stream: bool = False
+        stream: bool = False,
+        history: Optional[list] = None,
+        prompt_variant: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Get specialized eye doctor chat completion response
         
         Args:
-            request_data: Dictionary containing patient information and question
+            request: Validated request containing patient information and question
             model: Model name to use, defaults to configured model
             temperature: Controls randomness in generation, defaults to 0.7
             max_tokens: Maximum number of tokens to generate, defaults to None
             stream: Whether to use streaming response, defaults to False
+            history: Session history to use instead of request.previous_conversations
+            prompt_variant: Prompt template variant, chosen from PROMPT_VARIANT by default
             
         Returns:
             Dictionary containing generated message and token usage statistics
@@ -129,133 +595,156 @@ class LLMService:
             Exception: Various exceptions related to API errors
         """
         try:
-            # Construct specialized prompt using prompt engineering
-            system_prompt, user_message = construct_prompt(request_data)
-            
-            # Create messages list
-            messages = [
-                Message(role="system", content=system_prompt),
-                Message(role="user", content=user_message)
-            ]
+            # Construct the upstream messages straight from the validated request
+            if prompt_variant is None:
+                prompt_variant = choose_prompt_variant(settings.prompt_variant, request.session_id)
+            metrics.inc("prompt_variant_requests_total", endpoint="eye_doctor", variant=prompt_variant)
+            messages = construct_messages(
+                request, layout=settings.prompt_layout, history=history, variant=prompt_variant
+            )
             
-            # Add previous conversation context if available
-            previous_conversations = request_data.get('previous_conversations', [])
-            if previous_conversations:
-                # Reset messages to just include system prompt
-                messages = [Message(role="system", content=system_prompt)]
-                
-                # Add each message from previous conversations
-                for msg in previous_conversations:
-                    role = msg.get('role')
-                    content = msg.get('content')
-                    if role in ['user', 'assistant'] and content:
-                        messages.append(Message(role=role, content=content))
-                
-                # Add the current user query at the end
-                messages.append(Message(role="user", content=user_message))
+            # Cap answers without a caller max_tokens at the adaptive budget of their intent
+            intent = classify_intent(request.question) or "general"
+            model_to_use = model or self.default_model
+            max_tokens, budget_source = token_budget.resolve(max_tokens, intent, model_to_use)
             
-            # Call the standard chat completion method
-            return await self.get_chat_completion(
+            result = await self._create_completion(
                 messages=messages,
                 model=model,
                 temperature=temperature,
                 max_tokens=max_tokens,
                 stream=stream
             )
+            return self._observe_budget(result, intent, model_to_use, budget_source)
             
+        except (DeadlineExceededError, CircuitOpenError):
+            raise
         except Exception as e:
             logger.error(f"Error in eye doctor completion: {str(e)}")
             raise Exception(f"Error processing eye doctor request: {str(e)}")
 
+    async def _request_recommendations(
+        self,
+        messages: List[Dict[str, str]],
+        mode: str,
+        stream: bool,
+        max_tokens: Optional[int],
+        temperature: float,
+        validator=None
+    ) -> Dict[str, Any]:
+        """Request recommendations in a structured output mode, falling back to prompt-only JSON if it is rejected"""
+        if (self.default_model, mode) in self._unsupported_structured_modes:
+            mode = "prompt"
+        try:
+            return await self._create_completion(
+                messages=messages,
+                temperature=temperature,
+                stream=stream,
+                max_tokens=max_tokens,  # Limit response length
+                extra_params=structured_output_params(mode),
+                validator=validator
+            )
+        except UpstreamBadRequestError:
+            if mode == "prompt":
+                raise
+            # Remember the rejection and fall back to prompt-only JSON
+            logger.warning(f"Structured output mode '{mode}' rejected by upstream, falling back to prompt mode")
+            self._unsupported_structured_modes.add((self.default_model, mode))
+            return await self._create_completion(
+                messages=messages,
+                temperature=temperature,
+                stream=stream,
+                max_tokens=max_tokens,
+                validator=validator
+            )
+
     async def get_eye_doctor_recommendations(
         self,
-        request_data: Dict[str, Any],
+        request: AIRecommendationRequest,
         stream: bool = False
     ) -> Dict[str, Any]:
         """
         Get AI-generated medication and treatment recommendations
         
         Args:
-            request_data: Dictionary containing patient and disease information
+            request: Validated request containing patient and disease information
             stream: Whether to use streaming response, defaults to False
             
         Returns:
-            Dictionary containing recommended medications and treatment plan
+            Dictionary containing recommended medications and treatment plan,
+            or the stream, together with the prompt variant used
             
         Raises:
             Exception: Various exceptions related to API errors
         """
         try:
             # Construct specialized prompt for recommendations
-            system_prompt, user_message = construct_recommendation_prompt(request_data)
-            
-            # Create messages list
-            messages = [
-                Message(role="system", content=system_prompt),
-                Message(role="user", content=user_message)
-            ]
-            
-            # Call the chat completion method with stricter parameters
-            result = await self.get_chat_completion(
-                messages=messages,
-                temperature=0.3,  # Lower temperature for more consistent output
-                stream=stream,
-                max_tokens=1000  # Limit response length
+            start_time = time.perf_counter()
+            variant = choose_prompt_variant(settings.prompt_variant)
+            metrics.inc("prompt_variant_requests_total", endpoint="recommendations", variant=variant)
+            messages = construct_recommendation_messages(request, variant)
+            max_tokens, budget_source = token_budget.resolve(
+                None, "recommendations", self.default_model, default=RECOMMENDATION_MAX_TOKENS
             )
             
-            if stream:
-                return {"stream": result["stream"]}
+            # Prefer the provider's structured output mode; tool calls can't be streamed as content
+            mode = settings.structured_output_mode
+            if stream and mode == "tool":
+                mode = "json_object"
             
-            # Parse and validate the response content
-            try:
-                content = result["message"].content.strip()
-                
-                # Try to find JSON content if there's any extra text
-                if content.find('{') != 0:
-                    start = content.find('{')
-                    end = content.rfind('}') + 1
-                    if start >= 0 and end > start:
-                        content = content[start:end]
-                
-                recommendations = json.loads(content)
-                
-                # Validate the structure
-                if not isinstance(recommendations, dict):
-                    raise ValueError("Response is not a JSON object")
-                
-                if "medications" not in recommendations or "treatment_plan" not in recommendations:
-                    raise ValueError("Missing required fields: medications or treatment_plan")
+            # Invalid answers are retried right away at temperature 0 with a format reminder
+            retries = 0 if stream else max(settings.recommendation_retries, 0)
+            for attempt in range(retries + 1):
+                if attempt:
+                    metrics.inc("recommendations_retries_total", variant=variant)
+                    messages = construct_recommendation_messages(request, variant, retry=True)
+                validator = RecommendationStreamValidator() if settings.recommendation_early_abort and not stream else None
+                try:
+                    result = await self._request_recommendations(
+                        messages, mode, stream, max_tokens,
+                        temperature=0.3 if attempt == 0 else 0.0,  # Lower temperature for more consistent output
+                        validator=validator
+                    )
+                except MalformedOutputError as e:
+                    metrics.inc("recommendations_aborted_total", variant=variant)
+                    error = f"Invalid recommendations format: {str(e)}"
+                    continue
+                result = self._observe_budget(result, "recommendations", self.default_model, budget_source)
                 
-                if not isinstance(recommendations["medications"], list):
-                    raise ValueError("medications must be an array")
+                if stream:
+                    return {"stream": result["stream"], "prompt_variant": variant}
                 
-                if not isinstance(recommendations["treatment_plan"], dict):
-                    raise ValueError("treatment_plan must be an object")
-                
-                # Validate medications
-                for med in recommendations["medications"]:
-                    required_fields = ["medication_name", "dosage", "frequency", "side_effects"]
-                    missing_fields = [f for f in required_fields if f not in med]
-                    if missing_fields:
-                        raise ValueError(f"Medication missing required fields: {', '.join(missing_fields)}")
-                
-                # Validate treatment plan
-                required_fields = ["treatment_type", "treatment_detail"]
-                missing_fields = [f for f in required_fields if f not in recommendations["treatment_plan"]]
-                if missing_fields:
-                    raise ValueError(f"Treatment plan missing required fields: {', '.join(missing_fields)}")
-                
-                return {"recommendations": recommendations}
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parsing recommendations JSON: {str(e)}")
-                logger.error(f"Raw content: {result['message'].content}")
-                raise Exception("Invalid JSON format in model response")
-            except ValueError as e:
-                logger.error(f"Invalid recommendations format: {str(e)}")
-                logger.error(f"Parsed content: {recommendations}")
-                raise Exception(f"Invalid recommendations format: {str(e)}")
+                # Validate the response, repairing truncated or malformed JSON locally
+                content = result["message"]["content"] or ""
+                try:
+                    recommendations, repaired = parse_recommendations(content)
+                    break
+                except ValueError as e:
+                    if result.get("truncated"):
+                        raise DeadlineExceededError("Request deadline exceeded before the recommendations were complete")
+                    logger.error(f"Invalid recommendations format: {str(e)}")
+                    logger.error(f"Raw content: {content}")
+                    metrics.inc("recommendations_invalid_total")
+                    error = str(e)
+                    if result.get("cached"):
+                        # A circuit fallback answer would be served again
+                        raise Exception(error)
+            else:
+                raise Exception(error)
+            
+            if repaired:
+                logger.warning(f"Repaired recommendations JSON (finish_reason={result.get('finish_reason')})")
+                metrics.inc("recommendations_repaired_total")
+            
+            if formulary.enabled:
+                formulary.check(recommendations)
+            
+            metrics.observe("recommendation_latency_seconds", time.perf_counter() - start_time, variant=variant)
+            record_usage(result.get("usage"), endpoint="recommendations", variant=variant)
+            return {"recommendations": recommendations, "prompt_variant": variant}
             
+        except (DeadlineExceededError, CircuitOpenError):
+            raise
         except Exception as e:
             logger.error(f"Error in eye doctor recommendations: {str(e)}")
             raise Exception(f"Error generating recommendations: {str(e)}")
@@ -0,0 +1,156 @@
+"""
+Model tiering for eye doctor questions.
+
+Tiers are configured fastest first, e.g. MODEL_TIERS="fast=deepseek-chat,primary=deepseek-r1".
+Each question is routed by the intent used for its specialized prompt: intents listed
+in INTENT_TIERS go to their tier, everything else (and any long question or long
+conversation) goes to the strongest tier. When the chosen tier's recent latency
+breaches the configured SLO, the request falls back to the next faster tier until
+the slow samples age out of the window.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from ..utils.config import settings
+from ..utils.metrics import metrics, percentile
+from ..utils.prompts import classify_intent
+
+logger = logging.getLogger(__name__)
+
+# Minimum recent samples before a tier can be considered in breach of its SLO
+SLO_MIN_SAMPLES = 5
+
+def parse_mapping(value: str) -> Dict[str, str]:
+    """Parse "key=value,key=value" into an ordered dict"""
+    mapping = {}
+    for item in value.split(","):
+        key, sep, val = item.partition("=")
+        if sep and key.strip() and val.strip():
+            mapping[key.strip()] = val.strip()
+    return mapping
+
+class ModelRouter:
+    """Pick a model tier per request and track per-tier latency against the SLO"""
+
+    def __init__(
+        self,
+        tiers: Dict[str, str],
+        intent_tiers: Dict[str, str],
+        long_question_chars: int,
+        long_history_turns: int,
+        slo_ttft_seconds: float,
+        slo_latency_seconds: float,
+        slo_percentile: float,
+        slo_window_seconds: float
+    ):
+        # (tier, kind) -> recent (timestamp, seconds) samples
+        self._samples: Dict[Tuple[str, str], deque] = {}
+        self._lock = threading.Lock()
+        self.configure(tiers, intent_tiers, long_question_chars, long_history_turns,
+                       slo_ttft_seconds, slo_latency_seconds, slo_percentile, slo_window_seconds)
+
+    def configure(
+        self,
+        tiers: Dict[str, str],
+        intent_tiers: Dict[str, str],
+        long_question_chars: int,
+        long_history_turns: int,
+        slo_ttft_seconds: float,
+        slo_latency_seconds: float,
+        slo_percentile: float,
+        slo_window_seconds: float
+    ):
+        """Apply tiering settings; latency samples of tiers that still exist are kept"""
+        self.tiers = tiers
+        self.tier_names = list(tiers)
+        self.intent_tiers = {intent: tier for intent, tier in intent_tiers.items() if tier in tiers}
+        self.long_question_chars = long_question_chars
+        self.long_history_turns = long_history_turns
+        self.slo = {"ttft": slo_ttft_seconds, "latency": slo_latency_seconds}
+        self.slo_percentile = slo_percentile
+        self.slo_window_seconds = slo_window_seconds
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.tiers)
+
+    def _recent_latency(self, tier: str, kind: str) -> Optional[float]:
+        """Percentile of the tier's samples inside the SLO window"""
+        cutoff = time.time() - self.slo_window_seconds
+        with self._lock:
+            samples = self._samples.get((tier, kind))
+            if not samples:
+                return None
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+            if len(samples) < SLO_MIN_SAMPLES:
+                return None
+            values = sorted(seconds for _, seconds in samples)
+        return percentile(values, self.slo_percentile)
+
+    def _in_breach(self, tier: str, kind: str) -> bool:
+        slo = self.slo[kind]
+        if not slo:
+            return False
+        recent = self._recent_latency(tier, kind)
+        return recent is not None and recent > slo
+
+    def route(self, request, history_turns: int = 0) -> Tuple[str, str]:
+        """
+        Choose the tier and model for an eye doctor request
+
+        Args:
+            request: Validated EyeDoctorRequest
+            history_turns: Number of conversation turns sent along with the question
+
+        Returns:
+            Tuple of (tier name, model name)
+        """
+        strongest = self.tier_names[-1]
+        if len(request.question) > self.long_question_chars or history_turns > self.long_history_turns:
+            tier, reason = strongest, "complexity"
+        else:
+            intent = classify_intent(request.question)
+            tier = self.intent_tiers.get(intent, strongest)
+            reason = f"intent:{intent}" if intent in self.intent_tiers else "default"
+
+        # Step down to faster tiers while the chosen one is over its SLO
+        kind = "ttft" if request.stream else "latency"
+        index = self.tier_names.index(tier)
+        while index > 0 and self._in_breach(self.tier_names[index], kind):
+            logger.warning(f"Model tier {self.tier_names[index]} over {kind} SLO, falling back")
+            index -= 1
+            reason = "slo_fallback"
+        tier = self.tier_names[index]
+
+        metrics.inc("model_tier_requests_total", tier=tier, reason=reason)
+        return tier, self.tiers[tier]
+
+    def observe(self, tier: str, kind: str, seconds: float):
+        """Record a time-to-first-token ("ttft") or full response ("latency") sample for a tier"""
+        metrics.observe(f"model_tier_{kind}_seconds", seconds, tier=tier)
+        with self._lock:
+            samples = self._samples.get((tier, kind))
+            if samples is None:
+                samples = self._samples[(tier, kind)] = deque(maxlen=256)
+            samples.append((time.time(), seconds))
+
+def router_settings() -> Dict[str, object]:
+    """ModelRouter arguments from the current settings"""
+    return dict(
+        tiers=parse_mapping(settings.model_tiers),
+        intent_tiers=parse_mapping(settings.intent_tiers),
+        long_question_chars=settings.route_long_question_chars,
+        long_history_turns=settings.route_long_history_turns,
+        slo_ttft_seconds=settings.model_slo_ttft_seconds,
+        slo_latency_seconds=settings.model_slo_latency_seconds,
+        slo_percentile=settings.model_slo_percentile,
+        slo_window_seconds=settings.model_slo_window_seconds
+    )
+
+# Create model router instance
+model_router = ModelRouter(**router_settings())
@@ -0,0 +1,284 @@
+"""
+OpenAI-compatible passthrough to the upstream chat completions API.
+
+The request body is forwarded with only the service defaults filled in (model,
+stream usage, deadline max_tokens), and the upstream response is relayed as the
+raw bytes it arrived in: SSE events are neither parsed nor re-encoded, so
+newlines, finish reasons, usage and any provider-specific fields reach the
+client unchanged and OpenAI SDK clients can use the service as their base URL.
+
+Only the last TAIL_BYTES of a stream are kept and parsed once it ends, for the
+usage and finish reason metrics. The upstream response is closed as soon as the
+client disconnects or the caller's deadline passes.
+"""
+
+import json
+import logging
+import time
+from typing import Dict, Any, Optional, Tuple
+
+import httpx
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+
+from ..utils.config import settings
+from ..utils.deadline import current_deadline
+from ..utils.load_monitor import load_monitor
+from ..utils.metrics import metrics
+from .audit_log import audit_log
+from .circuit_breaker import circuit_breakers
+from .llm_service import DeadlineExceededError, usage_to_dict, record_usage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+
+# Bytes kept from the end of a stream to read its usage and finish reason
+TAIL_BYTES = 8192
+
+# Upstream timeouts without a caller deadline (the OpenAI SDK defaults)
+UPSTREAM_TIMEOUT = httpx.Timeout(600.0, connect=5.0)
+
+def openai_error(status_code: int, message: str, error_type: str, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    """Error response in the OpenAI API format"""
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": error_type, "code": None}},
+        headers=headers
+    )
+
+def inspect_tail(tail: bytes) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Read the usage and finish reason from the last SSE events of a stream
+
+    Returns:
+        Tuple of (usage dict or None, finish reason or None)
+    """
+    usage = None
+    finish_reason = None
+    for event in reversed(tail.split(b"\n\n")):
+        event = event.strip()
+        if not event.startswith(b"data:"):
+            continue
+        data = event[5:].strip()
+        if data == b"[DONE]":
+            continue
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            # The first event of the tail may be cut off
+            continue
+        if usage is None and chunk.get("usage"):
+            usage = usage_to_dict(chunk["usage"])
+        for choice in chunk.get("choices") or ():
+            finish_reason = finish_reason or choice.get("finish_reason")
+        if usage is not None and finish_reason is not None:
+            break
+    return usage, finish_reason
+
+class RelayStream:
+    """
+    Upstream body bytes relayed to the client
+
+    The upstream call (circuit slot, in-flight gauge, HTTP response) ends when the
+    relay finishes or is closed; `aclose` also ends it when iteration never started.
+    """
+
+    def __init__(self, upstream: httpx.Response, call, model: str, start_time: float, deadline, messages):
+        self.upstream = upstream
+        self.call = call
+        self.model = model
+        self.start_time = start_time
+        self.deadline = deadline
+        self.messages = messages
+        self.result = "cancelled"
+        self._tail = b""
+        # The whole stream is only kept for the audit log, which parses it off the event loop
+        self._raw_parts = [] if audit_log.enabled else None
+        self._iterator = None
+        self._finished = False
+
+    def __aiter__(self):
+        self._iterator = self._iterate()
+        return self._iterator
+
+    async def _iterate(self):
+        """Yield the upstream body bytes, closing the upstream when the client goes away"""
+        first = True
+        try:
+            async for raw in self.upstream.aiter_raw():
+                if first:
+                    ttft = time.perf_counter() - self.start_time
+                    load_monitor.observe_latency(ttft)
+                    self.call.succeed(ttft)
+                    first = False
+                self._tail = (self._tail + raw)[-TAIL_BYTES:]
+                if self._raw_parts is not None:
+                    self._raw_parts.append(raw)
+                metrics.inc("passthrough_bytes_total", len(raw))
+                yield raw
+                if self.deadline is not None and self.deadline.expired:
+                    self.result = "deadline"
+                    break
+            else:
+                self.result = "completed"
+        except httpx.TimeoutException:
+            if self.deadline is not None and self.deadline.expired:
+                # The caller's budget ran out, which says nothing about upstream health
+                self.result = "deadline"
+            else:
+                self.call.fail()
+                self.result = "error"
+                logger.error("Passthrough stream from upstream timed out")
+        except httpx.HTTPError as e:
+            self.call.fail()
+            self.result = "error"
+            logger.error(f"Passthrough stream from upstream failed: {str(e)}")
+        finally:
+            await self._finish()
+
+    async def _finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        self.call.release()
+        metrics.gauge_add("upstream_in_flight", -1)
+        await self.upstream.aclose()
+        metrics.inc("passthrough_streams_total", result=self.result)
+        if self.result == "completed":
+            metrics.observe("upstream_request_seconds", time.perf_counter() - self.start_time, model=self.model)
+            usage, finish_reason = inspect_tail(self._tail)
+            record_usage(usage, model=self.model)
+            metrics.inc("passthrough_finish_total", reason=finish_reason or "unknown")
+        if self._raw_parts is not None:
+            audit_log.record(self.messages, None, model=self.model, source="passthrough",
+                             finish_reason=None if self.result == "completed" else self.result,
+                             latency=time.perf_counter() - self.start_time, sse=b"".join(self._raw_parts))
+
+    async def aclose(self):
+        """Stop relaying, or end the upstream call if the relay never started"""
+        if self._iterator is not None:
+            await self._iterator.aclose()
+        await self._finish()
+
+class PassthroughProxy:
+    """Forward chat completion requests to the upstream and relay its response bytes"""
+
+    def __init__(self):
+        self._client = httpx.AsyncClient(timeout=UPSTREAM_TIMEOUT)
+
+    async def forward(self, payload: Dict[str, Any]) -> Response:
+        """
+        Send an OpenAI chat completion request body upstream
+
+        Args:
+            payload: Request body; model defaults to MODEL_ID
+
+        Returns:
+            The upstream response: raw SSE bytes when streaming, the upstream
+            JSON otherwise, and the upstream status and error body on errors
+
+        Raises:
+            CircuitOpenError: If the upstream circuit is open
+            DeadlineExceededError: If the caller's deadline passed before the upstream answered
+        """
+        max_tokens = payload.get("max_tokens")
+        if max_tokens is not None and (not isinstance(max_tokens, int) or isinstance(max_tokens, bool)):
+            return openai_error(400, "max_tokens must be an integer", "invalid_request_error")
+        model = payload.setdefault("model", settings.openai_default_model)
+        stream = bool(payload.get("stream"))
+        deadline = current_deadline()
+        timeout = UPSTREAM_TIMEOUT
+        if deadline is not None:
+            payload["max_tokens"] = deadline.fit_max_tokens(max_tokens)
+            timeout = httpx.Timeout(max(deadline.remaining(), 0.001), connect=5.0)
+        if stream and settings.stream_include_usage:
+            payload.setdefault("stream_options", {"include_usage": True})
+
+        call = circuit_breakers.get(settings.openai_api_base, model).begin()
+        base_url = (settings.openai_api_base or DEFAULT_API_BASE).rstrip("/")
+        request = self._client.build_request(
+            "POST",
+            f"{base_url}/chat/completions",
+            json=payload,
+            headers={
+                "Authorization": f"Bearer {settings.openai_api_key}",
+                # Relay the bytes exactly as sent, without decompressing them here
+                "Accept-Encoding": "identity",
+            },
+            timeout=timeout
+        )
+        start_time = time.perf_counter()
+        metrics.gauge_add("upstream_in_flight", 1)
+        handed_off = False
+        try:
+            try:
+                upstream = await self._client.send(request, stream=True)
+            except httpx.TimeoutException:
+                metrics.inc("upstream_errors_total", model=model, kind="timeout")
+                if deadline is not None and deadline.expired:
+                    call.release()
+                    raise DeadlineExceededError("Request deadline exceeded")
+                call.fail()
+                return openai_error(504, "Upstream request timed out", "upstream_timeout")
+            except httpx.HTTPError as e:
+                call.fail()
+                metrics.inc("upstream_errors_total", model=model, kind="other")
+                logger.error(f"Passthrough request to upstream failed: {str(e)}")
+                return openai_error(502, f"Upstream request failed: {str(e)}", "upstream_error")
+            metrics.observe("upstream_open_seconds", time.perf_counter() - start_time, model=model)
+
+            if upstream.status_code >= 400:
+                body = await upstream.aread()
+                await upstream.aclose()
+                # Only server errors count against the circuit; a 429 is throttling of a healthy upstream
+                if upstream.status_code >= 500:
+                    call.fail()
+                else:
+                    call.release()
+                kind = {400: "bad_request", 429: "rate_limit"}.get(upstream.status_code, "api")
+                metrics.inc("upstream_errors_total", model=model, kind=kind)
+                logger.error(f"Upstream returned {upstream.status_code} to passthrough request: {body[:500]!r}")
+                return Response(body, status_code=upstream.status_code,
+                                media_type=upstream.headers.get("content-type", "application/json"))
+
+            if not stream:
+                body = await upstream.aread()
+                await upstream.aclose()
+                elapsed = time.perf_counter() - start_time
+                metrics.observe("upstream_request_seconds", elapsed, model=model)
+                call.succeed(elapsed)
+                try:
+                    completion = json.loads(body)
+                    usage = usage_to_dict(completion.get("usage"))
+                    record_usage(usage, model=model)
+                    if audit_log.enabled:
+                        choice = (completion.get("choices") or [{}])[0]
+                        audit_log.record(payload["messages"], (choice.get("message") or {}).get("content"), model=model,
+                                         source="passthrough", finish_reason=choice.get("finish_reason"),
+                                         usage=usage, latency=elapsed)
+                except (ValueError, AttributeError):
+                    pass
+                return Response(body, status_code=upstream.status_code,
+                                media_type=upstream.headers.get("content-type", "application/json"))
+
+            handed_off = True
+            relay = RelayStream(upstream, call, model, start_time, deadline, payload["messages"])
+            return StreamingResponse(
+                relay,
+                status_code=upstream.status_code,
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                # Ends the upstream call even if the client left before the relay started
+                background=BackgroundTask(relay.aclose)
+            )
+        finally:
+            if not handed_off:
+                call.release()
+                metrics.gauge_add("upstream_in_flight", -1)
+
+    async def close(self):
+        await self._client.aclose()
+
+# Create passthrough proxy instance
+passthrough_proxy = PassthroughProxy()
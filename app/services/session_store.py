@@ -0,0 +1,277 @@
+"""
+Server-side conversation history for eye doctor sessions.
+
+Callers that send a session_id only need to send the new question: the patient
+context and the conversation history are kept here. Sessions live in an in-memory
+LRU bounded by session count, messages and characters per session. Evicted
+sessions can optionally spill to a local SQLite file and are loaded back on the
+next request. The spill file is only touched by a dedicated thread, so its I/O
+never blocks the event loop; sessions idle beyond the TTL are removed from it.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+from ..models.eye_doctor import PatientMedication
+from ..utils.config import settings
+from ..utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Conversation turn, attribute-compatible with ConversationTurn
+SessionTurn = namedtuple("SessionTurn", ["role", "content"])
+
+# Seconds between removals of expired sessions from the spill file
+SPILL_PRUNE_INTERVAL = 60
+
+# Request fields kept as the session's patient context
+CONTEXT_FIELDS = ("disease_name", "disease_category", "result", "remark", "treatment_plan", "medications")
+
+class Session:
+    """Patient context and conversation turns of one session"""
+
+    __slots__ = ("context", "turns", "chars", "updated_at")
+
+    def __init__(self, context: Dict[str, Any], turns: List[SessionTurn]):
+        self.context = context
+        self.turns = turns
+        self.chars = sum(len(turn.content) for turn in turns)
+        self.updated_at = time.time()
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {"context": self.context, "turns": self.turns},
+            ensure_ascii=False,
+            default=lambda obj: obj.model_dump()
+        )
+
+    @classmethod
+    def from_json(cls, data: str) -> "Session":
+        raw = json.loads(data)
+        context = raw["context"]
+        if context.get("medications"):
+            context["medications"] = [PatientMedication(**med) for med in context["medications"]]
+        return cls(context, [SessionTurn(*turn) for turn in raw["turns"]])
+
+class SessionStore:
+    """In-memory LRU of sessions with an optional SQLite spill"""
+
+    def __init__(self, max_sessions: int, max_turns: int, max_chars: int, ttl_seconds: int, spill_path: str = ""):
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.ttl_seconds = ttl_seconds
+        self.spill_path = spill_path
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._pruned_at = 0.0
+        # One thread runs every spill call in submission order, so a read always
+        # sees the writes submitted before it
+        self._spill = None
+        if spill_path:
+            self._spill = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-spill")
+            # Remove sessions that expired while the service was down
+            self._spill.submit(self._write_spilled, [])
+
+    def _expired(self, updated_at: float) -> bool:
+        return bool(self.ttl_seconds) and time.time() - updated_at > self.ttl_seconds
+
+    def _get(self, session_id: str) -> Optional[Session]:
+        """Return the in-memory session, promoting it to most recent"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if self._expired(session.updated_at):
+            del self._sessions[session_id]
+            metrics.inc("sessions_expired_total")
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    async def _load(self, session_id: str) -> Optional[Session]:
+        """Return the session from memory or the spill file, promoting it to most recent"""
+        with self._lock:
+            session = self._get(session_id)
+        if session is not None or self._spill is None:
+            return session
+        try:
+            spilled = await asyncio.get_running_loop().run_in_executor(self._spill, self._take_spilled, session_id)
+        except Exception as e:
+            metrics.inc("session_spill_errors_total")
+            logger.error(f"Failed to load session {session_id} from the spill file: {str(e)}")
+            return None
+        with self._lock:
+            # Another request may have loaded or created the session meanwhile
+            session = self._get(session_id)
+            if session is None and spilled is not None:
+                session = self._sessions[session_id] = spilled
+                metrics.inc("session_spill_loads_total")
+                self._evict()
+        return session
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.spill_path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+            self._db.commit()
+        return self._db
+
+    def _take_spilled(self, session_id: str) -> Optional[Session]:
+        """Remove a session from the spill file and return it unless it expired (spill thread)"""
+        db = self._connect()
+        row = db.execute("SELECT data, updated_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        with db:
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        if self._expired(row[1]):
+            metrics.inc("sessions_expired_total")
+            return None
+        session = Session.from_json(row[0])
+        session.updated_at = row[1]
+        return session
+
+    def _write_spilled(self, sessions: List[Tuple[str, Session]]):
+        """Write evicted sessions in one transaction and prune expired ones (spill thread)"""
+        try:
+            db = self._connect()
+            now = time.time()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO sessions (id, data, updated_at) VALUES (?, ?, ?)",
+                    [(session_id, session.to_json(), session.updated_at) for session_id, session in sessions]
+                )
+                if self.ttl_seconds and now - self._pruned_at >= SPILL_PRUNE_INTERVAL:
+                    self._pruned_at = now
+                    pruned = db.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl_seconds,)).rowcount
+                    metrics.inc("sessions_expired_total", pruned)
+        except sqlite3.Error as e:
+            metrics.inc("session_spill_errors_total")
+            logger.error(f"Failed to spill {len(sessions)} sessions: {str(e)}")
+
+    def _append_spilled(self, session_id: str, question: str, answer: str):
+        """Append a question/answer pair to a spilled session (spill thread)"""
+        try:
+            session = self._take_spilled(session_id)
+        except Exception as e:
+            metrics.inc("session_spill_errors_total")
+            logger.error(f"Failed to load session {session_id} from the spill file: {str(e)}")
+            return
+        if session is not None:
+            self._add_turns(session, question, answer)
+            self._write_spilled([(session_id, session)])
+
+    def resize(self, max_sessions: int, max_turns: int, max_chars: int, ttl_seconds: int):
+        """Change the limits; sessions beyond the new size are evicted (and spilled), turn limits apply on the next append"""
+        with self._lock:
+            self.max_sessions = max_sessions
+            self.max_turns = max_turns
+            self.max_chars = max_chars
+            self.ttl_seconds = ttl_seconds
+            self._evict()
+
+    def _evict(self):
+        """Evict least recently used sessions beyond the size limit, spilling live ones if configured"""
+        evicted = []
+        while len(self._sessions) > self.max_sessions:
+            session_id, session = self._sessions.popitem(last=False)
+            metrics.inc("session_evictions_total")
+            if not self._expired(session.updated_at):
+                evicted.append((session_id, session))
+        if evicted and self._spill is not None:
+            self._spill.submit(self._write_spilled, evicted)
+        metrics.set_gauge("sessions_in_memory", len(self._sessions))
+
+    async def prepare(self, request) -> Tuple[Any, List[SessionTurn]]:
+        """
+        Merge a delta request with its stored session
+
+        Context fields sent with the request replace the stored ones. Conversation
+        history sent with the first request of a session seeds the stored history.
+
+        Returns:
+            Tuple of (request with the complete patient context, conversation history)
+
+        Raises:
+            ValueError: If the session is unknown and the request lacks patient context
+        """
+        session = await self._load(request.session_id)
+        sent = {field: getattr(request, field) for field in CONTEXT_FIELDS if getattr(request, field) is not None}
+        with self._lock:
+            if session is None:
+                session = self._get(request.session_id)
+            if session is None:
+                missing = [f for f in ("disease_name", "disease_category", "result") if f not in sent]
+                if missing:
+                    raise ValueError(f"Unknown session {request.session_id}, missing fields: {', '.join(missing)}")
+                seed = [
+                    SessionTurn(turn.role, turn.content)
+                    for turn in request.previous_conversations or ()
+                    if turn.role in ('user', 'assistant') and turn.content
+                ]
+                session = Session({}, seed)
+                self._trim(session)
+                self._sessions[request.session_id] = session
+                metrics.inc("sessions_created_total")
+
+            if sent:
+                session.context.update(sent)
+            history = list(session.turns)
+            missing_context = {f: v for f, v in session.context.items() if getattr(request, f) is None}
+            self._evict()
+
+        if missing_context:
+            request = request.model_copy(update=missing_context)
+        return request, history
+
+    def append(self, session_id: str, question: str, answer: str):
+        """Append a question/answer pair, trimming the oldest messages beyond the limits"""
+        with self._lock:
+            session = self._get(session_id)
+            if session is not None:
+                self._add_turns(session, question, answer)
+                return
+        # Evicted while the answer was generated
+        if self._spill is not None:
+            self._spill.submit(self._append_spilled, session_id, question, answer)
+
+    def _add_turns(self, session: Session, question: str, answer: str):
+        session.turns.append(SessionTurn("user", question))
+        session.turns.append(SessionTurn("assistant", answer))
+        session.chars += len(question) + len(answer)
+        session.updated_at = time.time()
+        self._trim(session)
+
+    def _trim(self, session: Session):
+        """Drop the oldest messages beyond the limits, keeping the latest question and answer"""
+        turns = session.turns
+        while len(turns) > 2 and (len(turns) > self.max_turns or session.chars > self.max_chars):
+            session.chars -= len(turns.pop(0).content)
+        # The history should still start with a question
+        while len(turns) > 2 and turns[0].role != "user":
+            session.chars -= len(turns.pop(0).content)
+
+    def close(self):
+        """Finish pending spill writes (blocking, run it in a thread)"""
+        if self._spill is not None:
+            self._spill.shutdown(wait=True)
+
+# Create session store instance
+session_store = SessionStore(
+    max_sessions=settings.session_max_sessions,
+    max_turns=settings.session_max_turns,
+    max_chars=settings.session_max_chars,
+    ttl_seconds=settings.session_ttl_seconds,
+    spill_path=settings.session_spill_path
+)
@@ -0,0 +1,147 @@
+"""
+Adaptive max_tokens for requests that don't set one.
+
+The completion length of every finished answer is kept per (intent, model),
+where the intent is the specialized prompt family of an eye doctor question
+("general" without one) or "recommendations". Once enough answers have been
+seen, requests without a caller max_tokens are capped at a high percentile of
+those lengths plus headroom, so a runaway generation can't hold a connection
+for minutes while normal answers are not clipped. Completions and truncations
+(finish_reason "length") are counted per max_tokens source to tune the policy.
+"""
+
+import math
+import threading
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from ..utils.config import settings
+from ..utils.metrics import metrics, percentile
+
+# Where the max_tokens of a call came from
+CALLER = "caller"
+ADAPTIVE = "adaptive"
+FIXED = "fixed"
+UNLIMITED = "none"
+
+# Finish reasons of answers that ended on their own
+COMPLETE_REASONS = ("stop", "tool_calls")
+
+class TokenBudget:
+    """Track completion lengths per (intent, model) and derive max_tokens from them"""
+
+    def __init__(
+        self,
+        budget_percentile: float,
+        headroom: float,
+        min_samples: int,
+        window: int,
+        min_tokens: int,
+        max_tokens: int
+    ):
+        self._samples: Dict[Tuple[str, str], deque] = {}
+        self._lock = threading.Lock()
+        self.configure(budget_percentile, headroom, min_samples, window, min_tokens, max_tokens)
+
+    def configure(
+        self,
+        budget_percentile: float,
+        headroom: float,
+        min_samples: int,
+        window: int,
+        min_tokens: int,
+        max_tokens: int
+    ):
+        """Apply budget settings; recorded samples are kept (the most recent ones if the window shrinks)"""
+        self.budget_percentile = budget_percentile
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        if getattr(self, "window", None) != window:
+            self.window = window
+            with self._lock:
+                self._samples = {key: deque(samples, maxlen=window) for key, samples in self._samples.items()}
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_percentile > 0 and self.window > 0
+
+    def limit(self, intent: str, model: str) -> Optional[int]:
+        """Adaptive max_tokens for (intent, model), or None until enough samples were seen"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            samples = self._samples.get((intent, model))
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            values = sorted(samples)
+        budget = math.ceil(percentile(values, self.budget_percentile) * (1 + self.headroom))
+        budget = max(self.min_tokens, budget)
+        if self.max_tokens:
+            budget = min(self.max_tokens, budget)
+        metrics.set_gauge("token_budget_max_tokens", budget, intent=intent, model=model)
+        return budget
+
+    def resolve(self, requested: Optional[int], intent: str, model: str,
+                default: Optional[int] = None) -> Tuple[Optional[int], str]:
+        """
+        Choose the max_tokens of a call
+
+        Args:
+            requested: max_tokens set by the caller, which always wins
+            intent: Intent the completion length is tracked under
+            model: Model the call goes to
+            default: max_tokens to use while no adaptive budget is available
+
+        Returns:
+            Tuple of (max_tokens or None, source: caller, adaptive, fixed or none)
+        """
+        if requested is not None:
+            return requested, CALLER
+        budget = self.limit(intent, model)
+        if budget is not None:
+            return budget, ADAPTIVE
+        return default, FIXED if default is not None else UNLIMITED
+
+    def observe(self, intent: str, model: str, completion_tokens: Optional[int], finish_reason: Optional[str],
+                source: str):
+        """
+        Record the outcome of a finished completion
+
+        Answers cut off by a caller or fixed limit or by a deadline are counted
+        but not sampled, since their real length is unknown; answers cut off by
+        the adaptive budget are sampled at the budget, which the headroom lets
+        grow again. Answers without a reported length (completion_tokens None)
+        are only counted.
+        """
+        truncated = finish_reason == "length"
+        metrics.inc("completions_total", intent=intent, model=model, max_tokens=source)
+        if truncated:
+            metrics.inc("completions_truncated_total", intent=intent, model=model, max_tokens=source)
+        if completion_tokens is None:
+            return
+        metrics.observe("completion_tokens", completion_tokens, intent=intent, model=model)
+        if finish_reason not in COMPLETE_REASONS and not (truncated and source == ADAPTIVE):
+            return
+        if not self.window:
+            return
+        with self._lock:
+            samples = self._samples.get((intent, model))
+            if samples is None:
+                samples = self._samples[(intent, model)] = deque(maxlen=self.window)
+            samples.append(completion_tokens)
+
+def token_budget_settings() -> Dict[str, object]:
+    """TokenBudget arguments from the current settings"""
+    return dict(
+        budget_percentile=settings.token_budget_percentile,
+        headroom=settings.token_budget_headroom,
+        min_samples=settings.token_budget_min_samples,
+        window=settings.token_budget_window,
+        min_tokens=settings.token_budget_min_tokens,
+        max_tokens=settings.token_budget_max_tokens
+    )
+
+# Create token budget instance
+token_budget = TokenBudget(**token_budget_settings())
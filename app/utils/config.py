@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 import os
 import socket
 
@@ -18,6 +18,9 @@ def get_local_ip():
         return os.getenv("LOCAL_IP", "")
 
 class Settings(BaseModel):
+    # Field names follow the env var names, so MODEL_* settings may start with "model_"
+    model_config = ConfigDict(protected_namespaces=())
+
     # OpenAI API configuration
     openai_api_key: str = os.getenv("API_KEY", "")
     openai_default_model: str = os.getenv("MODEL_ID", "deepseek-ai/DeepSeek-R1/lcqfpp5osj")
@@ -39,6 +42,139 @@ class Settings(BaseModel):
 
     local_ip: str = get_local_ip()
 
+    # Eye doctor prompt layout: legacy or prefix (stable prefix for upstream prompt caching)
+    prompt_layout: str = os.getenv("PROMPT_LAYOUT", "legacy")
+    # Prompt template variant: default, compact, or an A/B split such as "default=80,compact=20"
+    prompt_variant: str = os.getenv("PROMPT_VARIANT", "default")
+    # Ask the upstream to append a usage chunk to streamed responses
+    stream_include_usage: bool = os.getenv("STREAM_INCLUDE_USAGE", "false").lower() == "true"
+    # Stream /api/chat/completions as the upstream's raw OpenAI SSE events instead of "data: {content}"
+    chat_stream_passthrough: bool = os.getenv("CHAT_STREAM_PASSTHROUGH", "false").lower() == "true"
+
+    # Reasoning output of R1-style models in streams: drop, event (separate SSE events) or keep
+    reasoning_mode: str = os.getenv("REASONING_MODE", "drop")
+
+    # Caller deadlines (X-Request-Deadline / X-Request-Timeout): time kept back for delivering
+    # the response, and the generation speed used to fit max_tokens into the remaining time
+    deadline_reserve_ms: int = int(os.getenv("DEADLINE_RESERVE_MS", "200"))
+    deadline_tokens_per_second: float = float(os.getenv("DEADLINE_TOKENS_PER_SECOND", "20"))
+
+    # Asynchronous recommendation jobs: worker count, queue capacity, result retention and long-poll cap
+    job_workers: int = Field(int(os.getenv("JOB_WORKERS", "4")), ge=1)
+    job_queue_size: int = Field(int(os.getenv("JOB_QUEUE_SIZE", "100")), ge=1)
+    job_ttl_seconds: int = int(os.getenv("JOB_TTL_SECONDS", "600"))
+    job_max_wait_seconds: float = float(os.getenv("JOB_MAX_WAIT_SECONDS", "30"))
+
+    # WebSocket connections: concurrent conversations per connection and outgoing message buffer
+    ws_max_streams: int = int(os.getenv("WS_MAX_STREAMS", "8"))
+    ws_send_queue_size: int = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+
+    # Load-aware instance weight published to Nacos: capacity references for the load score (0 = unbounded),
+    # minimum weight change before republishing, the weight of a saturated instance and the update interval
+    load_max_in_flight: int = int(os.getenv("LOAD_MAX_IN_FLIGHT", "50"))
+    load_latency_target_seconds: float = float(os.getenv("LOAD_LATENCY_TARGET_SECONDS", "15"))
+    load_weight_hysteresis: float = float(os.getenv("LOAD_WEIGHT_HYSTERESIS", "0.2"))
+    load_min_weight: float = float(os.getenv("LOAD_MIN_WEIGHT", "0.1"))
+    load_update_seconds: float = float(os.getenv("LOAD_UPDATE_SECONDS", "2"))
+
+    # Upstream circuit breaker per (BASE_URL, model): opens when at least CIRCUIT_MIN_REQUESTS calls in
+    # the window fail or are slow (time to first token for streams, full duration otherwise) at the given rate
+    circuit_window_seconds: float = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "30"))
+    circuit_min_requests: int = int(os.getenv("CIRCUIT_MIN_REQUESTS", "10"))
+    circuit_failure_rate: float = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+    circuit_slow_seconds: float = float(os.getenv("CIRCUIT_SLOW_SECONDS", "60"))
+    circuit_open_seconds: int = int(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+    # Recent answers served while the circuit is open (0 disables)
+    answer_cache_size: int = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+    answer_cache_ttl_seconds: int = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+    # Cache shared by all workers behind the in-process one: none, sqlite (one host) or redis (networked)
+    cache_l2_backend: str = os.getenv("CACHE_L2_BACKEND", "none")
+    cache_l2_max_entries: int = int(os.getenv("CACHE_L2_MAX_ENTRIES", "100000"))
+    cache_l2_ttl_seconds: int = int(os.getenv("CACHE_L2_TTL_SECONDS", "86400"))
+    # SQLite eviction beyond CACHE_L2_MAX_ENTRIES: lru or fifo (the redis server evicts by its own policy)
+    cache_l2_eviction: str = os.getenv("CACHE_L2_EVICTION", "lru")
+    cache_sqlite_path: str = os.getenv("CACHE_SQLITE_PATH", "answer_cache.db")
+    cache_redis_url: str = os.getenv("CACHE_REDIS_URL", "redis://127.0.0.1:6379/0")
+    cache_redis_timeout_seconds: float = float(os.getenv("CACHE_REDIS_TIMEOUT_SECONDS", "0.2"))
+
+    # Token required in the X-Admin-Token header by the /admin endpoints (empty disables them)
+    admin_token: str = os.getenv("ADMIN_TOKEN", "")
+    profile_max_seconds: float = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+    # Event loop lag sampling interval and the blocking time that gets the loop stack logged (0 disables)
+    loop_lag_interval_seconds: float = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+    loop_lag_threshold_seconds: float = float(os.getenv("LOOP_LAG_THRESHOLD_SECONDS", "0.2"))
+
+    # Runtime settings from a Nacos config data ID and/or a local file (KEY=VALUE like .env, empty to disable)
+    config_data_id: str = os.getenv("CONFIG_DATA_ID", "")
+    config_group: str = os.getenv("CONFIG_GROUP", "DEFAULT_GROUP")
+    config_file: str = os.getenv("CONFIG_FILE", "")
+    config_file_poll_seconds: float = float(os.getenv("CONFIG_FILE_POLL_SECONDS", "5"))
+    # Config changes kept for GET /config/history, optionally also appended to a JSONL audit file
+    config_history_size: int = int(os.getenv("CONFIG_HISTORY_SIZE", "100"))
+    config_audit_path: str = os.getenv("CONFIG_AUDIT_PATH", "")
+
+    # Idempotency-Key support: recorded responses kept (0 disables) and how long after completion
+    idempotency_max_entries: int = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+    idempotency_ttl_seconds: int = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+
+    # Drug formulary for checking recommended medications (JSON file, empty to disable);
+    # unknown medications are flagged or dropped
+    formulary_path: str = os.getenv("FORMULARY_PATH", "")
+    formulary_refresh_seconds: int = int(os.getenv("FORMULARY_REFRESH_SECONDS", "300"))
+    formulary_unknown_action: str = os.getenv("FORMULARY_UNKNOWN_ACTION", "flag")
+
+    # Server-side session history (callers send only the new question with a session_id)
+    session_max_sessions: int = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+    session_max_turns: int = int(os.getenv("SESSION_MAX_TURNS", "40"))
+    session_max_chars: int = int(os.getenv("SESSION_MAX_CHARS", "20000"))
+    session_ttl_seconds: int = int(os.getenv("SESSION_TTL_SECONDS", "86400"))
+    session_spill_path: str = os.getenv("SESSION_SPILL_PATH", "")
+
+    # Model tiering for eye doctor questions, fastest tier first (empty to always use MODEL_ID)
+    model_tiers: str = os.getenv("MODEL_TIERS", "")
+    intent_tiers: str = os.getenv("INTENT_TIERS", "prevention=fast,explanation=fast")
+    route_long_question_chars: int = int(os.getenv("ROUTE_LONG_QUESTION_CHARS", "200"))
+    route_long_history_turns: int = int(os.getenv("ROUTE_LONG_HISTORY_TURNS", "6"))
+    # Latency SLO per tier (0 disables), evaluated at a percentile over a sliding window
+    model_slo_ttft_seconds: float = float(os.getenv("MODEL_SLO_TTFT_SECONDS", "0"))
+    model_slo_latency_seconds: float = float(os.getenv("MODEL_SLO_LATENCY_SECONDS", "0"))
+    model_slo_percentile: float = float(os.getenv("MODEL_SLO_PERCENTILE", "90"))
+    model_slo_window_seconds: float = float(os.getenv("MODEL_SLO_WINDOW_SECONDS", "60"))
+
+    # Adaptive max_tokens when the caller sets none: percentile of recent completion lengths per
+    # (intent, model) plus headroom (percentile 0 disables), once min_samples answers were seen
+    token_budget_percentile: float = float(os.getenv("TOKEN_BUDGET_PERCENTILE", "99"))
+    token_budget_headroom: float = float(os.getenv("TOKEN_BUDGET_HEADROOM", "0.25"))
+    token_budget_min_samples: int = int(os.getenv("TOKEN_BUDGET_MIN_SAMPLES", "50"))
+    token_budget_window: int = int(os.getenv("TOKEN_BUDGET_WINDOW", "500"))
+    token_budget_min_tokens: int = int(os.getenv("TOKEN_BUDGET_MIN_TOKENS", "256"))
+    token_budget_max_tokens: int = int(os.getenv("TOKEN_BUDGET_MAX_TOKENS", "4096"))
+
+    # Structured output for recommendations: json_object, tool or prompt
+    structured_output_mode: str = os.getenv("STRUCTURED_OUTPUT_MODE", "json_object")
+    # Generate recommendations as an internal stream and abort as soon as the output can't match the schema
+    recommendation_early_abort: bool = os.getenv("RECOMMENDATION_EARLY_ABORT", "true").lower() == "true"
+    # Immediate retries of aborted or invalid recommendations, at temperature 0 with a format reminder
+    recommendation_retries: int = int(os.getenv("RECOMMENDATION_RETRIES", "1"))
+
+    # Precomputed FAQ answers (JSON file from precompute_faq.py, empty to disable)
+    faq_store_path: str = os.getenv("FAQ_STORE_PATH", "")
+    faq_refresh_seconds: int = int(os.getenv("FAQ_REFRESH_SECONDS", "300"))
+
+    # Traffic recording (JSONL file, empty to disable)
+    record_path: str = os.getenv("RECORD_PATH", "")
+
+    # Audit log of every prompt and answer (directory of compressed segments, empty to disable)
+    audit_path: str = os.getenv("AUDIT_PATH", "")
+    # Segment compression: gzip, or zstd (needs the zstandard package, falls back to gzip without it)
+    audit_compression: str = os.getenv("AUDIT_COMPRESSION", "gzip")
+    # A new segment is started once the current one holds this many uncompressed bytes or is this old
+    audit_segment_max_bytes: int = int(os.getenv("AUDIT_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+    audit_segment_max_seconds: int = int(os.getenv("AUDIT_SEGMENT_MAX_SECONDS", "3600"))
+    # Records waiting for the writer (more are dropped and counted) and the writer's flush interval
+    audit_buffer_size: int = int(os.getenv("AUDIT_BUFFER_SIZE", "10000"))
+    audit_flush_seconds: float = float(os.getenv("AUDIT_FLUSH_SECONDS", "1.0"))
+
 
 
 
@@ -47,4 +183,7 @@ settings = Settings()
 
 # Validate required configuration
 if not settings.openai_api_key:
-    raise ValueError("API_KEY must be set in .env file or environment variables") 
\ No newline at end of file
+    raise ValueError("API_KEY must be set in .env file or environment variables")
+# Defaults are not validated by pydantic; an unbounded job queue would accept jobs without limit
+if settings.job_workers < 1 or settings.job_queue_size < 1:
+    raise ValueError("JOB_WORKERS and JOB_QUEUE_SIZE must be at least 1") 
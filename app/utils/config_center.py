@@ -0,0 +1,252 @@
+"""
+Runtime settings from the Nacos config center.
+
+The service subscribes to a Nacos config data ID (CONFIG_DATA_ID) whose content
+uses the same KEY=VALUE format and names as the .env file. A local file
+(CONFIG_FILE) in the same format can be watched instead of, or in addition to,
+Nacos (Nacos values win). Every change is validated as a whole against Settings,
+then the changed fields are swapped into the shared settings object in one step
+and the listeners push them into the components that copied them at startup
+(upstream client, caches, router, breakers...). Keys removed from the config
+revert to their startup value. Every change attempt is kept in an audit history.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+from collections import deque
+from urllib.parse import urlsplit, urlunsplit
+from datetime import datetime, timezone
+from typing import Callable, Dict, Any, List, Optional, Set
+
+from dotenv import dotenv_values
+from nacos import NacosClient
+from pydantic import ValidationError
+
+from .config import Settings, settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Env var names that differ from the Settings field names
+ENV_ALIASES = {
+    "API_KEY": "openai_api_key",
+    "MODEL_ID": "openai_default_model",
+    "BASE_URL": "openai_api_base",
+}
+
+# Settings that only take effect at startup; changes are recorded but not applied
+RESTART_FIELDS = {
+    "host", "port", "local_ip",
+    "nacos_server_address", "nacos_namespace", "nacos_service_name", "nacos_group_name", "nacos_port",
+    "job_workers", "job_queue_size", "session_spill_path",
+    "config_data_id", "config_group", "config_file", "config_file_poll_seconds",
+    "config_history_size", "config_audit_path",
+    "cache_l2_backend", "cache_l2_eviction", "cache_sqlite_path", "cache_redis_url", "cache_redis_timeout_seconds",
+    "audit_path", "audit_compression", "audit_segment_max_bytes", "audit_segment_max_seconds",
+    "audit_buffer_size", "audit_flush_seconds",
+}
+
+# Sources in increasing priority
+SOURCES = ("file", "nacos")
+
+# Settings that are secrets as a whole
+SECRET_FIELDS = {"openai_api_key", "admin_token"}
+
+# URL settings that may carry a password
+URL_SECRET_FIELDS = {"cache_redis_url"}
+
+def mask_url_password(url: str) -> str:
+    """Replace the password of a URL with ***"""
+    parts = urlsplit(url)
+    if parts.password is None:
+        return url
+    netloc = f"{parts.username or ''}:***@{parts.netloc.rpartition('@')[2]}"
+    return urlunsplit(parts._replace(netloc=netloc))
+
+def audit_value(field: str, value: Any) -> Any:
+    """Value as shown in the audit history, with secrets masked"""
+    if not value:
+        return value
+    if field in SECRET_FIELDS:
+        return "***"
+    if field in URL_SECRET_FIELDS:
+        return mask_url_password(str(value))
+    return value
+
+def parse_config(content: str) -> Dict[str, str]:
+    """Parse KEY=VALUE config content into Settings field names and raw values"""
+    values = dotenv_values(stream=io.StringIO(content or ""))
+    return {ENV_ALIASES.get(key, key.lower()): value for key, value in values.items() if value is not None}
+
+class ConfigCenter:
+    """Apply config center changes to the shared settings and keep an audit history"""
+
+    def __init__(self, history_size: int, audit_path: str = ""):
+        self.version = 0
+        self.history = deque(maxlen=history_size)
+        self.audit_path = audit_path
+        self._baseline = settings.model_dump()
+        self._overrides: Dict[str, Dict[str, str]] = {}
+        self._listeners: List[Callable[[Set[str]], None]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._file_mtime: Optional[float] = None
+        self._nacos_client = None
+
+    def add_listener(self, callback: Callable[[Set[str]], None]):
+        """Register a callback receiving the names of the settings that changed"""
+        self._listeners.append(callback)
+
+    def apply(self, source: str, content: str) -> Dict[str, Any]:
+        """
+        Apply the full config content of one source
+
+        Args:
+            source: "file" or "nacos"
+            content: KEY=VALUE config text
+
+        Returns:
+            The audit record of the change
+        """
+        record = {
+            "version": None,
+            "source": source,
+            "received_at": datetime.now(timezone.utc).isoformat(),
+            "md5": hashlib.md5((content or "").encode("utf-8")).hexdigest(),
+            "changes": {},
+            "restart_required": [],
+            "unknown": [],
+            "error": None,
+        }
+        overrides = parse_config(content)
+        record["unknown"] = sorted(key for key in overrides if key not in Settings.model_fields)
+
+        merged_overrides = {**self._overrides, source: overrides}
+        candidate = dict(self._baseline)
+        for name in SOURCES:
+            candidate.update({k: v for k, v in merged_overrides.get(name, {}).items() if k in Settings.model_fields})
+        try:
+            new_settings = Settings.model_validate(candidate)
+            if not new_settings.openai_api_key:
+                raise ValueError("API_KEY must not be empty")
+        except (ValidationError, ValueError) as e:
+            record["error"] = str(e)
+            logger.error(f"Rejected config from {source}: {str(e)}")
+            metrics.inc("config_changes_total", source=source, result="rejected")
+            return self._audit(record)
+
+        self._overrides = merged_overrides
+        changed = {}
+        for field in Settings.model_fields:
+            old, new = getattr(settings, field), getattr(new_settings, field)
+            if old == new:
+                continue
+            if field in RESTART_FIELDS:
+                record["restart_required"].append(field)
+                continue
+            changed[field] = new
+            record["changes"][field] = {"old": audit_value(field, old), "new": audit_value(field, new)}
+
+        if changed:
+            # Swap all changed fields in one step so readers never see half of a change
+            settings.__dict__.update(changed)
+            for listener in self._listeners:
+                try:
+                    listener(set(changed))
+                except Exception as e:
+                    logger.error(f"Error applying settings change {sorted(changed)}: {str(e)}")
+            self.version += 1
+            record["version"] = self.version
+            logger.warning(f"Applied config version {self.version} from {source}: {json.dumps(record['changes'], ensure_ascii=False)}")
+        if record["restart_required"]:
+            logger.warning(f"Config from {source} changes settings that need a restart: {', '.join(record['restart_required'])}")
+        metrics.inc("config_changes_total", source=source, result="applied" if changed else "unchanged")
+        metrics.set_gauge("config_version", self.version)
+        return self._audit(record)
+
+    def _audit(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        self.history.append(record)
+        if self.audit_path:
+            try:
+                with open(self.audit_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError as e:
+                logger.error(f"Failed to write config audit record: {str(e)}")
+        return record
+
+    def status(self) -> Dict[str, Any]:
+        """Current config version, active overrides (secrets masked) and the change history, newest first"""
+        return {
+            "version": self.version,
+            "overrides": {
+                source: {field: audit_value(field, value) for field, value in overrides.items()}
+                for source, overrides in self._overrides.items()
+            },
+            "history": list(reversed(self.history)),
+        }
+
+    async def start(self) -> List[asyncio.Task]:
+        """
+        Load the initial config and start watching for changes
+
+        Returns:
+            Background tasks for the caller to cancel on shutdown
+        """
+        self._loop = asyncio.get_running_loop()
+        tasks = []
+        if settings.config_file:
+            self.check_file()
+            tasks.append(asyncio.create_task(self._watch_file()))
+        if settings.config_data_id:
+            await self._loop.run_in_executor(None, self._watch_nacos)
+        return tasks
+
+    def check_file(self) -> bool:
+        """Apply the local config file if it changed since the last check; returns True if it was read"""
+        try:
+            mtime = os.path.getmtime(settings.config_file)
+        except OSError:
+            return False
+        if mtime == self._file_mtime:
+            return False
+        try:
+            with open(settings.config_file, encoding="utf-8") as f:
+                content = f.read()
+        except OSError as e:
+            logger.error(f"Failed to read config file {settings.config_file}: {str(e)}")
+            return False
+        self._file_mtime = mtime
+        self.apply("file", content)
+        return True
+
+    async def _watch_file(self):
+        while True:
+            await asyncio.sleep(settings.config_file_poll_seconds)
+            self.check_file()
+
+    def _watch_nacos(self):
+        """Fetch the data ID and subscribe to changes (blocking, runs in a worker thread)"""
+        try:
+            self._nacos_client = NacosClient(
+                server_addresses=f"http://{settings.nacos_server_address}:{settings.nacos_port}",
+                namespace=settings.nacos_namespace,
+            )
+            content = self._nacos_client.get_config(settings.config_data_id, settings.config_group)
+            self._loop.call_soon_threadsafe(self.apply, "nacos", content or "")
+            self._nacos_client.add_config_watcher(
+                settings.config_data_id, settings.config_group, self._on_nacos_change, content=content
+            )
+            logger.info(f"Watching Nacos config {settings.config_group}/{settings.config_data_id}")
+        except Exception as e:
+            # Keep serving with the current settings; the config can still be changed through CONFIG_FILE
+            logger.error(f"Failed to subscribe to Nacos config {settings.config_data_id}: {str(e)}")
+
+    def _on_nacos_change(self, params: Dict[str, Any]):
+        # Called on the Nacos client's callback thread; apply on the event loop
+        self._loop.call_soon_threadsafe(self.apply, "nacos", params.get("content") or "")
+
+# Create config center instance
+config_center = ConfigCenter(settings.config_history_size, settings.config_audit_path)
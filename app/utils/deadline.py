@@ -0,0 +1,114 @@
+"""
+Caller deadline propagation.
+
+The caller states how long it is willing to wait, either as an absolute
+X-Request-Deadline (unix epoch in milliseconds or seconds) or as a relative
+X-Request-Timeout in milliseconds (e.g. its Feign read timeout). The middleware
+rejects requests whose deadline has already passed and stores the deadline in a
+context variable; the LLM service then shrinks max_tokens to the remaining budget
+and stops reading from the upstream when the deadline is reached.
+"""
+
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Optional
+
+from .config import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_HEADER = "X-Request-Deadline"
+TIMEOUT_HEADER = "X-Request-Timeout"
+
+# Smallest max_tokens worth sending upstream when the budget is nearly spent
+MIN_MAX_TOKENS = 16
+
+_current_deadline: contextvars.ContextVar[Optional["Deadline"]] = contextvars.ContextVar("deadline", default=None)
+
+class Deadline:
+    """Point in time (monotonic clock) by which the response must be delivered"""
+
+    def __init__(self, expires_at: float):
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_headers(cls, headers) -> Optional["Deadline"]:
+        """
+        Build the deadline from request headers, keeping the configured reserve for delivery
+
+        Returns:
+            The deadline, or None if the caller sent neither header or an unparsable value
+        """
+        reserve = settings.deadline_reserve_ms / 1000
+        try:
+            if headers.get(TIMEOUT_HEADER):
+                return cls(time.monotonic() + float(headers[TIMEOUT_HEADER]) / 1000 - reserve)
+            if headers.get(DEADLINE_HEADER):
+                deadline = float(headers[DEADLINE_HEADER])
+                # Java callers naturally send System.currentTimeMillis() based values
+                if deadline > 1e11:
+                    deadline /= 1000
+                return cls(time.monotonic() + (deadline - time.time()) - reserve)
+        except ValueError:
+            logger.warning(f"Ignoring malformed deadline header: {headers.get(TIMEOUT_HEADER) or headers.get(DEADLINE_HEADER)}")
+        return None
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (negative once it passed)"""
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def fit_max_tokens(self, max_tokens: Optional[int]) -> int:
+        """Limit max_tokens to what the upstream can generate in the remaining time"""
+        budget = max(int(self.remaining() * settings.deadline_tokens_per_second), MIN_MAX_TOKENS)
+        if max_tokens is not None and max_tokens <= budget:
+            return max_tokens
+        metrics.inc("deadline_max_tokens_reduced_total")
+        return budget
+
+def set_deadline(deadline: Optional[Deadline]):
+    """Attach the caller's deadline to the current request context"""
+    _current_deadline.set(deadline)
+
+def current_deadline() -> Optional[Deadline]:
+    """Return the deadline of the request being handled, if the caller sent one"""
+    return _current_deadline.get()
+
+class DeadlineStream:
+    """
+    Iterate an upstream stream until it ends or the deadline passes
+
+    When the deadline passes the upstream HTTP response is closed so the upstream
+    stops generating, and `truncated` is set.
+    """
+
+    def __init__(self, stream, upstream, deadline: Deadline):
+        self._stream = stream
+        self._upstream = upstream
+        self.deadline = deadline
+        self.truncated = False
+
+    async def __aiter__(self):
+        iterator = self._stream.__aiter__()
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), max(self.deadline.remaining(), 0))
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    self.truncated = True
+                    metrics.inc("deadline_truncations_total")
+                    logger.warning("Request deadline reached, cancelling upstream generation")
+                    return
+                yield chunk
+        finally:
+            response = getattr(self._upstream, "response", None)
+            if response is not None:
+                await response.aclose()
@@ -0,0 +1,235 @@
+"""
+Idempotency-Key handling for the POST endpoints.
+
+When the caller sends an Idempotency-Key header, the first request is run in a
+detached task whose response (status, headers and every body chunk, so streamed
+answers included) is recorded. A retry with the same key attaches to that
+recording: it receives what was produced so far and then follows the generation
+live if it is still running, or gets a replay of the stored response if it has
+finished. The first caller disconnecting (e.g. a Feign read timeout) does not stop
+the generation, so the retry doesn't pay for a second one.
+
+Responses with a 5xx status are not kept, so retries after a failure run again.
+Reusing a key with a different request body is rejected with 422.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from ..models.chat import ErrorResponse
+from .config import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+REPLAYED_HEADER = b"idempotent-replayed"
+
+# Endpoints whose responses are recorded under the caller's key
+IDEMPOTENT_PATHS = (
+    "/api/chat/completions",
+    "/api/eye-doctor/chat",
+    "/api/eye-doctor/recommendations",
+    "/api/eye-doctor/recommendations/jobs",
+    "/v1/chat/completions",
+)
+
+# Detached request tasks, referenced until they finish even if their recording is evicted
+_running_tasks: Set[asyncio.Task] = set()
+
+class RecordedResponse:
+    """ASGI response messages of one keyed request, readable while still being produced"""
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.messages: List[Dict[str, Any]] = []
+        self.status: Optional[int] = None
+        self.error: Optional[BaseException] = None
+        self.finished_at: Optional[float] = None
+        self.finished = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self._updated = asyncio.Event()
+
+    def _notify(self):
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    async def record(self, message: Dict[str, Any]):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+        self.messages.append(message)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.error = error
+        self.finished_at = time.monotonic()
+        self.finished.set()
+        self._notify()
+
+    async def replay(self, send, replayed: bool):
+        """Send the recorded messages, following the response until it is complete"""
+        index = 0
+        while True:
+            updated = self._updated
+            while index < len(self.messages):
+                message = self.messages[index]
+                index += 1
+                if replayed and message["type"] == "http.response.start":
+                    message = {**message, "headers": list(message.get("headers", [])) + [(REPLAYED_HEADER, b"true")]}
+                await send(message)
+            if self.finished.is_set():
+                if self.error is not None and index == 0:
+                    raise self.error
+                return
+            await updated.wait()
+
+class IdempotencyStore:
+    """Bounded store of recorded responses keyed by (path, Idempotency-Key), with a TTL after completion"""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], RecordedResponse]" = OrderedDict()
+        # (finished_at, key, recording) in completion order, so expiry only looks at the head
+        self._finished: deque = deque()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def resize(self, max_entries: int, ttl_seconds: int):
+        """Change the limits, dropping only the oldest recordings beyond the new size"""
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        while len(self._entries) > max(max_entries, 0):
+            self._entries.popitem(last=False)
+        metrics.set_gauge("idempotency_entries", len(self._entries))
+
+    def _purge_expired(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._finished and self._finished[0][0] < cutoff:
+            _, key, entry = self._finished.popleft()
+            # The key may have been evicted or reused since
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def finish(self, path: str, key: str, entry: RecordedResponse):
+        """Start the TTL of a completed recording"""
+        if self._entries.get((path, key)) is entry:
+            self._finished.append((entry.finished_at, (path, key), entry))
+
+    def begin(self, path: str, key: str, fingerprint: str) -> Tuple[Optional[RecordedResponse], bool]:
+        """
+        Find the recording for a key, or start a new one
+
+        Returns:
+            Tuple of (recording, whether it was created by this call); the
+            recording is None if the key was used with a different request body
+        """
+        self._purge_expired()
+        entry = self._entries.get((path, key))
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                return None, False
+            self._entries.move_to_end((path, key))
+            return entry, False
+
+        entry = self._entries[(path, key)] = RecordedResponse(fingerprint)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        metrics.set_gauge("idempotency_entries", len(self._entries))
+        return entry, True
+
+    def discard(self, path: str, key: str, entry: RecordedResponse):
+        """Forget a recording so the next retry runs again"""
+        if self._entries.get((path, key)) is entry:
+            del self._entries[(path, key)]
+            metrics.set_gauge("idempotency_entries", len(self._entries))
+
+class IdempotencyMiddleware:
+    """ASGI middleware recording and replaying responses of requests carrying an Idempotency-Key"""
+
+    def __init__(self, app, store: "IdempotencyStore" = None):
+        self.app = app
+        self.store = store or idempotency_store
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] != "POST"
+                or scope["path"] not in IDEMPOTENT_PATHS or not self.store.enabled):
+            return await self.app(scope, receive, send)
+        key = dict(scope["headers"]).get(IDEMPOTENCY_HEADER)
+        if not key:
+            return await self.app(scope, receive, send)
+        key = key.decode("latin-1")
+
+        body = await read_body(receive)
+        fingerprint = hashlib.sha256(body).hexdigest()
+        entry, created = self.store.begin(scope["path"], key, fingerprint)
+        if entry is None:
+            metrics.inc("idempotency_requests_total", result="conflict")
+            return await send_conflict(send)
+
+        if created:
+            metrics.inc("idempotency_requests_total", result="new")
+            entry.task = asyncio.create_task(self._run(scope, key, body, entry))
+            _running_tasks.add(entry.task)
+            entry.task.add_done_callback(_running_tasks.discard)
+        else:
+            result = "replayed" if entry.finished.is_set() else "attached"
+            logger.info(f"Idempotency-Key {key} on {scope['path']}: {result} to the earlier request")
+            metrics.inc("idempotency_requests_total", result=result)
+        await entry.replay(send, replayed=not created)
+
+    async def _run(self, scope, key: str, body: bytes, entry: RecordedResponse):
+        """Run the request detached from the caller's connection and record its response"""
+        request_sent = False
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await entry.finished.wait()
+            return {"type": "http.disconnect"}
+
+        error = None
+        try:
+            await self.app(scope, receive, entry.record)
+        except Exception as e:
+            logger.error(f"Request with Idempotency-Key {key} failed: {str(e)}")
+            error = e
+        if error is not None or entry.status is None or entry.status >= 500:
+            self.store.discard(scope["path"], key, entry)
+        entry.finish(error)
+        self.store.finish(scope["path"], key, entry)
+
+async def read_body(receive) -> bytes:
+    """Read the complete request body"""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+async def send_conflict(send):
+    body = json.dumps(ErrorResponse(
+        message="Idempotency-Key was already used with a different request body"
+    ).model_dump()).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 422,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+# Create idempotency store instance
+idempotency_store = IdempotencyStore(settings.idempotency_max_entries, settings.idempotency_ttl_seconds)
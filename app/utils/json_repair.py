@@ -0,0 +1,164 @@
+"""
+Local repair of truncated or lightly malformed JSON produced by the LLM.
+
+Handles the failure modes we see in practice: markdown code fences or prose around
+the object, trailing commas, raw newlines inside strings and output cut off by
+max_tokens. Truncated output is cut back to the last complete value and the open
+containers are closed, so a partially generated answer can still be used.
+"""
+
+import json
+from typing import Any, List, Tuple
+
+def extract_json_text(text: str) -> str:
+    """Strip code fences and surrounding prose, starting at the first '{'"""
+    start = text.find('{')
+    if start < 0:
+        raise ValueError("No JSON object found in model output")
+    end = text.rfind('}')
+    # Keep everything after the first brace when the object looks truncated
+    if end > start:
+        candidate = text[start:end + 1]
+        try:
+            json.loads(candidate)
+            return candidate
+        except json.JSONDecodeError:
+            pass
+    return text[start:].rstrip().removesuffix("```").rstrip()
+
+def _closers(stack: List[List[str]]) -> str:
+    return "".join('}' if container == '{' else ']' for container, _ in reversed(stack))
+
+def repair_json(text: str) -> Tuple[str, bool]:
+    """
+    Repair a JSON object string
+
+    Args:
+        text: Raw model output that should contain a JSON object
+
+    Returns:
+        Tuple of (repaired JSON string, whether the input was truncated)
+
+    Raises:
+        ValueError: If no usable JSON object can be recovered
+    """
+    text = extract_json_text(text)
+    out: List[str] = []
+    # Each entry is [container, state]; state is one of
+    # start, key, colon, value, comma (comma = a value was just completed)
+    stack: List[List[str]] = []
+    in_string = False
+    escape = False
+    token: List[str] = []
+    safe_len = 0
+    safe_closers = ""
+    finished = False
+
+    def complete_value():
+        nonlocal safe_len, safe_closers
+        if stack:
+            top = stack[-1]
+            top[1] = "colon" if top[0] == '{' and top[1] in ("start", "key") else "comma"
+            if top[1] == "comma":
+                safe_len = len(out)
+                safe_closers = _closers(stack)
+
+    def flush_token():
+        if token:
+            out.extend(token)
+            token.clear()
+            complete_value()
+
+    for char in text:
+        if in_string:
+            if escape:
+                escape = False
+                out.append(char)
+            elif char == '\\':
+                escape = True
+                out.append(char)
+            elif char == '"':
+                in_string = False
+                out.append(char)
+                complete_value()
+            elif char == '\n':
+                out.append('\\n')
+            elif char == '\r':
+                out.append('\\r')
+            elif char == '\t':
+                out.append('\\t')
+            else:
+                out.append(char)
+            continue
+
+        if char in ' \t\r\n':
+            flush_token()
+            out.append(char)
+        elif char == '"':
+            flush_token()
+            in_string = True
+            out.append(char)
+        elif char in '{[':
+            flush_token()
+            stack.append([char, "start"])
+            out.append(char)
+            safe_len = len(out)
+            safe_closers = _closers(stack)
+        elif char in '}]':
+            flush_token()
+            # Drop a trailing comma before the closing bracket
+            while out and out[-1] in ' \t\r\n':
+                out.pop()
+            if out and out[-1] == ',':
+                out.pop()
+            if not stack:
+                break
+            # Close the container that is actually open, even if the bracket differs
+            container, _ = stack.pop()
+            out.append('}' if container == '{' else ']')
+            if not stack:
+                finished = True
+                break
+            complete_value()
+        elif char == ',':
+            flush_token()
+            if stack:
+                stack[-1][1] = "key" if stack[-1][0] == '{' else "value"
+            out.append(char)
+        elif char == ':':
+            flush_token()
+            if stack:
+                stack[-1][1] = "value"
+            out.append(char)
+        else:
+            token.append(char)
+
+    if finished:
+        return "".join(out), False
+
+    # Keep the partial text of a string value cut off mid-generation
+    if in_string and stack and (stack[-1][0] == '[' or stack[-1][1] == "value"):
+        if escape:
+            out.pop()
+        return "".join(out) + '"' + _closers(stack), True
+
+    if not safe_closers:
+        raise ValueError("Model output ended before any complete JSON value")
+    return "".join(out[:safe_len]).rstrip().rstrip(',') + safe_closers, True
+
+def loads_lenient(text: str) -> Tuple[Any, bool]:
+    """
+    Parse JSON from model output, repairing it locally when needed
+
+    Returns:
+        Tuple of (parsed value, whether repair was needed)
+    """
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+    repaired, _ = repair_json(text)
+    try:
+        return json.loads(repaired), True
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Unable to repair JSON: {str(e)}")
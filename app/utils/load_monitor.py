@@ -0,0 +1,134 @@
+"""
+Instance load score for load-aware balancing.
+
+The score (0 = idle, 1 = saturated) is the highest of three ratios: upstream calls
+in flight against LOAD_MAX_IN_FLIGHT, queued recommendation jobs against the job
+queue size, and recent upstream time to first token against LOAD_LATENCY_TARGET_SECONDS
+(a limit of 0 means unbounded and leaves its ratio out). The app recomputes it every
+LOAD_UPDATE_SECONDS and turns it into a Nacos instance weight, which only changes
+when it moves by more than LOAD_WEIGHT_HYSTERESIS so small fluctuations don't cause
+weight flapping; the Nacos heartbeat only publishes the weight.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Any
+
+from .config import settings
+from .metrics import metrics, percentile
+
+logger = logging.getLogger(__name__)
+
+# Recent time-to-first-token samples used for the latency ratio
+LATENCY_WINDOW = 256
+LATENCY_WINDOW_SECONDS = 60
+
+def _ratio(value: float, limit: float) -> float:
+    """Value against its limit, 0 when the limit is unbounded (0 or less)"""
+    return value / limit if limit > 0 else 0.0
+
+class LoadMonitor:
+    """Compute the load score and the hysteresis-filtered instance weight"""
+
+    def __init__(self, max_in_flight: int, latency_target_seconds: float, hysteresis: float, min_weight: float):
+        self.max_in_flight = max_in_flight
+        self.latency_target_seconds = latency_target_seconds
+        self.hysteresis = hysteresis
+        self.min_weight = min_weight
+        self.weight = 1.0
+        # Whether the weight changed since it was last published
+        self._weight_changed = False
+        self._status: Dict[str, Any] = {"state": "ready", "weight": 1.0, "score": 0.0}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def observe_latency(self, seconds: float):
+        """Record an upstream time to first token"""
+        with self._lock:
+            self._latencies.append((time.monotonic(), seconds))
+
+    def _latency_p90(self) -> float:
+        cutoff = time.monotonic() - LATENCY_WINDOW_SECONDS
+        with self._lock:
+            while self._latencies and self._latencies[0][0] < cutoff:
+                self._latencies.popleft()
+            values = sorted(seconds for _, seconds in self._latencies)
+        return percentile(values, 90) or 0.0
+
+    def update(self) -> bool:
+        """
+        Recompute the load score and weight
+
+        Returns:
+            True if the published weight changed
+        """
+        in_flight = metrics.get_gauge("upstream_in_flight")
+        queued = metrics.get_gauge("recommendation_jobs_queued")
+        latency = self._latency_p90()
+        score = min(1.0, max(
+            _ratio(in_flight, self.max_in_flight),
+            _ratio(queued, settings.job_queue_size),
+            _ratio(latency, self.latency_target_seconds)
+        ))
+
+        # Move the weight only on significant changes, or when reaching either bound
+        target = round(max(self.min_weight, 1.0 - score), 2)
+        changed = abs(target - self.weight) >= self.hysteresis or (
+            target != self.weight and target in (1.0, self.min_weight)
+        )
+        if changed:
+            with self._lock:
+                self.weight = target
+                self._weight_changed = True
+
+        if self.weight <= self.min_weight:
+            state = "saturated"
+        elif self.weight < 0.5:
+            state = "busy"
+        else:
+            state = "ready"
+        self._status = {
+            "state": state,
+            "weight": self.weight,
+            "score": round(score, 3),
+            "in_flight": in_flight,
+            "queued_jobs": queued,
+            "ttft_p90_seconds": round(latency, 3),
+        }
+        metrics.set_gauge("load_score", round(score, 3))
+        metrics.set_gauge("instance_weight", self.weight)
+        return changed
+
+    def take_weight_change(self) -> bool:
+        """Return whether the weight changed since the last call (called before publishing it)"""
+        with self._lock:
+            changed, self._weight_changed = self._weight_changed, False
+        return changed
+
+    async def update_periodically(self):
+        """Recompute the load score every LOAD_UPDATE_SECONDS"""
+        while True:
+            try:
+                self.update()
+            except Exception as e:
+                logger.error(f"Failed to update the load score: {str(e)}")
+            await asyncio.sleep(settings.load_update_seconds)
+
+    def status(self) -> Dict[str, Any]:
+        """Return the state computed by the last update"""
+        return self._status
+
+    def metadata(self) -> Dict[str, str]:
+        """Load information published as Nacos instance metadata"""
+        return {"load_state": self._status["state"], "load_score": str(self._status["score"])}
+
+# Create load monitor instance
+load_monitor = LoadMonitor(
+    max_in_flight=settings.load_max_in_flight,
+    latency_target_seconds=settings.load_latency_target_seconds,
+    hysteresis=settings.load_weight_hysteresis,
+    min_weight=settings.load_min_weight
+)
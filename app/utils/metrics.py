@@ -0,0 +1,117 @@
+"""
+Lightweight in-process metrics registry.
+
+Counters, gauges and latency histograms are kept in memory and exposed as JSON
+through the /metrics endpoint. Histograms keep a bounded window of recent samples
+so percentiles reflect current behaviour without unbounded memory growth.
+"""
+
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, Any, Optional
+
+# Number of recent samples kept per histogram for percentile calculation
+HISTOGRAM_WINDOW = 2048
+
+def _metric_key(name: str, labels: Dict[str, Any]) -> str:
+    """Build a flat metric key such as name{path=/health}"""
+    if not labels:
+        return name
+    label_str = ",".join(f"{k}={v}" for k, v in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+def percentile(sorted_values, pct: float) -> Optional[float]:
+    """Return the nearest-rank percentile of an already sorted sequence"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+class Histogram:
+    """Count, sum and a sliding window of recent observations"""
+
+    def __init__(self, window: int = HISTOGRAM_WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.recent.append(value)
+
+    def quantile(self, pct: float) -> Optional[float]:
+        return percentile(sorted(self.recent), pct)
+
+    def summary(self) -> Dict[str, Any]:
+        values = sorted(self.recent)
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+        }
+
+class Metrics:
+    """Thread-safe registry of counters, gauges and histograms"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = defaultdict(float)
+        self._histograms: Dict[str, Histogram] = {}
+        self._started_at = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Increment a counter"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._counters[key] += value
+
+    def gauge_add(self, name: str, value: float, **labels):
+        """Add to (or subtract from) a gauge"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._gauges[key] += value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """Set a gauge to an absolute value"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def get_gauge(self, name: str, **labels) -> float:
+        """Read the current value of a gauge"""
+        with self._lock:
+            return self._gauges.get(_metric_key(name, labels), 0.0)
+
+    def observe(self, name: str, value: float, **labels):
+        """Record an observation in a histogram"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def quantile(self, name: str, pct: float, **labels) -> Optional[float]:
+        """Return a percentile of the recent observations of a histogram"""
+        with self._lock:
+            histogram = self._histograms.get(_metric_key(name, labels))
+            return histogram.quantile(pct) if histogram else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return all metrics plus process CPU time as a JSON-serializable dict"""
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self._started_at, 3),
+                "process_cpu_seconds": time.process_time(),
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "histograms": {k: h.summary() for k, h in self._histograms.items()},
+            }
+
+# Create metrics instance
+metrics = Metrics()
@@ -0,0 +1,224 @@
+"""
+Event loop lag monitoring and on-demand profiling.
+
+LoopLagMonitor wakes up every LOOP_LAG_INTERVAL_SECONDS and records how late it
+was woken in the event_loop_lag_seconds histogram. A watchdog thread checks that
+these wake-ups keep coming; when the loop has been stuck for longer than
+LOOP_LAG_THRESHOLD_SECONDS it logs the loop thread's current stack, i.e. the
+blocking callback itself. Both cost one wake-up per interval when the loop is
+healthy.
+
+Profiler captures the event loop thread for a number of seconds, either with
+cProfile (deterministic, returned as pstats text or a binary pstats dump for
+snakeviz/pstats) or with a wall-clock stack sampler (returned as collapsed
+stacks for flamegraph.pl or speedscope). Nothing is collected between captures.
+"""
+
+import asyncio
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Tuple
+
+from .config import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ("cprofile", "sampling")
+PROFILE_FORMATS = ("text", "pstats", "collapsed")
+# Sort keys accepted for cProfile text reports
+PROFILE_SORT_KEYS = tuple(key.value for key in pstats.SortKey)
+
+# Stalls kept for GET /admin/loop-stalls
+STALL_HISTORY = 20
+
+class ProfilerBusyError(Exception):
+    """Another profile capture is in progress"""
+
+class LoopLagMonitor:
+    """Measure event loop scheduling lag and report the stack of stalled callbacks"""
+
+    def __init__(self, interval_seconds: float, threshold_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.threshold_seconds = threshold_seconds
+        self.stalls = deque(maxlen=STALL_HISTORY)
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval_seconds > 0 and self.threshold_seconds > 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> asyncio.Task:
+        """Start measuring unless already running; returns the measuring task"""
+        if self.running:
+            return self._task
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        # Each run has its own stop event so a restart never revives the previous watchdog
+        stop = threading.Event()
+        threading.Thread(target=self._watch, args=(stop,), name="loop-lag-watchdog", daemon=True).start()
+        self._task = asyncio.create_task(self._measure(stop))
+        return self._task
+
+    def stop(self):
+        """Stop measuring"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def reconfigure(self, interval_seconds: float, threshold_seconds: float):
+        """Apply new settings, starting or stopping the measurement as needed (on the event loop)"""
+        self.interval_seconds = interval_seconds
+        self.threshold_seconds = threshold_seconds
+        if self.enabled:
+            self.start()
+        else:
+            self.stop()
+
+    async def _measure(self, stop: threading.Event):
+        try:
+            while True:
+                expected = time.monotonic() + self.interval_seconds
+                await asyncio.sleep(self.interval_seconds)
+                now = time.monotonic()
+                self._heartbeat = now
+                lag = max(0.0, now - expected)
+                metrics.observe("event_loop_lag_seconds", lag)
+                if lag >= self.threshold_seconds:
+                    metrics.inc("event_loop_stalls_total")
+        finally:
+            stop.set()
+
+    def _watch(self, stop: threading.Event):
+        """Watchdog thread: dump the loop thread's stack while it is blocked"""
+        reported = None
+        while not stop.wait(max(self.threshold_seconds / 2, 0.05)):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval_seconds
+            if blocked < self.threshold_seconds or heartbeat == reported:
+                continue
+            # Report each stall once, with the stack at the time it was detected
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            self.stalls.append({
+                "detected_at": datetime.now(timezone.utc).isoformat(),
+                "blocked_seconds": round(blocked, 3),
+                "stack": stack,
+            })
+            logger.warning(f"Event loop blocked for {blocked:.3f}s, loop thread stack:\n{stack}")
+
+class Profiler:
+    """One-at-a-time profile captures of the event loop thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profile capture is already in progress")
+
+    async def capture_cprofile(self, seconds: float, fmt: str, sort: str = "cumulative",
+                               limit: int = 100) -> bytes:
+        """
+        Profile everything the event loop runs for the given time
+
+        Args:
+            seconds: Capture duration
+            fmt: "text" for a pstats report, "pstats" for a binary dump loadable with pstats.Stats
+            sort: pstats sort key of the text report
+            limit: Number of functions in the text report
+
+        Raises:
+            ProfilerBusyError: If another capture is in progress
+        """
+        self._acquire()
+        try:
+            profile = cProfile.Profile()
+            # cProfile hooks the current thread, which is the event loop thread
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+            metrics.inc("profiles_total", mode="cprofile")
+            if fmt == "pstats":
+                profile.create_stats()
+                return marshal.dumps(profile.stats)
+            out = io.StringIO()
+            pstats.Stats(profile, stream=out).sort_stats(sort).print_stats(limit)
+            return out.getvalue().encode("utf-8")
+        finally:
+            self._lock.release()
+
+    async def capture_samples(self, seconds: float, hz: int, all_threads: bool = False) -> bytes:
+        """
+        Sample the stacks of the event loop thread (or every thread) for the given time
+
+        Returns:
+            Collapsed stacks, one "frame;frame;frame count" line per distinct stack
+
+        Raises:
+            ProfilerBusyError: If another capture is in progress
+        """
+        self._acquire()
+        try:
+            thread_id = None if all_threads else threading.get_ident()
+            loop = asyncio.get_running_loop()
+            stacks = await loop.run_in_executor(None, sample_stacks, seconds, hz, thread_id)
+            metrics.inc("profiles_total", mode="sampling")
+            lines = [f"{stack} {count}" for stack, count in stacks.most_common()]
+            return ("\n".join(lines) + "\n").encode("utf-8")
+        finally:
+            self._lock.release()
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def sample_stacks(seconds: float, hz: int, thread_id=None) -> Counter:
+    """Collect collapsed stacks of one thread (or all but the sampler) at hz samples per second"""
+    sampler_id = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    interval = 1.0 / hz
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == sampler_id or (thread_id is not None and ident != thread_id):
+                continue
+            labels: List[str] = []
+            while frame is not None:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            if thread_id is None:
+                labels.append(names.get(ident, str(ident)))
+            stacks[";".join(reversed(labels))] += 1
+        time.sleep(interval)
+    return stacks
+
+def profile_response_type(fmt: str) -> Tuple[str, Dict[str, Any]]:
+    """Media type and extra headers of a profile in the given format"""
+    if fmt == "pstats":
+        return "application/octet-stream", {"Content-Disposition": 'attachment; filename="profile.pstats"'}
+    return "text/plain", {}
+
+# Create loop lag monitor and profiler instances
+loop_lag_monitor = LoopLagMonitor(settings.loop_lag_interval_seconds, settings.loop_lag_threshold_seconds)
+profiler = Profiler()
@@ -2,8 +2,19 @@
 Prompt engineering utilities for the eye doctor AI chat application.
 This module contains system prompts, user input templates, and specialized prompts
 for different types of questions related to eye diseases.
+
+Every template exists in a "default" and a "compact" variant (PROMPT_VARIANTS);
+the compact set carries the same instructions in far fewer tokens. Run
+prompt_tokens.py to compare their token footprint.
 """
 
+import hashlib
+import logging
+import random
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
 # System prompt that sets the AI's behavior and role
 SYSTEM_PROMPT = """
 你是一位专业的眼科医学顾问，基于患者的眼底检查结果和相关问题提供专业咨询。
@@ -35,6 +46,23 @@ USER_INPUT_TEMPLATE = """
 您的问题是: {question}
 """
 
+# Patient context placed after the system prompt in the "prefix" layout.
+# Keeping it ahead of the conversation history gives every turn of a session
+# the same token prefix, so the upstream can reuse its prompt cache.
+PATIENT_CONTEXT_TEMPLATE = """
+患者的眼底检查信息：
+- 诊断: {disease_name} ({disease_category})
+- 检查结果: {result}
+- 备注: {remark}
+- 治疗计划: {treatment_plan}
+- 用药信息: {medications}
+"""
+
+# Question template used with PATIENT_CONTEXT_TEMPLATE
+QUESTION_TEMPLATE = """
+您的问题是: {question}
+"""
+
 # Specialized prompts for different question types
 
 # 1. Disease explanation questions
@@ -131,116 +159,125 @@ def format_medications(medications):
     
     formatted = []
     for med in medications:
-        med_info = f"{med.get('medication_name', '未知药物')}"
+        med_info = med.medication_name or '未知药物'
         
-        dosage = med.get('dosage')
-        if dosage:
-            med_info += f"，剂量：{dosage}"
+        if med.dosage:
+            med_info += f"，剂量：{med.dosage}"
             
-        frequency = med.get('frequency')
-        if frequency:
-            med_info += f"，频率：{frequency}"
+        if med.frequency:
+            med_info += f"，频率：{med.frequency}"
             
-        side_effects = med.get('side_effects')
-        if side_effects:
-            med_info += f"，可能的副作用：{side_effects}"
+        if med.side_effects:
+            med_info += f"，可能的副作用：{med.side_effects}"
             
         formatted.append(med_info)
     
     return "；".join(formatted)
 
+# Helper function to get the treatment detail from the request
+def get_treatment_detail(request):
+    """Return the treatment detail of the request or a placeholder"""
+    treatment_plan = request.treatment_plan
+    if treatment_plan and treatment_plan.get('treatment_detail'):
+        return treatment_plan['treatment_detail']
+    return "无治疗计划"
+
 # Helper function to construct the user input from request data
-def construct_user_input(request_data):
+def construct_user_input(request, variant="default"):
     """
     Construct a formatted user input from the request data
     
     Args:
-        request_data: Dictionary containing patient information and question
+        request: Validated EyeDoctorRequest containing patient information and question
+        variant: Prompt variant, a key of PROMPT_VARIANTS
         
     Returns:
         Formatted string with patient information and question
     """
-    disease_name = request_data.get('disease_name', '未知疾病')
-    disease_category = request_data.get('disease_category', '未知类别')
-    result = request_data.get('result', '无检查结果')
-    remark = request_data.get('remark', '无备注')
-    
-    # Get treatment plan
-    treatment_plan = "无治疗计划"
-    if 'treatment_plan' in request_data and 'treatment_detail' in request_data['treatment_plan']:
-        treatment_plan = request_data['treatment_plan']['treatment_detail']
-    
-    # Format medications
-    medications = format_medications(request_data.get('medications', []))
-    
-    # Get the question
-    question = request_data.get('question', '无具体问题')
-    
     # Format using the template
-    return USER_INPUT_TEMPLATE.format(
-        disease_name=disease_name,
-        disease_category=disease_category,
-        result=result,
-        remark=remark,
-        treatment_plan=treatment_plan,
-        medications=medications,
-        question=question
+    return PROMPT_VARIANTS[variant]["user_input"].format(
+        disease_name=request.disease_name,
+        disease_category=request.disease_category,
+        result=request.result,
+        remark=request.remark or '无备注',
+        treatment_plan=get_treatment_detail(request),
+        medications=format_medications(request.medications),
+        question=request.question
     )
 
+# Question keywords for each specialized prompt family, checked in order
+INTENT_KEYWORDS = (
+    ("explanation", ['什么病', '这个病是什么', '为什么会得', '病因']),
+    ("treatment", ['怎么治', '如何治疗', '治疗方法', '需要手术']),
+    ("medication", ['药', '用药', '药物', '副作用']),
+    ("prevention", ['预防', '生活', '日常', '饮食', '护眼']),
+    ("prognosis", ['严重吗', '会好吗', '预后', '影响视力']),
+)
+
+# Helper function to classify the question into a specialized prompt family
+def classify_intent(question):
+    """
+    Determine the question type from its keywords
+    
+    Args:
+        question: Patient's question
+        
+    Returns:
+        One of explanation, treatment, medication, prevention, prognosis, or None
+    """
+    question = question.lower()
+    for intent, keywords in INTENT_KEYWORDS:
+        if any(keyword in question for keyword in keywords):
+            return intent
+    return None
+
 # Helper function to get the most appropriate specialized prompt based on the question
-def get_specialized_prompt(request_data):
+def get_specialized_prompt(request, variant="default"):
     """
     Determine which specialized prompt to use based on the question
     
     Args:
-        request_data: Dictionary containing patient information and question
+        request: Validated EyeDoctorRequest containing patient information and question
+        variant: Prompt variant, a key of PROMPT_VARIANTS
         
     Returns:
         Specialized prompt string formatted with patient data
     """
-    question = request_data.get('question', '').lower()
-    disease_name = request_data.get('disease_name', '未知疾病')
-    result = request_data.get('result', '无检查结果')
-    remark = request_data.get('remark', '无备注')
-    
-    # Get treatment plan
-    treatment_plan = "无治疗计划"
-    if 'treatment_plan' in request_data and 'treatment_detail' in request_data['treatment_plan']:
-        treatment_plan = request_data['treatment_plan']['treatment_detail']
-    
-    # Format medications
-    medications = format_medications(request_data.get('medications', []))
+    prompts = PROMPT_VARIANTS[variant]
+    intent = classify_intent(request.question)
+    disease_name = request.disease_name
+    result = request.result
     
     # Check question type
-    if any(keyword in question for keyword in ['什么病', '这个病是什么', '为什么会得', '病因']):
-        return DISEASE_EXPLANATION_PROMPT.format(
+    if intent == "explanation":
+        return prompts["explanation"].format(
             disease_name=disease_name,
             result=result
         )
     
-    elif any(keyword in question for keyword in ['怎么治', '如何治疗', '治疗方法', '需要手术']):
-        return TREATMENT_PLAN_PROMPT.format(
+    elif intent == "treatment":
+        return prompts["treatment"].format(
             disease_name=disease_name,
             result=result,
-            treatment_plan=treatment_plan
+            treatment_plan=get_treatment_detail(request)
         )
     
-    elif any(keyword in question for keyword in ['药', '用药', '药物', '副作用']):
-        return MEDICATION_PROMPT.format(
-            medications=medications,
+    elif intent == "medication":
+        return prompts["medication"].format(
+            medications=format_medications(request.medications),
             disease_name=disease_name,
             result=result
         )
     
-    elif any(keyword in question for keyword in ['预防', '生活', '日常', '饮食', '护眼']):
-        return PREVENTION_LIFESTYLE_PROMPT.format(
+    elif intent == "prevention":
+        return prompts["prevention"].format(
             disease_name=disease_name,
             result=result,
-            remark=remark
+            remark=request.remark or '无备注'
         )
     
-    elif any(keyword in question for keyword in ['严重吗', '会好吗', '预后', '影响视力']):
-        return SEVERITY_PROGNOSIS_PROMPT.format(
+    elif intent == "prognosis":
+        return prompts["prognosis"].format(
             disease_name=disease_name,
             result=result
         )
@@ -249,21 +286,22 @@ def get_specialized_prompt(request_data):
     return ""
 
 # Main function to construct the complete prompt
-def construct_prompt(request_data):
+def construct_prompt(request, variant="default"):
     """
     Construct the complete prompt for the LLM
     
     Args:
-        request_data: Dictionary containing patient information and question
+        request: Validated EyeDoctorRequest containing patient information and question
+        variant: Prompt variant, a key of PROMPT_VARIANTS
         
     Returns:
         Tuple of (system_prompt, user_message) to send to the LLM
     """
     # Basic user input
-    user_input = construct_user_input(request_data)
+    user_input = construct_user_input(request, variant)
     
     # Get specialized prompt if applicable
-    specialized_prompt = get_specialized_prompt(request_data)
+    specialized_prompt = get_specialized_prompt(request, variant)
     
     # Combine user input with specialized prompt if exists
     if specialized_prompt:
@@ -271,7 +309,66 @@ def construct_prompt(request_data):
     else:
         user_message = user_input
     
-    return SYSTEM_PROMPT, user_message
+    return PROMPT_VARIANTS[variant]["system"], user_message
+
+# Construct the stable system prompt + patient context prefix
+def construct_prefix_prompt(request, variant="default"):
+    """
+    Construct the prompt for the "prefix" layout
+    
+    Args:
+        request: Validated EyeDoctorRequest containing patient information and question
+        variant: Prompt variant, a key of PROMPT_VARIANTS
+        
+    Returns:
+        Tuple of (system_prompt including patient context, user_message)
+    """
+    prompts = PROMPT_VARIANTS[variant]
+    patient_context = prompts["patient_context"].format(
+        disease_name=request.disease_name,
+        disease_category=request.disease_category,
+        result=request.result,
+        remark=request.remark or '无备注',
+        treatment_plan=get_treatment_detail(request),
+        medications=format_medications(request.medications)
+    )
+    user_message = prompts["question"].format(question=request.question)
+    
+    specialized_prompt = get_specialized_prompt(request, variant)
+    if specialized_prompt:
+        user_message = f"{user_message}\n\n{specialized_prompt}"
+    
+    return f"{prompts['system']}{patient_context}", user_message
+
+# Build the upstream message list directly from the validated request
+def construct_messages(request, layout="legacy", history=None, variant="default"):
+    """
+    Construct the message list sent to the upstream chat completion API
+    
+    Args:
+        request: Validated EyeDoctorRequest containing patient information and question
+        layout: "legacy" puts the patient context in the final user message,
+            "prefix" puts it in the system message ahead of the history
+        history: Conversation turns to use instead of request.previous_conversations
+        variant: Prompt variant, a key of PROMPT_VARIANTS
+        
+    Returns:
+        List of role/content dictionaries ready for the upstream payload
+    """
+    if layout == "prefix":
+        system_prompt, user_message = construct_prefix_prompt(request, variant)
+    else:
+        system_prompt, user_message = construct_prompt(request, variant)
+    messages = [{"role": "system", "content": system_prompt}]
+    
+    # Add previous conversation context if available
+    for turn in history if history is not None else request.previous_conversations or ():
+        if turn.role in ('user', 'assistant') and turn.content:
+            messages.append({"role": turn.role, "content": turn.content})
+    
+    # Add the current user query at the end
+    messages.append({"role": "user", "content": user_message})
+    return messages
 
 # AI Recommendation System Prompts
 RECOMMENDATION_SYSTEM_PROMPT = """你是一位经验丰富的眼科医生AI助手。你的任务是根据患者的诊断和信息提供用药和治疗建议。
@@ -314,30 +411,191 @@ RECOMMENDATION_USER_TEMPLATE = """请为以下患者提供用药和治疗建议
 
 请严格按照指定的JSON格式提供建议，不要添加任何其他说明文字。"""
 
-def construct_recommendation_prompt(request_data):
+RECOMMENDATION_RETRY_PROMPT = """你上一次的回复不符合要求的格式，已被丢弃。请重新回答，只输出一个JSON对象：medications必须是数组，其中每个药品的medication_name、dosage、frequency都必须是字符串；treatment_plan必须是包含treatment_type和treatment_detail两个字符串字段的对象。不要输出JSON以外的任何内容。"""
+
+def construct_recommendation_prompt(request, variant="default"):
     """
     Construct prompts for the AI recommendation system
     
     Args:
-        request_data: Dictionary containing patient and disease information
+        request: Validated AIRecommendationRequest containing patient and disease information
+        variant: Prompt variant, a key of PROMPT_VARIANTS
         
     Returns:
         Tuple of (system_prompt, user_message)
     """
-    # Get patient info
-    patient_info = request_data.get('patient_info', {})
-    name = patient_info.get('name', '未知')
-    age = patient_info.get('age', '未知')
-    sex = patient_info.get('sex', '未知')
+    prompts = PROMPT_VARIANTS[variant]
+    patient_info = request.patient_info
     
     # Format user message
-    user_message = RECOMMENDATION_USER_TEMPLATE.format(
-        disease_name=request_data.get('disease_name', '未知疾病'),
-        disease_category=request_data.get('disease_category', '未知类别'),
-        result=request_data.get('result', '无检查结果'),
-        name=name,
-        age=age,
-        sex=sex
+    user_message = prompts["recommendation_user"].format(
+        disease_name=request.disease_name,
+        disease_category=request.disease_category,
+        result=request.result,
+        name=patient_info.name,
+        age=patient_info.age,
+        sex=patient_info.sex
     )
     
-    return RECOMMENDATION_SYSTEM_PROMPT, user_message 
\ No newline at end of file
+    return prompts["recommendation_system"], user_message
+
+def construct_recommendation_messages(request, variant="default", retry=False):
+    """
+    Construct the upstream message list for a recommendation request
+    
+    With retry set, a reminder of the required format is appended for a retry
+    after an invalid answer.
+    """
+    system_prompt, user_message = construct_recommendation_prompt(request, variant)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message}
+    ]
+    if retry:
+        messages.append({"role": "user", "content": PROMPT_VARIANTS[variant]["recommendation_retry"]})
+    return messages
+
+# Compact prompt variant: the same instructions with the enumerations and
+# repeated reminders folded into single sentences. The answer format and domain
+# restrictions are stated in the system prompt instead of being left out.
+COMPACT_SYSTEM_PROMPT = """你是专业的眼科医学顾问，根据患者的检查结果回答问题：用通俗语言解释诊断、疾病、治疗和用药，提供循证建议。
+只回答眼科相关问题，超出范围时礼貌说明并建议咨询医生。不做确定性诊断，不开处方，不替代医生决策，不确定时坦诚说明并建议就医。
+如引用资料，在末尾写"参考资料："，每行"- 名称, 发布机构, 年份"。
+"""
+
+COMPACT_USER_INPUT_TEMPLATE = """
+诊断: {disease_name} ({disease_category})
+检查结果: {result}
+备注: {remark}
+治疗计划: {treatment_plan}
+用药: {medications}
+问题: {question}
+"""
+
+COMPACT_PATIENT_CONTEXT_TEMPLATE = """
+患者信息：
+诊断: {disease_name} ({disease_category})
+检查结果: {result}
+备注: {remark}
+治疗计划: {treatment_plan}
+用药: {medications}
+"""
+
+COMPACT_QUESTION_TEMPLATE = """
+问题: {question}
+"""
+
+COMPACT_DISEASE_EXPLANATION_PROMPT = "请通俗说明{disease_name}的定义、病因和风险因素、典型症状、发展和预后，以及与患者情况（{result}）的关联。"
+
+COMPACT_TREATMENT_PLAN_PROMPT = "请结合{disease_name}（{result}）和当前治疗方案（{treatment_plan}）说明：常规疗法、当前方案的原理、预期效果和周期、注意事项、复查时机，并提醒遵医嘱。"
+
+COMPACT_MEDICATION_PROMPT = "请说明所用药物（{medications}）的作用机制、用法、常见副作用及处理、禁忌和相互作用、按时用药的重要性，并结合{disease_name}（{result}）解释用药原因。"
+
+COMPACT_PREVENTION_LIFESTYLE_PROMPT = "请结合患者情况（{result}，{remark}）给出{disease_name}的护眼和自我监测、饮食、活动、用眼环境和随访建议，突出最重要的调整。"
+
+COMPACT_SEVERITY_PROGNOSIS_PROMPT = "请基于检查结果（{result}）客观评估{disease_name}的严重程度、自然病程、治疗对预后的影响、并发症预防和长期管理，既不淡化也不夸大。"
+
+COMPACT_RECOMMENDATION_SYSTEM_PROMPT = """你是眼科医生AI助手，根据患者的诊断给出用药和治疗建议。只输出如下格式的有效JSON，不加任何其他文字，所有字段必填，medications可包含多个药品，内容用中文：
+{"medications": [{"medication_name": "药品名称", "dosage": "剂量", "frequency": "频率", "side_effects": "副作用"}], "treatment_plan": {"treatment_type": "治疗类型", "treatment_detail": "治疗说明"}}"""
+
+COMPACT_RECOMMENDATION_USER_TEMPLATE = """患者：{name}，{sex}，{age}岁
+疾病：{disease_name}（{disease_category}）
+诊断结果：{result}"""
+
+COMPACT_RECOMMENDATION_RETRY_PROMPT = """上次回复格式不对，已丢弃。请只输出符合上述格式的JSON，所有字段都是字符串。"""
+
+# Template sets selectable with PROMPT_VARIANT
+PROMPT_VARIANTS = {
+    "default": {
+        "system": SYSTEM_PROMPT,
+        "user_input": USER_INPUT_TEMPLATE,
+        "patient_context": PATIENT_CONTEXT_TEMPLATE,
+        "question": QUESTION_TEMPLATE,
+        "explanation": DISEASE_EXPLANATION_PROMPT,
+        "treatment": TREATMENT_PLAN_PROMPT,
+        "medication": MEDICATION_PROMPT,
+        "prevention": PREVENTION_LIFESTYLE_PROMPT,
+        "prognosis": SEVERITY_PROGNOSIS_PROMPT,
+        "recommendation_system": RECOMMENDATION_SYSTEM_PROMPT,
+        "recommendation_user": RECOMMENDATION_USER_TEMPLATE,
+        "recommendation_retry": RECOMMENDATION_RETRY_PROMPT,
+    },
+    "compact": {
+        "system": COMPACT_SYSTEM_PROMPT,
+        "user_input": COMPACT_USER_INPUT_TEMPLATE,
+        "patient_context": COMPACT_PATIENT_CONTEXT_TEMPLATE,
+        "question": COMPACT_QUESTION_TEMPLATE,
+        "explanation": COMPACT_DISEASE_EXPLANATION_PROMPT,
+        "treatment": COMPACT_TREATMENT_PLAN_PROMPT,
+        "medication": COMPACT_MEDICATION_PROMPT,
+        "prevention": COMPACT_PREVENTION_LIFESTYLE_PROMPT,
+        "prognosis": COMPACT_SEVERITY_PROGNOSIS_PROMPT,
+        "recommendation_system": COMPACT_RECOMMENDATION_SYSTEM_PROMPT,
+        "recommendation_user": COMPACT_RECOMMENDATION_USER_TEMPLATE,
+        "recommendation_retry": COMPACT_RECOMMENDATION_RETRY_PROMPT,
+    },
+}
+
+@lru_cache(maxsize=32)
+def parse_variant_weights(spec):
+    """
+    Parse PROMPT_VARIANT into variant weights
+    
+    Parsed once per distinct setting, so a malformed one is logged once rather
+    than on every request.
+    
+    Args:
+        spec: A single variant name ("compact") or an A/B split ("default=80,compact=20")
+        
+    Returns:
+        Tuple of (variant, weight) tuples; unknown variants and non-positive weights are skipped
+    """
+    weights = []
+    for item in (spec or "").split(","):
+        name, sep, weight = item.partition("=")
+        name = name.strip()
+        if not name and not sep:
+            continue
+        if name not in PROMPT_VARIANTS:
+            logger.warning(f"Ignoring unknown prompt variant {item.strip()!r} in PROMPT_VARIANT={spec!r}, "
+                           f"expected one of {', '.join(PROMPT_VARIANTS)}")
+            continue
+        try:
+            weight = float(weight) if sep else 1.0
+        except ValueError:
+            logger.warning(f"Ignoring invalid weight in {item.strip()!r} of PROMPT_VARIANT={spec!r}")
+            continue
+        if weight > 0:
+            weights.append((name, weight))
+    if not weights:
+        if spec:
+            logger.warning(f"PROMPT_VARIANT={spec!r} names no usable variant, using default")
+        return (("default", 1.0),)
+    return tuple(weights)
+
+def choose_prompt_variant(spec, key=None):
+    """
+    Pick the prompt variant of a request
+    
+    Args:
+        spec: PROMPT_VARIANT setting
+        key: Stable assignment key (e.g. the session ID), so every turn of a
+            session uses the same variant; a random variant is picked without one
+        
+    Returns:
+        Variant name, a key of PROMPT_VARIANTS
+    """
+    weights = parse_variant_weights(spec)
+    if len(weights) == 1:
+        return weights[0][0]
+    total = sum(weight for _, weight in weights)
+    if key:
+        digest = hashlib.sha256(key.encode("utf-8")).digest()
+        point = int.from_bytes(digest[:8], "big") / 2 ** 64 * total
+    else:
+        point = random.random() * total
+    for name, weight in weights:
+        point -= weight
+        if point < 0:
+            return name
+    return weights[-1][0]
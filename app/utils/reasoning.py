@@ -0,0 +1,99 @@
+"""
+Separation of reasoning output from answer text for R1-style models.
+
+Reasoning models return their chain of thought either as `reasoning_content`
+deltas or inline inside a <think>...</think> block of the content. ReasoningFilter
+splits a stream incrementally (tags may be cut across chunks); strip_reasoning does
+the same for a complete text.
+"""
+
+from typing import Tuple
+
+# How reasoning is handled in streamed responses:
+#   drop  - discard it, only answer tokens are sent
+#   event - send it as separate "reasoning" SSE events
+#   keep  - forward it inline as before
+REASONING_MODES = ("drop", "event", "keep")
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+def strip_reasoning(text: str) -> str:
+    """Remove <think> blocks from a complete model output"""
+    if not text or THINK_CLOSE not in text:
+        return text
+    answer_parts = []
+    rest = text
+    while True:
+        open_index = rest.find(THINK_OPEN)
+        close_index = rest.find(THINK_CLOSE)
+        if close_index < 0:
+            answer_parts.append(rest)
+            break
+        # A close tag without an open tag: the template opened the block in the prompt
+        start = open_index if 0 <= open_index < close_index else 0
+        answer_parts.append(rest[:start])
+        rest = rest[close_index + len(THINK_CLOSE):]
+    return "".join(answer_parts).lstrip()
+
+class ReasoningFilter:
+    """Incrementally split streamed deltas into (reasoning, answer) text"""
+
+    def __init__(self):
+        self._in_think = False
+        self._pending = ""
+        self._answer_started = False
+        self.reasoning_chars = 0
+
+    def feed(self, delta) -> Tuple[str, str]:
+        """
+        Split one streamed delta
+
+        Args:
+            delta: Chunk delta carrying `content` and optionally `reasoning_content`
+
+        Returns:
+            Tuple of (reasoning text, answer text), either may be empty
+        """
+        reasoning = getattr(delta, "reasoning_content", None) or ""
+        inline_reasoning, answer = self._split(delta.content or "")
+        reasoning += inline_reasoning
+        self.reasoning_chars += len(reasoning)
+        return reasoning, self._answer(answer)
+
+    def flush(self) -> Tuple[str, str]:
+        """Return text held back while waiting for a possible tag at the end of the stream"""
+        pending, self._pending = self._pending, ""
+        if self._in_think:
+            return pending, ""
+        return "", self._answer(pending)
+
+    def _answer(self, text: str) -> str:
+        # Drop the blank lines models put between the reasoning and the answer
+        if not self._answer_started:
+            text = text.lstrip()
+            self._answer_started = bool(text)
+        return text
+
+    def _split(self, text: str) -> Tuple[str, str]:
+        text = self._pending + text
+        self._pending = ""
+        reasoning_parts, answer_parts = [], []
+        while text:
+            tag = THINK_CLOSE if self._in_think else THINK_OPEN
+            parts = reasoning_parts if self._in_think else answer_parts
+            index = text.find(tag)
+            if index >= 0:
+                parts.append(text[:index])
+                text = text[index + len(tag):]
+                self._in_think = not self._in_think
+                continue
+            # Hold back a trailing partial tag until the next delta
+            for size in range(min(len(tag) - 1, len(text)), 0, -1):
+                if text.endswith(tag[:size]):
+                    self._pending = text[-size:]
+                    text = text[:-size]
+                    break
+            parts.append(text)
+            break
+        return "".join(reasoning_parts), "".join(answer_parts)
@@ -0,0 +1,182 @@
+"""
+Traffic recorder for offline performance regression runs.
+
+When RECORD_PATH is set, every upstream exchange is appended to a JSONL file
+together with the body of the API request that caused it. Streamed responses are
+stored chunk by chunk with their time offset from the upstream call and the full
+delta (reasoning_content and tool calls included) plus the usage-only chunk, and
+non-streamed responses with the whole message, so the replayer can reproduce
+production-shaped traffic deterministically. Lines are written by a background
+thread; requests only put the record on a bounded queue.
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+from .config import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Records waiting to be written before new ones are dropped
+RECORD_BUFFER_SIZE = 10000
+
+# Recording of the API request currently being processed
+_current_recording: ContextVar[Optional[Dict[str, Any]]] = ContextVar("current_recording", default=None)
+
+def upstream_key(messages: List[Dict[str, str]]) -> str:
+    """Stable key identifying an upstream prompt, shared with the replay upstream"""
+    canonical = json.dumps(messages, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+# Queue item telling the writer to finish
+_STOP = object()
+
+def _as_dict(value) -> Optional[Dict[str, Any]]:
+    """Upstream object (pydantic model or dict) as a plain dict"""
+    if value is None or isinstance(value, dict):
+        return value
+    return value.model_dump(exclude_none=True)
+
+class TrafficRecorder:
+    """Append-only JSONL recorder of API request bodies and upstream responses"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def begin(self, endpoint: str, body: Dict[str, Any]):
+        """Mark the start of an API request whose upstream calls should be recorded"""
+        if not self.enabled:
+            return
+        _current_recording.set({
+            "request_id": uuid.uuid4().hex,
+            "endpoint": endpoint,
+            "body": body,
+            "received_at": time.time(),
+        })
+
+    def record_response(self, messages: List[Dict[str, str]], model: str, elapsed: float, response):
+        """Record a non-streaming upstream exchange as the upstream returned it"""
+        recording = _current_recording.get()
+        if recording is None:
+            return
+        choice = response.choices[0]
+        message = _as_dict(choice.message)
+        self._write(recording, {
+            "key": upstream_key(messages),
+            "model": model,
+            "stream": False,
+            "latency": round(elapsed, 4),
+            "content": message.get("content"),
+            "message": message,
+            "finish_reason": choice.finish_reason,
+            "usage": _as_dict(response.usage),
+        })
+
+    def wrap_stream(self, messages: List[Dict[str, str]], model: str, started: float, stream):
+        """Return the stream unchanged, recording chunk content and timing as it is consumed"""
+        recording = _current_recording.get()
+        if recording is None:
+            return stream
+        return self._recording_stream(recording, upstream_key(messages), model, started, stream)
+
+    async def _recording_stream(self, recording: Dict[str, Any], key: str, model: str, started: float, stream):
+        # [offset, delta (None for a chunk without choices), finish_reason, usage]
+        chunks = []
+        try:
+            async for chunk in stream:
+                offset = round(time.perf_counter() - started, 4)
+                usage = _as_dict(getattr(chunk, "usage", None))
+                if chunk.choices:
+                    choice = chunk.choices[0]
+                    chunks.append([offset, _as_dict(choice.delta), choice.finish_reason, usage])
+                elif usage is not None:
+                    chunks.append([offset, None, None, usage])
+                yield chunk
+        finally:
+            self._write(recording, {
+                "key": key,
+                "model": model,
+                "stream": True,
+                "chunks": chunks,
+            })
+
+    def _write(self, recording: Dict[str, Any], upstream: Dict[str, Any]):
+        """Queue a record for the writer thread"""
+        if not self.enabled:
+            return
+        record = {
+            "request_id": recording["request_id"],
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+            "received_at": recording["received_at"],
+            "endpoint": recording["endpoint"],
+            "body": recording["body"],
+            "upstream": upstream,
+        }
+        try:
+            self._writer_queue().put_nowait((self.path, record))
+        except queue.Full:
+            metrics.inc("record_dropped_total")
+
+    def _writer_queue(self) -> queue.Queue:
+        """Start the writer thread on first use (again in a forked worker)"""
+        if self._thread is None or self._pid != os.getpid():
+            with self._start_lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=RECORD_BUFFER_SIZE)
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.close)
+        return self._queue
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            # Write everything queued meanwhile in one go, grouped by file
+            lines: Dict[str, List[str]] = {}
+            while item is not _STOP:
+                path, record = item
+                lines.setdefault(path, []).append(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            stop = item is _STOP
+            for path, batch in lines.items():
+                try:
+                    with open(path, "a", encoding="utf-8") as f:
+                        f.writelines(batch)
+                except OSError as e:
+                    logger.error(f"Failed to write traffic recording: {str(e)}")
+
+    def close(self):
+        """Write the queued records and stop the writer"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._thread = None
+        self._queue.put(_STOP)
+        thread.join(timeout=30)
+
+# Create recorder instance
+recorder = TrafficRecorder(settings.record_path)
@@ -0,0 +1,40 @@
+"""
+Reference extraction from eye doctor answers.
+"""
+
+from typing import Dict, Any, List
+
+REFERENCE_MARKER = "参考资料"
+
+def extract_references(content: str) -> List[Dict[str, Any]]:
+    """
+    Extract the references listed after the "参考资料" marker
+
+    Each reference line is expected as "- title, source, year".
+
+    Args:
+        content: Complete answer text
+
+    Returns:
+        List of reference dictionaries with title, source and optional year
+    """
+    references = []
+    # Simple reference extraction logic - could be more sophisticated
+    if REFERENCE_MARKER not in content:
+        return references
+
+    ref_section = content.rsplit(REFERENCE_MARKER, 1)[-1]
+    ref_lines = [line.strip() for line in ref_section.split("\n") if line.strip()]
+    for line in ref_lines:
+        parts = line.split(",")
+        if len(parts) >= 2:
+            ref = {"title": parts[0].strip("- ")}
+            if len(parts) > 1:
+                ref["source"] = parts[1].strip()
+            if len(parts) > 2:
+                try:
+                    ref["year"] = int(parts[2].strip())
+                except ValueError:
+                    pass
+            references.append(ref)
+    return references
@@ -1,6 +1,7 @@
 from nacos import NacosException, NacosClient
 from apscheduler.schedulers.background import BackgroundScheduler
 from app.utils.config import settings
+from app.utils.load_monitor import load_monitor
 import time
 
 
@@ -15,6 +16,15 @@ Local_IP = settings.local_ip
 #服务器运行端口
 Port = settings.port
 
+# 实例元数据：健康检查地址以及当前负载状态
+def instance_metadata(service_port):
+    return {
+        "health_check_url": f"http://{Local_IP}:{service_port}/health",
+        "ready_url": f"http://{Local_IP}:{service_port}/ready",
+        "cluster": "default",
+        **load_monitor.metadata()
+    }
+
 # 初始化应用
 def init_app():
     service_port = Port
@@ -29,10 +39,8 @@ def init_app():
             ip=Local_IP,
             port=service_port,  # ✅ 每个端口单独注册
             group_name=NACOS_GROUP_NAME,
-            metadata={
-                "health_check_url": f"http://{Local_IP}:{service_port}/health",
-                "cluster": "default"
-            }
+            weight=load_monitor.weight,
+            metadata=instance_metadata(service_port)
         )
         print(f"✅ 端口 {service_port} 注册成功")
     except NacosException as e:
@@ -44,12 +52,28 @@ def init_app():
     scheduler.start()
 
 def send_heartbeat(nacos_client, service_port):
+    # 负载分数和权重由应用内的定时任务计算，这里只在权重变化后更新实例权重和元数据
+    if load_monitor.take_weight_change():
+        try:
+            nacos_client.modify_naming_instance(
+                service_name=NACOS_SERVICE_NAME,
+                ip=Local_IP,
+                port=service_port,
+                group_name=NACOS_GROUP_NAME,
+                weight=load_monitor.weight,
+                metadata=instance_metadata(service_port)
+            )
+            print(f"✅ 端口 {service_port} 权重更新为 {load_monitor.weight}（{load_monitor.status()['state']}）")
+        except NacosException as e:
+            print(f"❌ 端口 {service_port} 权重更新失败: {str(e)}")
     try:
         nacos_client.send_heartbeat(
             service_name=NACOS_SERVICE_NAME,
             ip=Local_IP,
             port=service_port,
-            group_name=NACOS_GROUP_NAME
+            group_name=NACOS_GROUP_NAME,
+            weight=load_monitor.weight,
+            metadata=instance_metadata(service_port)
         )
         # print(f"✅ 端口 {service_port} 心跳发送成功")
     except NacosException as e:
@@ -0,0 +1,289 @@
+"""
+Structured output helpers for AI recommendations.
+
+Builds the provider parameters for JSON mode or tool calling, and validates the
+model output against AIRecommendationResponse with a precompiled TypeAdapter,
+falling back to local JSON repair for truncated or lightly malformed output.
+"""
+
+from typing import Dict, Any, Optional, Tuple
+from pydantic import TypeAdapter, ValidationError
+
+from ..models.eye_doctor import AIRecommendationResponse
+from .json_repair import loads_lenient
+from .reasoning import strip_reasoning, THINK_OPEN
+
+# Supported structured output modes:
+#   json_object - provider JSON mode (response_format)
+#   tool        - forced function call whose arguments follow the response schema
+#   prompt      - rely on prompt wording only
+STRUCTURED_OUTPUT_MODES = ("json_object", "tool", "prompt")
+
+RECOMMENDATION_TOOL_NAME = "submit_recommendations"
+
+# Validator compiled once at import instead of on every response
+RECOMMENDATION_ADAPTER = TypeAdapter(AIRecommendationResponse)
+
+REQUIRED_MEDICATION_FIELDS = ("medication_name", "dosage", "frequency")
+
+def structured_output_params(mode: str) -> Optional[Dict[str, Any]]:
+    """Return the extra upstream request parameters for a structured output mode"""
+    if mode == "json_object":
+        return {"response_format": {"type": "json_object"}}
+    if mode == "tool":
+        return {
+            "tools": [{
+                "type": "function",
+                "function": {
+                    "name": RECOMMENDATION_TOOL_NAME,
+                    "description": "提交用药和治疗建议",
+                    "parameters": AIRecommendationResponse.model_json_schema(),
+                },
+            }],
+            "tool_choice": {"type": "function", "function": {"name": RECOMMENDATION_TOOL_NAME}},
+        }
+    return None
+
+def parse_recommendations(content: str) -> Tuple[Dict[str, Any], bool]:
+    """
+    Validate model output as recommendations, repairing it locally if needed
+
+    Args:
+        content: Raw model output (JSON text, possibly wrapped or truncated)
+
+    Returns:
+        Tuple of (validated recommendations dict, whether repair was needed)
+
+    Raises:
+        ValueError: If the output cannot be turned into valid recommendations
+    """
+    content = strip_reasoning(content)
+    try:
+        return RECOMMENDATION_ADAPTER.validate_json(content).model_dump(), False
+    except ValidationError:
+        pass
+
+    data, _ = loads_lenient(content)
+    if not isinstance(data, dict):
+        raise ValueError("Response is not a JSON object")
+
+    # Drop medications that were cut off before all required fields were generated
+    medications = data.get("medications")
+    if isinstance(medications, list):
+        data["medications"] = [
+            med for med in medications
+            if isinstance(med, dict) and all(field in med for field in REQUIRED_MEDICATION_FIELDS)
+        ]
+
+    try:
+        return RECOMMENDATION_ADAPTER.validate_python(data).model_dump(), True
+    except ValidationError as e:
+        missing = ", ".join(".".join(str(p) for p in err["loc"]) for err in e.errors())
+        raise ValueError(f"Invalid recommendations format: {missing}")
+
+# Non-whitespace text allowed before the JSON object starts (outside <think> blocks)
+MAX_PREAMBLE_CHARS = 500
+
+# JSON type of a value, by its first character
+_VALUE_TYPES = {'"': "string", '{': "object", '[': "array", 't': "boolean", 'f': "boolean", 'n': "null", '-': "number"}
+
+def _resolve(node: Optional[Dict[str, Any]], defs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Follow $ref and single-element allOf wrappers of a JSON schema node"""
+    while node is not None:
+        if "$ref" in node:
+            node = defs[node["$ref"].rsplit("/", 1)[-1]]
+        elif len(node.get("allOf", ())) == 1:
+            node = node["allOf"][0]
+        else:
+            return node
+    return None
+
+def _allowed_types(node: Optional[Dict[str, Any]], defs: Dict[str, Any]) -> Optional[set]:
+    """JSON types a schema node accepts, or None if it accepts anything"""
+    node = _resolve(node, defs)
+    if node is None:
+        return None
+    if "anyOf" in node:
+        types = set()
+        for option in node["anyOf"]:
+            option_types = _allowed_types(option, defs)
+            if option_types is None:
+                return None
+            types |= option_types
+        return types
+    if "type" not in node:
+        return None
+    return {"number", "integer"} if node["type"] in ("number", "integer") else {node["type"]}
+
+class _Frame:
+    """An open object or array of the output being validated"""
+
+    __slots__ = ("container", "node", "state", "key", "keys", "lenient_items", "deferred", "problem")
+
+    def __init__(self, container: str, node: Optional[Dict[str, Any]], deferred: bool = False):
+        self.container = container
+        self.node = node
+        # object: key, colon, value, after; array: value, after
+        self.state = "key" if container == '{' else "value"
+        self.key = None
+        self.keys = set()
+        # Items of this array that don't validate are dropped by the local repair
+        self.lenient_items = False
+        # Problems are only fatal once this object turns out to be complete
+        self.deferred = deferred
+        self.problem = None
+
+class RecommendationStreamValidator:
+    """
+    Check generated recommendations against the response schema while they stream
+
+    feed() takes each piece of generated text and returns the reason the output
+    can no longer become valid recommendations, or None while it still can. Only
+    violations parse_recommendations could not repair are reported: a missing or
+    wrongly typed top-level field or treatment plan field, a complete medication
+    with a wrongly typed field, an unquoted key, or prose instead of JSON.
+    Medications cut off before their required fields are dropped by the repair,
+    so they are let through.
+    """
+
+    _schema = AIRecommendationResponse.model_json_schema()
+
+    def __init__(self):
+        self._defs = self._schema.get("$defs", {})
+        self._stack = []
+        self._preamble = ""
+        self._started = False
+        self._done = False
+        self._in_string = False
+        self._escape = False
+        self._key_parts = None
+        self.chars = 0
+
+    def feed(self, text: str) -> Optional[str]:
+        """Validate the next piece of output, returning why it is invalid or None"""
+        self.chars += len(text)
+        if self._done:
+            return None
+        if not self._started:
+            text = self._skip_preamble(text)
+            if text is None:
+                return None if len(self._preamble_answer().strip()) <= MAX_PREAMBLE_CHARS else "no JSON object in output"
+        for char in text:
+            problem = self._feed_char(char)
+            if problem or self._done:
+                return problem
+        return None
+
+    def _preamble_answer(self) -> str:
+        """Preamble text outside <think> blocks; an unclosed block hides everything after it"""
+        text = strip_reasoning(self._preamble)
+        open_index = text.find(THINK_OPEN)
+        return text[:open_index] if open_index >= 0 else text
+
+    def _skip_preamble(self, text: str) -> Optional[str]:
+        """Buffer text until the root object starts, returning the text after its '{'"""
+        self._preamble += text
+        answer = self._preamble_answer()
+        start = answer.find('{')
+        if start < 0:
+            return None
+        # The root object starts at the first '{' of the answer, as in extract_json_text
+        self._started = True
+        self._stack.append(_Frame('{', _resolve(self._schema, self._defs)))
+        self._preamble = ""
+        return answer[start + 1:]
+
+    def _feed_char(self, char: str) -> Optional[str]:
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._key_parts is not None:
+                    frame = self._stack[-1]
+                    frame.key = "".join(self._key_parts)
+                    frame.keys.add(frame.key)
+                    frame.state = "colon"
+                    self._key_parts = None
+                return None
+            if self._key_parts is not None:
+                self._key_parts.append(char)
+            return None
+
+        if char in ' \t\r\n':
+            return None
+        frame = self._stack[-1]
+        if char in '}]':
+            return self._close()
+        if frame.state == "after":
+            # Anything but a separator continues the scalar value just started
+            if char == ',':
+                frame.state = "key" if frame.container == '{' else "value"
+            return None
+        if frame.state == "key":
+            if char == '"':
+                self._in_string = True
+                self._key_parts = []
+                return None
+            if char == ',':
+                return None
+            return f"unquoted key in {self._path(self._stack[:-1])}"
+        if frame.state == "colon":
+            if char == ':':
+                frame.state = "value"
+            return None
+        return self._start_value(char)
+
+    def _start_value(self, char: str) -> Optional[str]:
+        frame = self._stack[-1]
+        value_type = "number" if char.isdigit() else _VALUE_TYPES.get(char, "invalid")
+        node = None
+        if frame.node is not None:
+            if frame.container == '{':
+                node = (frame.node.get("properties") or {}).get(frame.key)
+            else:
+                node = frame.node.get("items")
+        allowed = _allowed_types(node, self._defs)
+
+        if allowed is not None and value_type not in allowed:
+            problem = f"{self._path(self._stack)} is {value_type}, expected {' or '.join(sorted(allowed))}"
+            if frame.container == '[' and frame.lenient_items:
+                # The repair drops this item, so its content no longer matters
+                problem = None
+            elif not frame.deferred:
+                return problem
+            frame.problem = frame.problem or problem
+            node = None
+
+        frame.state = "after"
+        if value_type == "string":
+            self._in_string = True
+        elif char in '{[':
+            child = _Frame(char, _resolve(node, self._defs), deferred=frame.lenient_items)
+            # Incomplete medications are dropped by the repair, as in parse_recommendations
+            child.lenient_items = char == '[' and len(self._stack) == 1 and frame.key == "medications"
+            self._stack.append(child)
+        return None
+
+    def _close(self) -> Optional[str]:
+        frame = self._stack.pop()
+        if frame.container == '{' and frame.node is not None:
+            missing = [field for field in frame.node.get("required", ()) if field not in frame.keys]
+            if frame.deferred:
+                # Dropped by the repair when incomplete, fatal when complete but invalid
+                if not missing and frame.problem:
+                    return frame.problem
+            elif missing:
+                return f"{self._path(self._stack)} is missing {', '.join(missing)}"
+        if not self._stack:
+            self._done = True
+            return None
+        return None
+
+    @staticmethod
+    def _path(frames) -> str:
+        """Location of the value the innermost of the frames is at, e.g. medications[].dosage"""
+        path = "".join(f".{frame.key}" if frame.container == '{' else "[]" for frame in frames)
+        return path.lstrip(".") or "response"
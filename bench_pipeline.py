@@ -0,0 +1,96 @@
+"""
+Microbenchmark for the eye doctor request-to-upstream pipeline
+
+Compares the legacy path (request.model_dump() -> Message objects -> model_dump())
+with the direct path that builds the upstream messages from the validated request.
+Reports CPU time and peak transient allocation per request. No network access is required.
+
+Usage:
+    python bench_pipeline.py [iterations] [history_turns]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from app.models.chat import Message
+from app.models.eye_doctor import EyeDoctorRequest
+from app.utils.prompts import construct_prompt, construct_messages
+
+def build_request(history_turns: int) -> EyeDoctorRequest:
+    """Build a representative request with the given number of history turns"""
+    conversations = []
+    for i in range(history_turns):
+        conversations.append({"role": "user", "content": f"第{i}个问题：这个病严重吗？"})
+        conversations.append({
+            "role": "assistant",
+            "content": "根据您的眼底检查结果，您目前处于轻度糖尿病视网膜病变阶段。" * 4
+        })
+
+    return EyeDoctorRequest(
+        disease_name="糖尿病视网膜病变",
+        disease_category="视网膜疾病",
+        result="根据眼部图像分析，患者出现轻度糖尿病视网膜病变，建议定期复查，控制血糖。",
+        remark="患者需要定期监测血糖和眼部状况",
+        treatment_plan={"treatment_detail": "每天使用人工泪液，避免长时间用眼，定期复查"},
+        medications=[{
+            "medication_name": "人工泪液",
+            "dosage": "每次1-2滴",
+            "frequency": "每天4次",
+            "side_effects": "轻微刺痛感"
+        }],
+        previous_conversations=conversations,
+        question="我平时用药需要注意什么？"
+    )
+
+def legacy_pipeline(request: EyeDoctorRequest):
+    """Reproduce the copies made by the original dict-based pipeline"""
+    request_data = request.model_dump()
+    system_prompt, user_message = construct_prompt(request)
+    messages = [Message(role="system", content=system_prompt)]
+    for msg in request_data.get('previous_conversations') or []:
+        role = msg.get('role')
+        content = msg.get('content')
+        if role in ['user', 'assistant'] and content:
+            messages.append(Message(role=role, content=content))
+    messages.append(Message(role="user", content=user_message))
+    return [msg.model_dump() for msg in messages]
+
+def direct_pipeline(request: EyeDoctorRequest):
+    """Current pipeline: validated request straight to the upstream payload"""
+    return construct_messages(request)
+
+def measure(func, request, iterations: int):
+    """Return (microseconds per call, peak transient bytes per call)"""
+    # Warm up
+    for _ in range(100):
+        func(request)
+
+    start = time.process_time()
+    for _ in range(iterations):
+        func(request)
+    cpu_us = (time.process_time() - start) / iterations * 1e6
+
+    sample = max(iterations // 10, 1)
+    peak_total = 0
+    tracemalloc.start()
+    for _ in range(sample):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func(request)
+        peak_total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return cpu_us, peak_total / sample
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    history_turns = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    request = build_request(history_turns)
+    assert legacy_pipeline(request) == direct_pipeline(request)
+
+    print(f"iterations={iterations} history_turns={history_turns}")
+    print(f"{'pipeline':<10}{'cpu us/req':>14}{'peak bytes/req':>16}")
+    for name, func in (("legacy", legacy_pipeline), ("direct", direct_pipeline)):
+        cpu_us, peak = measure(func, request, iterations)
+        print(f"{name:<10}{cpu_us:>14.2f}{peak:>16.0f}")
@@ -0,0 +1,267 @@
+"""
+Bulk processing of recommendation and eye doctor cases
+
+Reads a JSONL file of AIRecommendationRequest or EyeDoctorRequest records and runs
+them through LLMService directly (no HTTP API) with bounded concurrency and an
+optional request rate limit, writing one JSONL result per case as it finishes.
+
+The output file doubles as the checkpoint: when it already exists, cases whose
+result is in it are skipped, so an interrupted run (Ctrl+C, crash, deploy) is
+resumed by running the same command again. Failed cases are retried on resume
+only with --retry-failed (the newer line for a case supersedes the older one).
+
+Each input line is either the request itself or {"id": ..., "request": {...}}.
+Without an "id", the line number is used. The request type is detected from the
+fields (patient_info -> recommendations, question -> eye doctor) unless --kind
+is given.
+
+Usage:
+    python bulk_process.py cases.jsonl --output results.jsonl --concurrency 8 --rate 5
+    python bulk_process.py cases.jsonl --output results.jsonl --retry-failed
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, Set, Tuple
+
+from pydantic import ValidationError
+
+from app.models.eye_doctor import AIRecommendationRequest, EyeDoctorRequest
+from app.services.llm_service import llm_service
+from app.utils.metrics import percentile
+from app.utils.references import extract_references
+
+KINDS = ("recommendations", "eye-doctor")
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 10
+
+class RateLimiter:
+    """Spread request starts evenly at no more than `rate` per second (0 = unlimited)"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+class Stats:
+    """Counters and latencies of the current run"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.retries = 0
+        self.latencies = []
+        self.errors = Counter()
+
+    @property
+    def processed(self) -> int:
+        return self.succeeded + self.failed
+
+    def throughput(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+def read_checkpoint(path: str, retry_failed: bool) -> Set[str]:
+    """
+    Return the IDs of cases already in the output file
+
+    A partially written last line (interrupted write) is cut off so appending
+    continues on a clean line.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+    for line in data.decode("utf-8").splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("status") == "ok" or not retry_failed:
+            done.add(str(record.get("id")))
+    return done
+
+def parse_case(line_number: int, line: str, kind: Optional[str]) -> Tuple[str, str, Any]:
+    """
+    Turn an input line into (case id, kind, validated request)
+
+    Raises:
+        ValueError: If the line is not valid JSON or not a valid request
+    """
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON: {str(e)}")
+    if not isinstance(record, dict):
+        raise ValueError("Input line is not a JSON object")
+    case_id = str(record.get("id", line_number))
+    body = record.get("request", {k: v for k, v in record.items() if k != "id"})
+    if not isinstance(body, dict):
+        raise ValueError("Request is not a JSON object")
+    if kind is None:
+        kind = "recommendations" if "patient_info" in body else "eye-doctor"
+    try:
+        if kind == "recommendations":
+            return case_id, kind, AIRecommendationRequest.model_validate(body)
+        return case_id, kind, EyeDoctorRequest.model_validate(body)
+    except ValidationError as e:
+        raise ValueError(f"Invalid {kind} request: {e.errors()[0]['msg']}")
+
+async def run_case(kind: str, request) -> Dict[str, Any]:
+    """Run one case through the LLM service"""
+    if kind == "recommendations":
+        result = await llm_service.get_eye_doctor_recommendations(request=request, stream=False)
+        return result["recommendations"]
+    result = await llm_service.get_eye_doctor_completion(
+        request=request,
+        model=request.model,
+        temperature=request.temperature,
+        max_tokens=request.max_tokens
+    )
+    content = result["message"]["content"]
+    return {
+        "content": content,
+        "references": extract_references(content),
+        "usage": result.get("usage"),
+    }
+
+async def process(case_id: str, kind: str, request, args, limiter: RateLimiter, stats: Stats) -> Dict[str, Any]:
+    """Run a case with retries and return its output record"""
+    start = time.monotonic()
+    error = None
+    for attempt in range(args.retries + 1):
+        if attempt:
+            stats.retries += 1
+            await asyncio.sleep(min(2 ** attempt, 30))
+        await limiter.acquire()
+        try:
+            result = await run_case(kind, request)
+            latency = time.monotonic() - start
+            stats.succeeded += 1
+            stats.latencies.append(latency)
+            return {"id": case_id, "kind": kind, "status": "ok", "result": result,
+                    "attempts": attempt + 1, "latency_seconds": round(latency, 3),
+                    "finished_at": datetime.now(timezone.utc).isoformat()}
+        except Exception as e:
+            error = str(e)
+    stats.failed += 1
+    stats.errors[error[:120]] += 1
+    return {"id": case_id, "kind": kind, "status": "error", "error": error,
+            "attempts": args.retries + 1, "latency_seconds": round(time.monotonic() - start, 3),
+            "finished_at": datetime.now(timezone.utc).isoformat()}
+
+async def report_progress(stats: Stats):
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        print(f"... {stats.processed} done ({stats.failed} failed, {stats.skipped} skipped), "
+              f"{stats.throughput():.2f} cases/s")
+
+def print_summary(stats: Stats, output: str):
+    elapsed = time.monotonic() - stats.started
+    latencies = sorted(stats.latencies)
+    print(f"\nProcessed {stats.processed} cases in {elapsed:.1f}s ({stats.throughput():.2f} cases/s)")
+    print(f"  succeeded: {stats.succeeded}")
+    print(f"  failed:    {stats.failed}")
+    print(f"  skipped:   {stats.skipped} (already in {output})")
+    print(f"  retries:   {stats.retries}")
+    if latencies:
+        print(f"  latency:   p50 {percentile(latencies, 50):.2f}s, p95 {percentile(latencies, 95):.2f}s, "
+              f"max {latencies[-1]:.2f}s")
+    if stats.errors:
+        print("  top errors:")
+        for error, count in stats.errors.most_common(5):
+            print(f"    {count:5d}  {error}")
+
+async def main(args):
+    done = read_checkpoint(args.output, args.retry_failed)
+    stats = Stats()
+    limiter = RateLimiter(args.rate)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency * 2)
+
+    with open(args.output, "a", encoding="utf-8") as out:
+        def write(record: Dict[str, Any]):
+            # One flushed line per case: the output file is the checkpoint
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+        async def worker():
+            while True:
+                case = await queue.get()
+                try:
+                    write(await process(*case, args, limiter, stats))
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(args.concurrency)]
+        progress = asyncio.create_task(report_progress(stats))
+        queued = 0
+        try:
+            with open(args.input, encoding="utf-8") as f:
+                for line_number, line in enumerate(f, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        case_id, kind, request = parse_case(line_number, line, args.kind)
+                    except ValueError as e:
+                        # Record unusable input once so it isn't reported again on every resume
+                        case_id = str(line_number)
+                        if case_id not in done:
+                            stats.failed += 1
+                            stats.errors[str(e)[:120]] += 1
+                            write({"id": case_id, "status": "error", "error": str(e)})
+                        continue
+                    if case_id in done:
+                        stats.skipped += 1
+                        continue
+                    if args.limit and queued >= args.limit:
+                        break
+                    await queue.put((case_id, kind, request))
+                    queued += 1
+            await queue.join()
+        finally:
+            for task in workers + [progress]:
+                task.cancel()
+            print_summary(stats, args.output)
+
+    if stats.failed:
+        print(f"\nRerun with --retry-failed to retry the failed cases")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run recommendation or eye doctor cases in bulk")
+    parser.add_argument("input", help="JSONL file of AIRecommendationRequest or EyeDoctorRequest records")
+    parser.add_argument("--output", required=True, help="JSONL results file, also used to resume")
+    parser.add_argument("--kind", choices=KINDS, help="Request type (detected per line by default)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=0.0, help="Maximum requests started per second (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=2, help="Retries per case on upstream errors")
+    parser.add_argument("--retry-failed", action="store_true", help="Run cases that failed in an earlier run again")
+    parser.add_argument("--limit", type=int, default=0, help="Stop after this many cases (0 = all)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        print("\nInterrupted, run the same command again to resume")
@@ -0,0 +1,124 @@
+"""
+Local stand-in for the networked shared cache
+
+A minimal in-memory server speaking the Redis protocol, implementing the
+commands the service uses (GET, SET with EX/PX, DEL) plus PING, AUTH and SELECT,
+with LRU eviction beyond --max-keys. It lets CACHE_L2_BACKEND=redis be developed
+and tested without a Redis installation.
+
+Usage:
+    python cache_server.py --port 6390 --max-keys 100000
+
+Then start the workers against it:
+    CACHE_L2_BACKEND=redis CACHE_REDIS_URL=redis://127.0.0.1:6390/0 uvicorn app.main:app --workers 4
+"""
+
+import argparse
+import asyncio
+import time
+from collections import OrderedDict
+
+class Store:
+    """Keys with optional expiry, least recently used evicted first"""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+
+    def get(self, key: bytes):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: bytes, value: bytes, ttl_seconds=None):
+        self.entries[key] = (value, time.time() + ttl_seconds if ttl_seconds is not None else None)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_keys:
+            self.entries.popitem(last=False)
+
+    def delete(self, keys) -> int:
+        return sum(1 for key in keys if self.entries.pop(key, None) is not None)
+
+def encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, Exception):
+        return f"-ERR {reply}\r\n".encode()
+    if isinstance(reply, str):
+        return f"+{reply}\r\n".encode()
+    return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+def execute(store: Store, args):
+    command = args[0].upper()
+    if command == b"PING":
+        return "PONG"
+    if command in (b"AUTH", b"SELECT"):
+        return "OK"
+    if command == b"GET" and len(args) == 2:
+        return store.get(args[1])
+    if command == b"SET" and len(args) in (3, 5):
+        ttl = None
+        if len(args) == 5:
+            unit = args[3].upper()
+            if unit not in (b"EX", b"PX"):
+                return ValueError("syntax error")
+            ttl = int(args[4]) / (1000 if unit == b"PX" else 1)
+        store.set(args[1], args[2], ttl)
+        return "OK"
+    if command == b"DEL" and len(args) >= 2:
+        return store.delete(args[1:])
+    return ValueError(f"unknown command or wrong number of arguments for '{command.decode(errors='replace')}'")
+
+async def read_command(reader: asyncio.StreamReader):
+    """Read one command sent as a RESP array of bulk strings"""
+    line = await reader.readuntil(b"\r\n")
+    if not line.startswith(b"*"):
+        # Inline command, e.g. from telnet
+        return line.strip().split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        length = int((await reader.readuntil(b"\r\n"))[1:-2])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+def make_handler(store: Store):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                args = await read_command(reader)
+                if args:
+                    writer.write(encode(execute(store, args)))
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+    return handle
+
+async def main(args):
+    store = Store(args.max_keys)
+    server = await asyncio.start_server(make_handler(store), args.host, args.port)
+    print(f"Cache server listening on {args.host}:{args.port} (max {args.max_keys} keys)")
+    async with server:
+        await server.serve_forever()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="In-memory stand-in for the shared cache (Redis protocol)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    parser.add_argument("--max-keys", type=int, default=100000, help="Keys kept before the least recently used are evicted")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        pass
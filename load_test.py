@@ -0,0 +1,212 @@
+"""
+Load generator for the Chat API Service
+
+Drives the chat, eye doctor and recommendation endpoints in standard and streaming
+mode at a target concurrency and reports throughput, p50/p95/p99 latency, time to
+first token and service-side CPU per request (read from the /metrics endpoint).
+Results can be saved as a JSON baseline and compared against a previous run.
+
+Usage:
+    python load_test.py --concurrency 20 --requests 200 --output baseline.json
+    python load_test.py --concurrency 20 --requests 200 --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+from app.utils.metrics import percentile
+
+API_BASE = os.getenv('API_BASE', 'http://localhost:8000')
+
+CHAT_PAYLOAD = {
+    "messages": [{"role": "user", "content": "请简单介绍一下干眼症。"}],
+    "temperature": 0.7
+}
+
+EYE_DOCTOR_PAYLOAD = {
+    "disease_name": "糖尿病视网膜病变",
+    "disease_category": "视网膜疾病",
+    "result": "根据眼部图像分析，患者出现轻度糖尿病视网膜病变，建议定期复查，控制血糖。",
+    "remark": "患者需要定期监测血糖和眼部状况",
+    "treatment_plan": {"treatment_detail": "每天使用人工泪液，避免长时间用眼，定期复查"},
+    "medications": [{
+        "medication_name": "人工泪液",
+        "dosage": "每次1-2滴",
+        "frequency": "每天4次",
+        "side_effects": "轻微刺痛感"
+    }],
+    "previous_conversations": [
+        {"role": "user", "content": "这个病严重吗？"},
+        {"role": "assistant", "content": "您目前处于轻度糖尿病视网膜病变阶段，需要引起重视并定期复查。"}
+    ],
+    "question": "我平时需要注意些什么？"
+}
+
+RECOMMENDATION_PAYLOAD = {
+    "disease_name": "干眼症",
+    "disease_category": "角膜疾病",
+    "result": "泪膜破裂时间缩短，角膜荧光素染色阳性",
+    "patient_info": {"name": "张三", "sex": "男", "age": 45}
+}
+
+ENDPOINTS = {
+    "chat": ("/api/chat/completions", CHAT_PAYLOAD),
+    "eye": ("/api/eye-doctor/chat", EYE_DOCTOR_PAYLOAD),
+    "recommend": ("/api/eye-doctor/recommendations", RECOMMENDATION_PAYLOAD),
+}
+
+def summarize(latencies: List[float], ttfts: List[float], errors: int, elapsed: float, cpu_seconds: Optional[float]) -> Dict[str, Any]:
+    """Build the result record of one scenario"""
+    completed = len(latencies)
+    latencies, ttfts = sorted(latencies), sorted(ttfts)
+    return {
+        "requests": completed + errors,
+        "errors": errors,
+        "throughput_rps": round(completed / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p95": percentile(ttfts, 95),
+        "ttft_p99": percentile(ttfts, 99),
+        "service_cpu_ms_per_request": (
+            round(cpu_seconds / completed * 1000, 3) if cpu_seconds is not None and completed else None
+        ),
+    }
+
+async def service_cpu_seconds(client: httpx.AsyncClient, target: str) -> Optional[float]:
+    """Read the service process CPU time from /metrics"""
+    try:
+        response = await client.get(f"{target}/metrics")
+        return response.json()["process_cpu_seconds"]
+    except Exception:
+        return None
+
+async def send_request(client: httpx.AsyncClient, url: str, payload: Dict[str, Any], stream: bool):
+    """Send one request and return (latency, ttft); raises on failure"""
+    start = time.perf_counter()
+    body = dict(payload, stream=stream)
+    if not stream:
+        response = await client.post(url, json=body)
+        response.raise_for_status()
+        latency = time.perf_counter() - start
+        return latency, latency
+
+    ttft = None
+    async with client.stream("POST", url, json=body) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if ttft is None and line.startswith("data: ") and line[6:].strip() not in ("", "[DONE]"):
+                ttft = time.perf_counter() - start
+    latency = time.perf_counter() - start
+    return latency, ttft if ttft is not None else latency
+
+async def run_scenario(target: str, endpoint: str, stream: bool, concurrency: int, total: int, timeout: float) -> Dict[str, Any]:
+    """Run one endpoint/mode combination at the requested concurrency"""
+    path, payload = ENDPOINTS[endpoint]
+    url = f"{target}{path}"
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    errors = 0
+    remaining = total
+
+    limits = httpx.Limits(max_connections=concurrency + 1, max_keepalive_connections=concurrency + 1)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                try:
+                    latency, ttft = await send_request(client, url, payload, stream)
+                    latencies.append(latency)
+                    ttfts.append(ttft)
+                except Exception:
+                    errors += 1
+
+        cpu_before = await service_cpu_seconds(client, target)
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        cpu_after = await service_cpu_seconds(client, target)
+
+    cpu_seconds = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return summarize(latencies, ttfts, errors, elapsed, cpu_seconds)
+
+def print_report(results: Dict[str, Dict[str, Any]]):
+    """Print a table of scenario results"""
+    def fmt(value, scale=1000):
+        return "-" if value is None else f"{value * scale:.0f}"
+
+    print(f"{'scenario':<24}{'req':>6}{'err':>5}{'rps':>9}{'p50ms':>8}{'p95ms':>8}{'p99ms':>8}{'ttft50':>8}{'ttft95':>8}{'cpu ms':>8}")
+    for name, r in results.items():
+        cpu = r["service_cpu_ms_per_request"]
+        print(
+            f"{name:<24}{r['requests']:>6}{r['errors']:>5}{r['throughput_rps']:>9.2f}"
+            f"{fmt(r['latency_p50']):>8}{fmt(r['latency_p95']):>8}{fmt(r['latency_p99']):>8}"
+            f"{fmt(r['ttft_p50']):>8}{fmt(r['ttft_p95']):>8}{'-' if cpu is None else f'{cpu:.2f}':>8}"
+        )
+
+def print_comparison(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any]):
+    """Print relative changes against a saved baseline"""
+    print(f"\nComparison with baseline from {baseline.get('timestamp')}:")
+    for name, r in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        changes = []
+        for key in ("throughput_rps", "latency_p95", "ttft_p95", "service_cpu_ms_per_request"):
+            old, new = base.get(key), r.get(key)
+            if old and new is not None:
+                changes.append(f"{key} {(new - old) / old * 100:+.1f}%")
+        print(f"  {name}: {', '.join(changes)}")
+
+async def main(args):
+    results = {}
+    for endpoint in args.endpoints.split(","):
+        for mode in args.modes.split(","):
+            name = f"{endpoint}-{mode}"
+            print(f"Running {name} ...", flush=True)
+            results[name] = await run_scenario(
+                args.target, endpoint, mode == "stream", args.concurrency, args.requests, args.timeout
+            )
+
+    print()
+    print_report(results)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(results, json.load(f))
+
+    if args.output:
+        record = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "target": args.target,
+            "concurrency": args.concurrency,
+            "requests_per_scenario": args.requests,
+            "scenarios": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the Chat API Service")
+    parser.add_argument("--target", default=API_BASE)
+    parser.add_argument("--endpoints", default="chat,eye,recommend", help="Comma separated: chat,eye,recommend")
+    parser.add_argument("--modes", default="standard,stream", help="Comma separated: standard,stream")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="Save results as a JSON baseline")
+    parser.add_argument("--compare", help="Compare against a saved JSON baseline")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,378 @@
+"""
+Mock OpenAI-compatible chat completions server
+
+Stands in for the upstream model gateway so the service can be benchmarked
+without network access or token cost. Time to first token, generation speed,
+error rate and rate limiting are configurable from the command line.
+
+Usage:
+    python mock_upstream.py --port 9000 --ttft 0.3 --tps 40 --error-rate 0.01 --rate-limit 50
+
+Then start the service against it:
+    BASE_URL=http://127.0.0.1:9000/v1 API_KEY=mock python run.py
+
+With --prompt-tps the mock also charges prompt processing time before the first
+token; --prefix-cache simulates an upstream prompt cache that skips that cost for
+the longest previously seen message prefix and reports it as cached_tokens.
+
+With --replay the server reproduces upstream responses captured by the traffic
+recorder (RECORD_PATH), including chunk timing, optionally sped up with --speed:
+    python mock_upstream.py --replay recordings.jsonl --speed 2
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+import uuid
+from collections import deque, defaultdict
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Canned answers returned by the mock
+CHAT_ANSWER = (
+    "根据您的检查结果，目前病情处于早期阶段，整体可控。"
+    "建议您按时用药，避免长时间用眼，保持规律作息，并定期到医院复查。"
+    "如果出现视力突然下降、眼前黑影增多等情况，请及时就医。\n\n"
+    "参考资料\n- 中国糖尿病视网膜病变临床诊疗指南,中华医学会眼科学分会,2022\n"
+)
+
+RECOMMENDATION_ANSWER = json.dumps({
+    "medications": [
+        {
+            "medication_name": "玻璃酸钠滴眼液",
+            "dosage": "每次1滴",
+            "frequency": "每日4次",
+            "side_effects": "偶见眼部刺激感"
+        }
+    ],
+    "treatment_plan": {
+        "treatment_type": "药物治疗",
+        "treatment_detail": "规律使用人工泪液，减少屏幕时间，一个月后复查。"
+    }
+}, ensure_ascii=False)
+
+logger = logging.getLogger("mock_upstream")
+
+class MockConfig:
+    """Behaviour knobs of the mock upstream"""
+
+    def __init__(self, ttft: float, tps: float, error_rate: float, rate_limit: float, tokens_per_chunk: int,
+                 prompt_tps: float = 0.0, prefix_cache: bool = False, reasoning_tokens: int = 0):
+        self.ttft = ttft
+        self.reasoning_tokens = reasoning_tokens
+        self.prompt_tps = prompt_tps
+        self.prefix_cache = prefix_cache
+        self.tps = tps
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.tokens_per_chunk = tokens_per_chunk
+
+class RateLimiter:
+    """Sliding one-second window request limiter"""
+
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.window = deque()
+
+    def allow(self) -> bool:
+        if self.limit <= 0:
+            return True
+        now = time.monotonic()
+        while self.window and now - self.window[0] > 1.0:
+            self.window.popleft()
+        if len(self.window) >= self.limit:
+            return False
+        self.window.append(now)
+        return True
+
+class PrefixCache:
+    """Remembers message prefixes to simulate upstream prompt caching"""
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self.seen = set()
+
+    def cached_tokens(self, messages) -> int:
+        """Return the pseudo token count of the longest cached prefix and cache this prompt"""
+        cached = 0
+        prefix_tokens = 0
+        digest = hashlib.sha1()
+        hit = True
+        for message in messages:
+            digest.update(json.dumps(message, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+            key = digest.hexdigest()
+            prefix_tokens += len(message.get("content") or "")
+            if hit and key in self.seen:
+                cached = prefix_tokens
+            else:
+                hit = False
+                if len(self.seen) < self.max_entries:
+                    self.seen.add(key)
+        return cached
+
+def replay_key(messages) -> str:
+    """Prompt key; must match app.utils.recorder.upstream_key"""
+    canonical = json.dumps(messages, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+class ReplayStore:
+    """Recorded upstream exchanges indexed by prompt key"""
+
+    def __init__(self, path: str, speed: float):
+        self.speed = speed if speed > 0 else 1.0
+        self.exchanges = defaultdict(list)
+        self.positions = defaultdict(int)
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    upstream = json.loads(line)["upstream"]
+                    self.exchanges[upstream["key"]].append(upstream)
+
+    def lookup(self, messages):
+        """Return the next recorded exchange for the prompt, cycling deterministically"""
+        key = replay_key(messages)
+        candidates = self.exchanges.get(key)
+        if not candidates:
+            return None
+        position = self.positions[key]
+        self.positions[key] = position + 1
+        return candidates[position % len(candidates)]
+
+    def timeline(self, exchange):
+        """Return [(offset seconds, delta or None, finish_reason, usage)] scaled by the replay speed"""
+        if exchange["stream"]:
+            chunks = exchange["chunks"]
+        else:
+            message = exchange.get("message") or {"role": "assistant", "content": exchange["content"] or ""}
+            chunks = [[exchange["latency"], message, exchange.get("finish_reason") or "stop", exchange.get("usage")]]
+        timeline = []
+        for chunk in chunks:
+            offset, delta, finish_reason = chunk[:3]
+            # Older recordings kept only the content of each chunk
+            if isinstance(delta, str):
+                delta = {"content": delta}
+            timeline.append((offset / self.speed, delta, finish_reason, chunk[3] if len(chunk) > 3 else None))
+        return timeline
+
+def merge_deltas(deltas) -> dict:
+    """Join streamed deltas into one message"""
+    message = {"role": "assistant", "content": ""}
+    for delta in deltas:
+        for field in ("content", "reasoning_content"):
+            if delta.get(field):
+                message[field] = message.get(field, "") + delta[field]
+        if delta.get("tool_calls"):
+            message["tool_calls"] = delta["tool_calls"]
+    return message
+
+def pick_answer(payload: dict) -> str:
+    """Return the canned answer matching the request type"""
+    messages = payload.get("messages") or []
+    system_prompt = messages[0].get("content", "") if messages else ""
+    if '"medications"' in system_prompt:
+        return RECOMMENDATION_ANSWER
+    return CHAT_ANSWER
+
+def tokenize(text: str, max_tokens):
+    """Split text into pseudo tokens (one character each) honouring max_tokens"""
+    tokens = list(text)
+    if max_tokens is not None and len(tokens) > max_tokens:
+        return tokens[:max_tokens], "length"
+    return tokens, "stop"
+
+def create_app(config: MockConfig, replay: ReplayStore = None) -> FastAPI:
+    """Create the mock upstream application"""
+    app = FastAPI(title="Mock OpenAI Upstream")
+    limiter = RateLimiter(config.rate_limit)
+    prefix_cache = PrefixCache() if config.prefix_cache else None
+
+    async def replay_response(payload: dict, exchange: dict, completion_id: str, created: int, model: str):
+        timeline = replay.timeline(exchange)
+        started = time.perf_counter()
+
+        if not payload.get("stream"):
+            message = merge_deltas(delta for _, delta, _, _ in timeline if delta)
+            usage = exchange.get("usage") or next((usage for *_, usage in reversed(timeline) if usage), None) or {
+                "prompt_tokens": 0,
+                "completion_tokens": len(message["content"]),
+                "total_tokens": len(message["content"]),
+            }
+            finish_reason = next((reason for _, _, reason, _ in reversed(timeline) if reason), "stop")
+            await asyncio.sleep(timeline[-1][0] if timeline else 0)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": finish_reason,
+                }],
+                "usage": usage,
+            }
+
+        async def generate():
+            for offset, delta, finish_reason, usage in timeline:
+                delay = offset - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [] if delta is None else [{
+                        "index": 0,
+                        "delta": delta,
+                        "finish_reason": finish_reason,
+                    }],
+                }
+                if usage:
+                    chunk["usage"] = usage
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    @app.post("/v1/chat/completions")
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+
+        if not limiter.allow():
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": "1"},
+                content={"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}},
+            )
+        if random.random() < config.error_rate:
+            return JSONResponse(
+                status_code=500,
+                content={"error": {"message": "Injected upstream error", "type": "server_error"}},
+            )
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = payload.get("model", "mock-model")
+
+        if replay is not None:
+            exchange = replay.lookup(payload.get("messages") or [])
+            if exchange is not None:
+                return await replay_response(payload, exchange, completion_id, created, model)
+            logger.warning("No recorded exchange for prompt, falling back to synthetic answer")
+        tokens, finish_reason = tokenize(pick_answer(payload), payload.get("max_tokens"))
+        messages = payload.get("messages") or []
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages)
+        cached_tokens = prefix_cache.cached_tokens(messages) if prefix_cache else 0
+        # R1-style reasoning emitted as reasoning_content before the answer
+        reasoning = ["思考"] * config.reasoning_tokens
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(reasoning) + len(tokens),
+            "total_tokens": prompt_tokens + len(reasoning) + len(tokens),
+        }
+        if prefix_cache:
+            usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+        token_interval = 1.0 / config.tps if config.tps > 0 else 0.0
+        ttft = config.ttft
+        if config.prompt_tps > 0:
+            ttft += (prompt_tokens - cached_tokens) / config.prompt_tps
+
+        if not payload.get("stream"):
+            await asyncio.sleep(ttft + token_interval * (len(reasoning) + len(tokens)))
+            message = {"role": "assistant", "content": "".join(tokens)}
+            if reasoning:
+                message["reasoning_content"] = "".join(reasoning)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": finish_reason,
+                }],
+                "usage": usage,
+            }
+
+        async def generate():
+            await asyncio.sleep(ttft)
+            step = max(config.tokens_per_chunk, 1)
+            for i in range(0, len(reasoning), step):
+                if i:
+                    await asyncio.sleep(token_interval * step)
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"content": None, "reasoning_content": "".join(reasoning[i:i + step])},
+                        "finish_reason": None,
+                    }],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            for i in range(0, len(tokens), step):
+                if i:
+                    await asyncio.sleep(token_interval * step)
+                is_last = i + step >= len(tokens)
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"content": "".join(tokens[i:i + step])},
+                        "finish_reason": finish_reason if is_last else None,
+                    }],
+                }
+                if is_last:
+                    chunk["usage"] = usage
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    return app
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--ttft", type=float, default=0.3, help="Seconds before the first token")
+    parser.add_argument("--tps", type=float, default=40.0, help="Generated tokens per second (0 = instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 500")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Requests per second before 429 (0 = unlimited)")
+    parser.add_argument("--tokens-per-chunk", type=int, default=1, help="Tokens per streamed chunk")
+    parser.add_argument("--prompt-tps", type=float, default=0.0, help="Prompt tokens processed per second (0 = free)")
+    parser.add_argument("--prefix-cache", action="store_true", help="Simulate upstream prompt prefix caching")
+    parser.add_argument("--reasoning-tokens", type=int, default=0,
+                        help="Reasoning tokens streamed as reasoning_content before the answer")
+    parser.add_argument("--replay", help="Serve responses recorded with RECORD_PATH")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed factor (2 = twice as fast)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = MockConfig(
+        ttft=args.ttft,
+        tps=args.tps,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        tokens_per_chunk=args.tokens_per_chunk,
+        prompt_tps=args.prompt_tps,
+        prefix_cache=args.prefix_cache,
+        reasoning_tokens=args.reasoning_tokens,
+    )
+    replay = ReplayStore(args.replay, args.speed) if args.replay else None
+    uvicorn.run(create_app(config, replay), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,130 @@
+"""
+Batch job that pre-generates FAQ answers for common diseases
+
+For every (disease, intent) pair it asks the LLM the representative question of
+that specialized prompt family and writes the answers to the FAQ store file read
+by the service (FAQ_STORE_PATH). The file is replaced atomically, so running
+instances pick up the new version on their next refresh.
+
+Usage:
+    python precompute_faq.py --diseases "糖尿病视网膜病变:视网膜疾病,干眼症:角膜疾病" --output faq_store.json
+    python precompute_faq.py --diseases-file diseases.txt --output faq_store.json
+
+diseases.txt contains one "disease_name,disease_category" per line.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+from app.models.eye_doctor import EyeDoctorRequest
+from app.services.faq_store import FINDINGS_INTENTS, faq_key
+from app.services.llm_service import llm_service
+from app.utils.config import settings
+from app.utils.prompts import classify_intent
+from app.utils.references import extract_references
+
+# Questions served from the store for each specialized prompt family; the first
+# one is asked to generate the answer, the others are equivalent phrasings.
+# Explanation and prognosis answers depend on the patient's findings and are
+# never served from the store (FINDINGS_INTENTS), so they are not generated.
+INTENT_QUESTIONS = {
+    "treatment": ["这个病怎么治？", "这个病怎么治疗？"],
+    "medication": ["用药需要注意什么？"],
+    "prevention": ["日常生活中应该如何预防和护眼？"],
+}
+
+def check_intent_questions():
+    """Make sure every question is classified as the intent it is stored under"""
+    for intent, questions in INTENT_QUESTIONS.items():
+        if intent in FINDINGS_INTENTS:
+            raise SystemExit(f"Intent {intent} depends on the patient's findings and can't be precomputed")
+        for question in questions:
+            if classify_intent(question) != intent:
+                raise SystemExit(f"Question {question!r} is classified as {classify_intent(question)}, not {intent}")
+
+def parse_diseases(args):
+    """Return a list of (disease_name, disease_category)"""
+    entries = []
+    if args.diseases:
+        entries.extend(item for item in args.diseases.split(",") if item.strip())
+    if args.diseases_file:
+        with open(args.diseases_file, encoding="utf-8") as f:
+            entries.extend(line.strip().replace(",", ":", 1) for line in f if line.strip())
+    diseases = []
+    for entry in entries:
+        name, _, category = entry.partition(":")
+        diseases.append((name.strip(), category.strip() or "眼科疾病"))
+    return diseases
+
+async def generate_answer(disease_name: str, disease_category: str, intent: str, semaphore: asyncio.Semaphore):
+    """Generate the generic answer for one (disease, intent) pair"""
+    request = EyeDoctorRequest(
+        disease_name=disease_name,
+        disease_category=disease_category,
+        result="未提供具体检查结果，请给出针对该疾病的通用解答",
+        question=INTENT_QUESTIONS[intent][0],
+    )
+    async with semaphore:
+        result = await llm_service.get_eye_doctor_completion(request=request, temperature=0.3)
+    content = result["message"]["content"]
+    return {
+        "disease_name": disease_name,
+        "intent": intent,
+        "questions": INTENT_QUESTIONS[intent],
+        "content": content,
+        "references": extract_references(content),
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+async def main(args):
+    diseases = parse_diseases(args)
+    if not diseases:
+        raise SystemExit("No diseases given, use --diseases or --diseases-file")
+    check_intent_questions()
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    tasks = {}
+    for disease_name, disease_category in diseases:
+        for intent in INTENT_QUESTIONS:
+            tasks[faq_key(disease_name, intent)] = asyncio.create_task(
+                generate_answer(disease_name, disease_category, intent, semaphore)
+            )
+
+    start = time.time()
+    entries = {}
+    failures = 0
+    for key, task in tasks.items():
+        try:
+            entries[key] = await task
+            print(f"✅ {key}")
+        except Exception as e:
+            failures += 1
+            print(f"❌ {key}: {str(e)}")
+
+    store = {
+        "version": datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S"),
+        "model": settings.openai_default_model,
+        "entries": entries,
+    }
+    tmp_path = f"{args.output}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(store, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, args.output)
+
+    print(f"\nWrote {len(entries)} answers ({failures} failed) to {args.output} "
+          f"as version {store['version']} in {time.time() - start:.1f}s")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pre-generate FAQ answers for common diseases")
+    parser.add_argument("--diseases", help='Comma separated "name:category" list')
+    parser.add_argument("--diseases-file", help='File with one "name,category" per line')
+    parser.add_argument("--output", default=settings.faq_store_path or "faq_store.json")
+    parser.add_argument("--concurrency", type=int, default=4)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
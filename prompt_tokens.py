@@ -0,0 +1,148 @@
+"""
+Token footprint of the prompt templates
+
+Counts the tokens of every template in app/utils/prompts.py for each prompt
+variant, lists module-level templates that no variant uses, and counts the
+complete upstream messages assembled for a typical request of each question
+type, prompt layout and variant, so the saving of a variant can be checked
+before it is A/B-tested with PROMPT_VARIANT.
+
+Tokens are counted with tiktoken when it is installed (--encoding); otherwise a
+heuristic is used (one token per CJK character, one per four other characters),
+which is close enough to compare templates but not an exact upstream count.
+
+Usage:
+    python prompt_tokens.py
+    python prompt_tokens.py --encoding o200k_base --json
+"""
+
+import argparse
+import json
+import math
+from typing import Dict, Any, List
+
+from app.models.eye_doctor import AIRecommendationRequest, EyeDoctorRequest
+from app.utils import prompts
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Tokens the chat format adds around each message (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+LAYOUTS = ("legacy", "prefix")
+
+# A typical question for each specialized prompt family, and one without
+SAMPLE_QUESTIONS = {
+    "explanation": "这是什么病？为什么会得这个病？",
+    "treatment": "这个病怎么治？需要手术吗？",
+    "medication": "用药需要注意什么？",
+    "prevention": "日常生活中应该如何护眼？",
+    "prognosis": "这个病严重吗？会影响视力吗？",
+    "general": "多久需要复查一次？",
+}
+
+SAMPLE_PATIENT = {
+    "disease_name": "糖尿病视网膜病变",
+    "disease_category": "视网膜疾病",
+    "result": "双眼视网膜可见散在微血管瘤及点状出血，黄斑区未见明显水肿",
+    "remark": "糖尿病病史8年，血糖控制一般",
+    "treatment_plan": {"treatment_type": "药物治疗", "treatment_detail": "控制血糖血压，羟苯磺酸钙口服，3个月后复查眼底"},
+    "medications": [
+        {"medication_name": "羟苯磺酸钙胶囊", "dosage": "0.5g", "frequency": "每日3次", "side_effects": "胃肠不适"},
+    ],
+}
+
+SAMPLE_RECOMMENDATION = {
+    "disease_name": "细菌性结膜炎",
+    "disease_category": "结膜疾病",
+    "result": "右眼结膜充血，有黏脓性分泌物，角膜透明",
+    "patient_info": {"name": "张三", "sex": "男", "age": 35},
+}
+
+def is_cjk(char: str) -> bool:
+    return "⺀" <= char <= "鿿" or "豈" <= char <= "﫿" or "＀" <= char <= "￯"
+
+class TokenCounter:
+    """Count tokens with tiktoken, or estimate them without it"""
+
+    def __init__(self, encoding: str):
+        self.encoding = tiktoken.get_encoding(encoding) if tiktoken else None
+        self.method = f"tiktoken {encoding}" if self.encoding else "heuristic estimate"
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        cjk = sum(1 for char in text if is_cjk(char))
+        return cjk + math.ceil((len(text) - cjk) / 4)
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        return sum(self.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+def template_report(counter: TokenCounter) -> Dict[str, Any]:
+    """Tokens of each template per variant, and the templates no variant uses"""
+    variants = list(prompts.PROMPT_VARIANTS)
+    templates = {}
+    for name in prompts.PROMPT_VARIANTS["default"]:
+        templates[name] = {variant: counter.count(prompts.PROMPT_VARIANTS[variant][name]) for variant in variants}
+    used = {id(text) for templates_of in prompts.PROMPT_VARIANTS.values() for text in templates_of.values()}
+    unused = {
+        name: counter.count(value) for name, value in vars(prompts).items()
+        if name.isupper() and isinstance(value, str) and id(value) not in used
+    }
+    return {"templates": templates, "unused": unused}
+
+def assembled_report(counter: TokenCounter) -> Dict[str, Any]:
+    """Tokens of the complete messages of a typical request per question type, layout and variant"""
+    variants = list(prompts.PROMPT_VARIANTS)
+    report = {}
+    for intent, question in SAMPLE_QUESTIONS.items():
+        request = EyeDoctorRequest(question=question, **SAMPLE_PATIENT)
+        for layout in LAYOUTS:
+            report[f"eye_doctor/{intent}/{layout}"] = {
+                variant: counter.count_messages(prompts.construct_messages(request, layout=layout, variant=variant))
+                for variant in variants
+            }
+    request = AIRecommendationRequest(**SAMPLE_RECOMMENDATION)
+    report["recommendations"] = {
+        variant: counter.count_messages(prompts.construct_recommendation_messages(request, variant))
+        for variant in variants
+    }
+    return report
+
+def print_table(title: str, rows: Dict[str, Dict[str, int]], variants: List[str]):
+    print(f"\n{title}")
+    width = max(len(name) for name in rows) + 2
+    print("".ljust(width) + "".join(variant.rjust(10) for variant in variants) + "saving".rjust(10))
+    for name, counts in rows.items():
+        baseline, smallest = counts["default"], min(counts.values())
+        saving = f"{(baseline - smallest) / baseline:.0%}" if baseline else "-"
+        print(name.ljust(width) + "".join(str(counts[variant]).rjust(10) for variant in variants) + saving.rjust(10))
+
+def main(args):
+    counter = TokenCounter(args.encoding)
+    templates = template_report(counter)
+    assembled = assembled_report(counter)
+    if args.json:
+        print(json.dumps({"method": counter.method, **templates, "assembled": assembled}, ensure_ascii=False, indent=2))
+        return
+
+    variants = list(prompts.PROMPT_VARIANTS)
+    print(f"Token counts ({counter.method})")
+    print_table("Templates", templates["templates"], variants)
+    print_table("Assembled prompts (all messages)", assembled, variants)
+    if templates["unused"]:
+        print("\nTemplates not used by any variant")
+        for name, tokens in templates["unused"].items():
+            print(f"  {name}: {tokens}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Report the token footprint of the prompt templates")
+    parser.add_argument("--encoding", default="cl100k_base", help="tiktoken encoding (ignored without tiktoken)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    main(parse_args())
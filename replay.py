@@ -0,0 +1,129 @@
+"""
+Replay recorded traffic against the Chat API Service
+
+Reads a JSONL file written by the traffic recorder (RECORD_PATH) and sends the
+recorded request bodies to the service again. Run the service against
+`mock_upstream.py --replay <file>` so upstream responses are reproduced
+deterministically and the run needs no network access.
+
+Usage:
+    python mock_upstream.py --port 9000 --replay recordings.jsonl --speed 1
+    BASE_URL=http://127.0.0.1:9000/v1 API_KEY=mock python run.py
+    python replay.py recordings.jsonl --pace original --speed 1 --output replay.json
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Any, List
+
+import httpx
+
+from load_test import API_BASE, summarize, service_cpu_seconds, send_request, print_report, print_comparison
+
+def load_requests(path: str) -> List[Dict[str, Any]]:
+    """Return one entry per recorded API request, ordered by arrival time"""
+    requests = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            # A request may have made several upstream calls; replay its body once
+            requests.setdefault(record["request_id"], {
+                "endpoint": record["endpoint"],
+                "body": record["body"],
+                "received_at": record["received_at"],
+            })
+    return sorted(requests.values(), key=lambda r: r["received_at"])
+
+async def replay(args) -> Dict[str, Dict[str, Any]]:
+    """Send the recorded requests and collect per-scenario statistics"""
+    entries = load_requests(args.recordings)
+    if not entries:
+        return {}
+
+    latencies = defaultdict(list)
+    ttfts = defaultdict(list)
+    errors = defaultdict(int)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    speed = args.speed if args.speed > 0 else 1.0
+    first_arrival = entries[0]["received_at"]
+
+    limits = httpx.Limits(max_connections=args.concurrency + 1, max_keepalive_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+
+        async def send(entry):
+            stream = bool(entry["body"].get("stream"))
+            name = f"{entry['endpoint'].rsplit('/', 1)[-1]}-{'stream' if stream else 'standard'}"
+            if args.pace == "original":
+                delay = (entry["received_at"] - first_arrival) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            async with semaphore:
+                try:
+                    latency, ttft = await send_request(client, f"{args.target}{entry['endpoint']}", entry["body"], stream)
+                    latencies[name].append(latency)
+                    ttfts[name].append(ttft)
+                except Exception:
+                    errors[name] += 1
+
+        cpu_before = await service_cpu_seconds(client, args.target)
+        start = time.perf_counter()
+        await asyncio.gather(*(send(entry) for entry in entries))
+        elapsed = time.perf_counter() - start
+        cpu_after = await service_cpu_seconds(client, args.target)
+
+    cpu_seconds = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    results = {}
+    for name in sorted(set(latencies) | set(errors)):
+        results[name] = summarize(latencies[name], ttfts[name], errors[name], elapsed, None)
+    results["all"] = summarize(
+        [v for values in latencies.values() for v in values],
+        [v for values in ttfts.values() for v in values],
+        sum(errors.values()),
+        elapsed,
+        cpu_seconds,
+    )
+    return results
+
+async def main(args):
+    results = await replay(args)
+    print_report(results)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(results, json.load(f))
+
+    if args.output:
+        record = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "target": args.target,
+            "recordings": args.recordings,
+            "pace": args.pace,
+            "speed": args.speed,
+            "scenarios": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay recorded traffic against the service")
+    parser.add_argument("recordings", help="JSONL file written by the traffic recorder")
+    parser.add_argument("--target", default=API_BASE)
+    parser.add_argument("--pace", choices=["original", "max"], default="original",
+                        help="Keep the recorded inter-arrival times or send as fast as concurrency allows")
+    parser.add_argument("--speed", type=float, default=1.0, help="Arrival-time speed factor for --pace original")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="Save results as a JSON baseline")
+    parser.add_argument("--compare", help="Compare against a saved JSON baseline")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
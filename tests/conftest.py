@@ -0,0 +1,76 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+# Settings refuse to load without an API key; nothing in the tests reaches the upstream
+os.environ.setdefault("API_KEY", "test")
+# Importing the app registers with Nacos; point it at a closed port so it fails fast
+os.environ.setdefault("NACOS_SERVER_ADDRESS", "127.0.0.1")
+os.environ.setdefault("NACOS_PORT", "1")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+def make_chunk(content=None, finish_reason=None, usage=None, choices=True):
+    """Build an upstream stream chunk"""
+    return ChatCompletionChunk.model_validate({
+        "id": "chunk",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "test-model",
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}] if choices else [],
+        "usage": usage,
+    })
+
+async def iterate(items):
+    for item in items:
+        yield item
+
+async def collect(stream):
+    return [item async for item in stream]
+
+class FakeUpstream:
+    """
+    Stand-in for the AsyncOpenAI client
+
+    Streams `pieces` as chunks (the last one with finish_reason "stop"), sleeping
+    `delays[i]` seconds before piece i, or answers with their concatenation when
+    not streaming. `error` is raised by every call instead.
+    """
+
+    def __init__(self, pieces=("回答",), delays=(), usage=None, error=None):
+        self.pieces = list(pieces)
+        self.delays = list(delays)
+        self.usage = usage
+        self.error = error
+        self.calls = []
+        self.chat = SimpleNamespace(completions=self)
+
+    def with_options(self, **kwargs):
+        return self
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.error is not None:
+            raise self.error
+        if kwargs.get("stream"):
+            return self._stream()
+        return ChatCompletion.model_validate({
+            "id": "completion",
+            "object": "chat.completion",
+            "created": 0,
+            "model": kwargs["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(self.pieces)},
+                         "finish_reason": "stop"}],
+            "usage": self.usage,
+        })
+
+    async def _stream(self):
+        for i, piece in enumerate(self.pieces):
+            if i < len(self.delays):
+                await asyncio.sleep(self.delays[i])
+            yield make_chunk(piece, finish_reason="stop" if i == len(self.pieces) - 1 else None)
+        if self.usage:
+            yield make_chunk(choices=False, usage=self.usage)
@@ -0,0 +1,147 @@
+import contextvars
+import glob
+import gzip
+import json
+import os
+import time
+
+import pytest
+
+from app.services import audit_log as audit_log_module
+from app.services.audit_log import INDEX_SUFFIX, AuditLog, answer_from_sse, search
+
+MESSAGES = [{"role": "user", "content": "干眼症怎么治？"}]
+
+SSE = (
+    b'data: {"choices":[{"index":0,"delta":{"role":"assistant","content":"\xe7\x83\xad"},"finish_reason":null}]}\n\n'
+    b'data: {"choices":[{"index":0,"delta":{"content":"\xe6\x95\xb7"},"finish_reason":"stop"}]}\n\n'
+    b'data: {"choices":[],"usage":{"prompt_tokens":5,"completion_tokens":2,"total_tokens":7}}\n\n'
+    b"data: [DONE]\n\n"
+)
+
+
+def make_log(path, compression="gzip", segment_max_bytes=1 << 20, flush_seconds=0.05):
+    return AuditLog(str(path), compression, segment_max_bytes, segment_max_seconds=3600, buffer_size=100,
+                    flush_seconds=flush_seconds)
+
+
+def record(log, response_id, answer="热敷", **fields):
+    """Record one answer under its own response ID, as a request would"""
+    def run():
+        log.begin("/api/eye-doctor/chat", response_id)
+        log.record(MESSAGES, answer, model="test-model", **fields)
+    contextvars.copy_context().run(run)
+
+
+def segments(path):
+    return sorted(p for p in glob.glob(os.path.join(path, "audit-*")) if not p.endswith(INDEX_SUFFIX))
+
+
+def test_disabled_log_records_nothing(tmp_path):
+    log = make_log("")
+    record(log, "r1")
+    assert log._thread is None
+
+
+def test_close_flushes_buffered_records(tmp_path):
+    log = make_log(tmp_path, flush_seconds=30)
+    for i in range(3):
+        record(log, f"r{i}", answer=f"回答{i}")
+    log.close()
+
+    found = search(str(tmp_path))
+    assert [r["response_id"] for r in found] == ["r0", "r1", "r2"]
+    assert found[0]["endpoint"] == "/api/eye-doctor/chat"
+    assert found[0]["messages"] == MESSAGES and found[2]["answer"] == "回答2"
+
+
+def test_gzip_segment_decompresses_as_a_whole(tmp_path):
+    log = make_log(tmp_path)
+    record(log, "r1")
+    time.sleep(0.2)
+    record(log, "r2")
+    log.close()
+
+    [segment] = segments(tmp_path)
+    assert segment.endswith(".jsonl.gz")
+    with gzip.open(segment, "rt", encoding="utf-8") as f:
+        assert [json.loads(line)["response_id"] for line in f] == ["r1", "r2"]
+
+
+def test_zstd_segment_round_trip(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    log = make_log(tmp_path, compression="zstd")
+    record(log, "r1")
+    log.close()
+
+    [segment] = segments(tmp_path)
+    assert segment.endswith(".jsonl.zst")
+    with open(segment, "rb") as f:
+        lines = zstandard.ZstdDecompressor().stream_reader(f).read().splitlines()
+    assert json.loads(lines[0])["response_id"] == "r1"
+    assert search(str(tmp_path), response_id="r1")[0]["answer"] == "热敷"
+
+
+def test_zstd_without_the_package_falls_back_to_gzip(tmp_path, monkeypatch):
+    monkeypatch.setattr(audit_log_module, "zstandard", None)
+    log = make_log(tmp_path, compression="zstd")
+    record(log, "r1")
+    log.close()
+
+    [segment] = segments(tmp_path)
+    assert segment.endswith(".jsonl.gz")
+    assert search(str(tmp_path), response_id="r1")[0]["answer"] == "热敷"
+
+
+def test_segments_rotate_at_their_size_limit(tmp_path):
+    log = make_log(tmp_path, segment_max_bytes=1)
+    for response_id in ("r1", "r2", "r3"):
+        record(log, response_id)
+        time.sleep(0.2)
+    log.close()
+
+    assert len(segments(tmp_path)) == 3
+    assert [r["response_id"] for r in search(str(tmp_path))] == ["r1", "r2", "r3"]
+
+
+def test_search_by_response_id_and_time_range(tmp_path):
+    log = make_log(tmp_path, segment_max_bytes=1)
+    record(log, "early")
+    time.sleep(0.2)
+    middle = time.time()
+    for i in range(5):
+        record(log, f"r{i}")
+    log.close()
+
+    assert [r["answer"] for r in search(str(tmp_path), response_id="r3")] == ["热敷"]
+    assert search(str(tmp_path), response_id="missing") == []
+    assert [r["response_id"] for r in search(str(tmp_path), until=middle)] == ["early"]
+    assert len(search(str(tmp_path), since=middle)) == 5
+    assert len(search(str(tmp_path), since=middle, limit=2)) == 2
+
+
+def test_search_skips_index_lines_still_being_written(tmp_path):
+    log = make_log(tmp_path)
+    record(log, "r1")
+    log.close()
+    [segment] = segments(tmp_path)
+    with open(segment + INDEX_SUFFIX, "a", encoding="utf-8") as index:
+        index.write("r2\t123")
+    assert [r["response_id"] for r in search(str(tmp_path))] == ["r1"]
+
+
+def test_passthrough_stream_is_reassembled(tmp_path):
+    log = make_log(tmp_path)
+    record(log, "r1", answer=None, source="passthrough", sse=SSE)
+    log.close()
+
+    [found] = search(str(tmp_path), response_id="r1")
+    assert found["answer"] == "热敷"
+    assert found["finish_reason"] == "stop"
+    assert found["usage"]["completion_tokens"] == 2
+    assert "sse" not in found
+
+
+def test_answer_from_sse_ignores_partial_and_non_data_events():
+    raw = b": comment\n\n" + SSE + b'data: {"choices":[{"delta":{"content":"cut'
+    assert answer_from_sse(raw) == ("热敷", "stop", {"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7})
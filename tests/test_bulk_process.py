@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import json
+
+import pytest
+
+import bulk_process
+from app.models.eye_doctor import AIRecommendationRequest, EyeDoctorRequest
+from app.services.llm_service import llm_service
+from bulk_process import parse_case, read_checkpoint
+
+EYE_DOCTOR = {"disease_name": "干眼症", "disease_category": "眼表疾病", "result": "轻度", "question": "怎么治？"}
+RECOMMENDATION = {"disease_name": "干眼症", "disease_category": "眼表疾病", "result": "轻度",
+                  "patient_info": {"name": "张三", "sex": "男", "age": 30}}
+
+
+def write_lines(path, records):
+    path.write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records), encoding="utf-8")
+
+
+def test_checkpoint_cuts_off_a_partial_last_line(tmp_path):
+    output = tmp_path / "results.jsonl"
+    output.write_bytes(b'{"id": "1", "status": "ok"}\n{"id": "2", "sta')
+    assert read_checkpoint(str(output), retry_failed=False) == {"1"}
+    assert output.read_bytes() == b'{"id": "1", "status": "ok"}\n'
+
+
+def test_failed_cases_are_done_unless_retried(tmp_path):
+    output = tmp_path / "results.jsonl"
+    write_lines(output, [{"id": "1", "status": "ok"}, {"id": 2, "status": "error"},
+                         {"id": "3", "status": "error"}, {"id": "3", "status": "ok"}])
+    assert read_checkpoint(str(output), retry_failed=False) == {"1", "2", "3"}
+    assert read_checkpoint(str(output), retry_failed=True) == {"1", "3"}
+
+
+def test_missing_checkpoint_is_empty(tmp_path):
+    assert read_checkpoint(str(tmp_path / "missing.jsonl"), retry_failed=False) == set()
+
+
+def test_kind_is_detected_from_the_fields():
+    case_id, kind, request = parse_case(7, json.dumps(RECOMMENDATION), None)
+    assert (case_id, kind) == ("7", "recommendations")
+    assert isinstance(request, AIRecommendationRequest)
+    case_id, kind, request = parse_case(8, json.dumps({"id": 42, "request": EYE_DOCTOR}), None)
+    assert (case_id, kind) == ("42", "eye-doctor")
+    assert isinstance(request, EyeDoctorRequest)
+
+
+def test_explicit_kind_wins():
+    with pytest.raises(ValueError, match="Invalid recommendations request"):
+        parse_case(1, json.dumps(EYE_DOCTOR), "recommendations")
+
+
+@pytest.mark.parametrize("line, message", [
+    ("{not json", "Invalid JSON"),
+    ("[1, 2]", "not a JSON object"),
+    ('{"id": "x", "request": ["patient_info"]}', "Request is not a JSON object"),
+    ('{"id": "x", "request": "patient_info"}', "Request is not a JSON object"),
+    ('{"question": "怎么治？"}', "Invalid eye-doctor request"),
+])
+def test_invalid_input_is_reported(line, message):
+    with pytest.raises(ValueError, match=message):
+        parse_case(1, line, None)
+
+
+def test_resume_skips_finished_cases(tmp_path, monkeypatch):
+    seen = []
+
+    async def completion(request, **kwargs):
+        seen.append(request.question)
+        return {"message": {"content": f"回答：{request.question}"}, "usage": None}
+
+    monkeypatch.setattr(llm_service, "get_eye_doctor_completion", completion)
+    cases = tmp_path / "cases.jsonl"
+    output = tmp_path / "results.jsonl"
+    write_lines(cases, [{"id": f"c{i}", "request": dict(EYE_DOCTOR, question=f"问题{i}")} for i in range(3)])
+    with open(cases, "a", encoding="utf-8") as f:
+        f.write("{broken\n")
+    write_lines(output, [{"id": "c1", "status": "ok"}])
+    args = argparse.Namespace(input=str(cases), output=str(output), kind=None, concurrency=2, rate=0.0,
+                              retries=0, retry_failed=False, limit=0)
+
+    asyncio.run(bulk_process.main(args))
+    assert sorted(seen) == ["问题0", "问题2"]
+
+    # A second run finds everything done, including the unusable line
+    asyncio.run(bulk_process.main(args))
+    assert len(seen) == 2
+    records = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert sorted(r["id"] for r in records) == ["4", "c0", "c1", "c2"]
+    assert [r["status"] for r in records if r["id"] == "4"] == ["error"]
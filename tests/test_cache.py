@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+from app.services.cache import CacheBackend, CacheBackendError, MemoryBackend, SQLiteBackend, TieredCache
+
+
+class SlowBackend(CacheBackend):
+    name = "slow"
+
+    def __init__(self, fail=False):
+        self.release = asyncio.Event()
+        self.values = {}
+        self.fail = fail
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def put(self, key, value):
+        await self.release.wait()
+        if self.fail:
+            raise CacheBackendError("down")
+        self.values[key] = value
+
+    async def delete(self, key):
+        self.values.pop(key, None)
+
+
+def test_put_does_not_wait_for_shared_write():
+    async def scenario():
+        l2 = SlowBackend()
+        cache = TieredCache("test", MemoryBackend("test", 10, 60), l2)
+        await asyncio.wait_for(cache.put("k", "v"), 1)
+        assert await cache.get("k") == "v"
+        assert l2.values == {}
+
+        l2.release.set()
+        await cache.close()
+        assert l2.values == {"k": "v"}
+
+    asyncio.run(scenario())
+
+
+def test_failed_shared_write_is_swallowed():
+    async def scenario():
+        l2 = SlowBackend(fail=True)
+        l2.release.set()
+        cache = TieredCache("test", MemoryBackend("test", 10, 60), l2)
+        await cache.put("k", "v")
+        await cache.close()
+        assert await cache.get("k") == "v"
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_calls_run_off_the_event_loop(tmp_path):
+    backend = SQLiteBackend("test", str(tmp_path / "cache.db"), max_entries=2, ttl_seconds=60)
+    threads = set()
+    original = backend._connect
+
+    def connect():
+        threads.add(threading.current_thread())
+        return original()
+
+    backend._connect = connect
+
+    async def scenario():
+        await backend.put("a", "1")
+        assert await backend.get("a") == "1"
+        await backend.delete("a")
+        assert await backend.get("a") is None
+        await backend.close()
+
+    asyncio.run(scenario())
+    assert threading.main_thread() not in threads
+
+
+def test_sqlite_resize_prunes_on_next_put(tmp_path):
+    backend = SQLiteBackend("test", str(tmp_path / "cache.db"), max_entries=10, ttl_seconds=60)
+
+    async def scenario():
+        for key in "abcd":
+            await backend.put(key, key)
+        backend.resize(2, 60)
+        await backend.put("e", "e")
+        values = [await backend.get(key) for key in "abcde"]
+        await backend.close()
+        return values
+
+    assert asyncio.run(scenario()) == [None, None, None, "d", "e"]
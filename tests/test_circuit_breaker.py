@@ -0,0 +1,154 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import circuit_breaker as breaker_module
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, circuit_breakers
+from app.services.llm_service import llm_service
+from app.utils.config import settings
+from conftest import FakeUpstream, collect
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Monotonic clock advanced by the test"""
+    now = [1000.0]
+    monkeypatch.setattr(breaker_module, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("test", window_seconds=60, min_requests=4, failure_rate=0.5, slow_seconds=10,
+                          open_seconds=30)
+
+
+def outcome(breaker, ok=True, latency=1.0):
+    call = breaker.begin()
+    if ok:
+        call.succeed(latency)
+    else:
+        call.fail()
+
+
+def trip(breaker):
+    for ok in (True, True, False, False):
+        outcome(breaker, ok)
+    assert breaker.state == OPEN
+
+
+def test_opens_at_the_failure_rate_once_enough_calls_were_seen(breaker):
+    outcome(breaker, False)
+    outcome(breaker, False)
+    outcome(breaker, False)
+    assert breaker.state == CLOSED
+    outcome(breaker, True)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.begin()
+
+
+def test_slow_calls_count_as_failures(breaker):
+    for latency in (1, 1, 11, 12):
+        outcome(breaker, latency=latency)
+    assert breaker.state == OPEN
+
+
+def test_outcomes_outside_the_window_are_forgotten(breaker, clock):
+    outcome(breaker, False)
+    outcome(breaker, False)
+    clock[0] += 61
+    outcome(breaker, False)
+    outcome(breaker, True)
+    outcome(breaker, True)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_after_the_cooldown_lets_one_probe_through(breaker, clock):
+    trip(breaker)
+    clock[0] += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.begin()
+    clock[0] += 1
+    probe = breaker.begin()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.begin()
+    probe.succeed(1.0)
+    assert breaker.state == CLOSED
+    assert not breaker._outcomes
+
+
+@pytest.mark.parametrize("ok, latency", [(False, 1.0), (True, 11.0)])
+def test_failed_or_slow_probe_reopens(breaker, clock, ok, latency):
+    trip(breaker)
+    clock[0] += 30
+    outcome(breaker, ok, latency)
+    assert breaker.state == OPEN
+    clock[0] += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.begin()
+
+
+def test_released_probe_frees_the_slot(breaker, clock):
+    trip(breaker)
+    clock[0] += 30
+    breaker.begin().release()
+    assert breaker.state == HALF_OPEN
+    breaker.begin()
+
+
+def test_probe_that_never_reports_stops_blocking_after_the_cooldown(breaker, clock):
+    trip(breaker)
+    clock[0] += 30
+    breaker.begin()
+    clock[0] += 30
+    breaker.begin()
+
+
+def test_only_the_first_outcome_of_a_call_counts(breaker):
+    call = breaker.begin()
+    call.fail()
+    call.succeed()
+    call.fail()
+    call.release()
+    assert [ok for _, ok in breaker._outcomes] == [False]
+
+
+def test_reconfigure_keeps_state(monkeypatch):
+    breaker = circuit_breakers.get("http://reconfigure", "model")
+    breaker.state = OPEN
+    monkeypatch.setattr(settings, "circuit_open_seconds", 7)
+    circuit_breakers.reconfigure()
+    assert breaker.open_seconds == 7 and breaker.state == OPEN
+
+
+def open_circuit(model):
+    breaker = circuit_breakers.get(settings.openai_api_base, model)
+    breaker.state = OPEN
+    breaker._opened_at = breaker_module.time.monotonic()
+
+
+def complete(prompt, model, stream=False):
+    return asyncio.run(llm_service._create_completion(
+        messages=[{"role": "user", "content": prompt}], model=model, stream=stream
+    ))
+
+
+def test_open_circuit_serves_the_cached_answer(monkeypatch):
+    model = "fallback-model"
+    monkeypatch.setattr(llm_service, "client", FakeUpstream(["缓存", "回答"]))
+    assert complete("干眼症怎么治？", model)["message"]["content"] == "缓存回答"
+    open_circuit(model)
+
+    result = complete("干眼症怎么治？", model)
+    assert result["cached"] and result["message"]["content"] == "缓存回答"
+
+    stream = complete("干眼症怎么治？", model, stream=True)["stream"]
+    chunks = asyncio.run(collect(stream))
+    assert [(c.choices[0].delta.content, c.choices[0].finish_reason) for c in chunks] == [("缓存回答", "stop")]
+
+    with pytest.raises(CircuitOpenError):
+        complete("没有缓存的问题", model)
+    assert len(llm_service.client.calls) == 1
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.llm_service import ClosingStream, DeadlineExceededError, llm_service
+from app.services.session_store import session_store
+from app.utils.config import settings
+from app.utils.deadline import MIN_MAX_TOKENS, Deadline, DeadlineStream, set_deadline
+from conftest import FakeUpstream, collect, iterate
+
+PATIENT = {"disease_name": "干眼症", "disease_category": "眼表疾病", "result": "泪膜破裂时间5秒"}
+
+
+@pytest.fixture
+def no_reserve(monkeypatch):
+    monkeypatch.setattr(settings, "deadline_reserve_ms", 0)
+
+
+def in_seconds(seconds):
+    return Deadline(time.monotonic() + seconds)
+
+
+def complete(deadline, **kwargs):
+    """Run a non-streaming completion under a deadline"""
+    async def run():
+        set_deadline(deadline)
+        return await llm_service._create_completion(messages=[{"role": "user", "content": "hi"}], **kwargs)
+    return asyncio.run(run())
+
+
+def test_timeout_header_is_relative_milliseconds(monkeypatch):
+    monkeypatch.setattr(settings, "deadline_reserve_ms", 200)
+    deadline = Deadline.from_headers({"X-Request-Timeout": "3000"})
+    assert 2.7 < deadline.remaining() <= 2.8
+
+
+@pytest.mark.parametrize("scale", [1, 1000])
+def test_deadline_header_accepts_epoch_seconds_and_milliseconds(no_reserve, scale):
+    deadline = Deadline.from_headers({"X-Request-Deadline": str((time.time() + 5) * scale)})
+    assert 4.8 < deadline.remaining() <= 5
+
+
+def test_timeout_header_wins_and_malformed_headers_are_ignored(no_reserve):
+    both = Deadline.from_headers({"X-Request-Timeout": "1000", "X-Request-Deadline": str(time.time() + 60)})
+    assert both.remaining() <= 1
+    assert Deadline.from_headers({"X-Request-Timeout": "soon"}) is None
+    assert Deadline.from_headers({}) is None
+
+
+def test_expired_deadline_is_rejected(no_reserve):
+    response = TestClient(app).post("/api/chat/completions", json={"messages": [{"role": "user", "content": "hi"}]},
+                                    headers={"X-Request-Deadline": str(time.time() - 1)})
+    assert response.status_code == 504
+
+
+def test_max_tokens_is_clamped_to_the_remaining_time(monkeypatch):
+    monkeypatch.setattr(settings, "deadline_tokens_per_second", 20)
+    deadline = in_seconds(10.52)
+    assert deadline.fit_max_tokens(100) == 100
+    assert deadline.fit_max_tokens(1000) == 210
+    assert deadline.fit_max_tokens(None) == 210
+    assert in_seconds(0.1).fit_max_tokens(1000) == MIN_MAX_TOKENS
+
+
+def test_deadline_stream_stops_at_the_deadline_with_the_partial_answer():
+    async def slow():
+        yield "第一段"
+        await asyncio.sleep(5)
+        yield "第二段"
+
+    upstream = SimpleNamespace(response=None)
+    stream = DeadlineStream(slow(), upstream, in_seconds(0.2))
+    assert asyncio.run(collect(stream)) == ["第一段"]
+    assert stream.truncated
+
+    stream = DeadlineStream(iterate(["完整回答"]), upstream, in_seconds(5))
+    assert asyncio.run(collect(stream)) == ["完整回答"]
+    assert not stream.truncated
+
+
+def test_non_streaming_call_returns_the_partial_answer_at_the_deadline(monkeypatch):
+    upstream = FakeUpstream(["第一段", "第二段"], delays=[0, 5])
+    monkeypatch.setattr(llm_service, "client", upstream)
+
+    result = complete(in_seconds(0.3), max_tokens=500)
+
+    assert result["message"]["content"] == "第一段"
+    assert result["truncated"] and result["finish_reason"] == "deadline"
+    assert upstream.calls[0]["stream"] and upstream.calls[0]["max_tokens"] <= 500
+
+
+def test_non_streaming_call_without_any_answer_by_the_deadline_fails(monkeypatch):
+    monkeypatch.setattr(llm_service, "client", FakeUpstream(["回答"], delays=[5]))
+    with pytest.raises(DeadlineExceededError):
+        complete(in_seconds(0.2))
+
+
+def test_non_streaming_call_finishing_in_time_is_not_truncated(monkeypatch):
+    monkeypatch.setattr(llm_service, "client", FakeUpstream(["第一段", "第二段"]))
+    result = complete(in_seconds(5))
+    assert result["message"]["content"] == "第一段第二段"
+    assert not result["truncated"] and result["finish_reason"] == "stop"
+
+
+def sse_events(body: str):
+    return [event[len("data: "):] for event in body.split("\n\n") if event.startswith("data: ")]
+
+
+def test_eye_doctor_stream_cut_at_deadline_ends_with_truncated_chunk(monkeypatch, no_reserve):
+    monkeypatch.setattr(llm_service, "client", FakeUpstream(["第一段", "第二段"], delays=[0, 5]))
+    body = dict(PATIENT, question="我平时要注意什么？", stream=True, session_id="deadline-stream")
+
+    response = TestClient(app).post("/api/eye-doctor/chat", json=body, headers={"X-Request-Timeout": "400"})
+
+    events = sse_events(response.text)
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(event) for event in events[:-1]]
+    assert chunks[0]["content"] == "第一段"
+    assert chunks[-1]["is_complete"] and chunks[-1]["truncated"]
+    turns = session_store._get("deadline-stream").turns
+    assert [turn.content for turn in turns][-1] == "第一段"
+
+
+def test_unstarted_stream_releases_its_call_and_upstream():
+    class Response:
+        closed = False
+
+        async def aclose(self):
+            self.closed = True
+
+    class Call:
+        released = False
+
+        def release(self):
+            self.released = True
+
+    upstream, call = SimpleNamespace(response=Response()), Call()
+    stream = ClosingStream(iterate([]), upstream, 0.0, call)
+    asyncio.run(stream.aclose())
+    assert call.released and upstream.response.closed
+
+
+def test_recommendations_stream_cut_at_deadline_returns_the_salvaged_json(monkeypatch, no_reserve):
+    answer = '{"treatment_plan": {"treatment_type": "药物治疗", "treatment_detail": "按时用药"}, "medications": ['
+    monkeypatch.setattr(llm_service, "client", FakeUpstream([answer, "{}]}"], delays=[0, 5]))
+    body = dict(PATIENT, patient_info={"name": "张三", "sex": "男", "age": 30}, stream=True)
+
+    response = TestClient(app).post("/api/eye-doctor/recommendations", json=body,
+                                    headers={"X-Request-Timeout": "400"})
+
+    events = sse_events(response.text)
+    assert events[-1] == "[DONE]"
+    recommendations = json.loads(events[-2])
+    assert recommendations["treatment_plan"]["treatment_detail"] == "按时用药"
+    assert recommendations["medications"] == []
@@ -0,0 +1,21 @@
+from app.models.eye_doctor import EyeDoctorRequest
+from app.utils.prompts import construct_messages
+
+
+def test_turns_without_role_are_accepted_and_skipped():
+    request = EyeDoctorRequest(
+        disease_name="干眼症",
+        disease_category="眼表疾病",
+        result="BUT 3s",
+        question="还要复查吗？",
+        previous_conversations=[
+            {"content": "没有角色的旧格式记录"},
+            {"role": "user", "content": "这个病严重吗？"},
+            {"role": "assistant", "content": "不严重。"},
+        ],
+    )
+    assert request.previous_conversations[0].role is None
+
+    contents = [message["content"] for message in construct_messages(request)]
+    assert "没有角色的旧格式记录" not in contents
+    assert "这个病严重吗？" in contents and "不严重。" in contents
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from app.models.eye_doctor import EyeDoctorRequest
+from app.services.faq_store import FINDINGS_INTENTS, FAQStore, faq_key, normalize_question
+from precompute_faq import INTENT_QUESTIONS, check_intent_questions
+
+
+def entry(disease_name, intent, questions):
+    return {
+        "disease_name": disease_name,
+        "intent": intent,
+        "questions": questions,
+        "content": f"{disease_name} {intent}",
+        "references": [],
+        "generated_at": 0,
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = tmp_path / "faq.json"
+    entries = {
+        faq_key("干眼症", "treatment"): entry("干眼症", "treatment", ["这个病怎么治？"]),
+        faq_key("干眼症", "medication"): entry("干眼症", "medication", ["用药需要注意什么？"]),
+        faq_key("干眼症", "prognosis"): entry("干眼症", "prognosis", ["这个病严重吗？会影响视力吗？"]),
+    }
+    path.write_text(json.dumps({"version": "test", "entries": entries}, ensure_ascii=False), encoding="utf-8")
+    store = FAQStore(str(path), refresh_seconds=0)
+    assert store.load()
+    return store
+
+
+def request(question, **fields):
+    values = {"disease_name": "干眼症", "disease_category": "眼表疾病", "result": "", "question": question}
+    values.update(fields)
+    return EyeDoctorRequest(**values)
+
+
+def test_normalize_question_ignores_width_case_spacing_and_punctuation():
+    assert normalize_question(" 这个病 怎么治?? ") == normalize_question("这个病怎么治？")
+    assert normalize_question("ＯＫ吗") == normalize_question("ok吗")
+
+
+def test_serves_exact_precomputed_question(store):
+    hit = store.lookup(request("这个病怎么治"))
+    assert hit["content"] == "干眼症 treatment"
+
+
+@pytest.mark.parametrize("question", ["能不能停药", "生活中能开车吗", "这个病怎么治？晚上眼睛很痛"])
+def test_unrelated_or_extended_questions_miss(store, question):
+    assert store.lookup(request(question)) is None
+
+
+def test_other_disease_misses(store):
+    assert store.lookup(request("这个病怎么治？", disease_name="青光眼")) is None
+
+
+def test_findings_dependent_answers_are_not_loaded(store):
+    assert faq_key("干眼症", "prognosis") not in store._entries
+    assert store.lookup(request("这个病严重吗？会影响视力吗？")) is None
+    assert store.lookup(request("这个病怎么治？", result="泪膜破裂时间 3 秒")) is not None
+
+
+def test_precomputed_questions_match_their_intents():
+    check_intent_questions()
+    assert not set(INTENT_QUESTIONS) & set(FINDINGS_INTENTS)
+
+
+def test_generic_answers_not_served_with_own_plan_or_medications(store):
+    assert store.lookup(request("这个病怎么治？", treatment_plan={"plan": "热敷"})) is None
+    assert store.lookup(request("用药需要注意什么？", medications=[{"medication_name": "玻璃酸钠滴眼液"}])) is None
+
+
+def test_follow_up_turns_not_served(store):
+    history = [{"role": "user", "content": "你好"}, {"role": "assistant", "content": "你好"}]
+    assert store.lookup(request("这个病怎么治？", previous_conversations=history)) is None
+
+
+def test_store_without_questions_serves_nothing(tmp_path):
+    path = tmp_path / "faq.json"
+    legacy = {faq_key("干眼症", "treatment"): {"content": "旧回答", "references": [], "generated_at": 0}}
+    path.write_text(json.dumps({"version": "old", "entries": legacy}, ensure_ascii=False), encoding="utf-8")
+    store = FAQStore(str(path), refresh_seconds=0)
+    assert store.load()
+    assert store.lookup(request("这个病怎么治？")) is None
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from app.models.eye_doctor import AIRecommendationResponse
+from app.services.formulary import Formulary, MATCHED, NORMALIZED, PARTIAL, UNKNOWN
+
+DRUGS = [
+    {"name": "左氧氟沙星滴眼液", "aliases": ["左氧氟沙星", "可乐必妥", "levofloxacin"], "initials": "zyfsxdyy"},
+    {"name": "阿托品滴眼液", "aliases": []},
+    {"name": "托吡卡胺滴眼液", "aliases": []},
+]
+
+@pytest.fixture
+def formulary(tmp_path):
+    path = tmp_path / "formulary.json"
+    path.write_text(json.dumps({"version": "test", "drugs": DRUGS}, ensure_ascii=False), encoding="utf-8")
+    formulary = Formulary(str(path), 300, "flag")
+    assert formulary.load()
+    return formulary
+
+@pytest.mark.parametrize("name, expected", [
+    ("左氧氟沙星滴眼液", ("左氧氟沙星滴眼液", MATCHED)),
+    ("可乐必妥", ("左氧氟沙星滴眼液", NORMALIZED)),
+    ("Levofloxacin", ("左氧氟沙星滴眼液", NORMALIZED)),
+    ("ZYFSXDYY", ("左氧氟沙星滴眼液", NORMALIZED)),
+    ("左氧氟沙星滴眼液（可乐必妥）", ("左氧氟沙星滴眼液", NORMALIZED)),
+    ("复方托吡卡胺滴眼液", ("托吡卡胺滴眼液", PARTIAL)),
+    ("0.01%低浓度阿托品滴眼液", ("阿托品滴眼液", PARTIAL)),
+    ("阿托品滴眼液（0.01%）", ("阿托品滴眼液", PARTIAL)),
+    ("布洛芬", (None, UNKNOWN)),
+])
+def test_lookup(formulary, name, expected):
+    assert formulary.lookup(name) == expected
+
+def test_check_only_rewrites_exact_and_alias_matches(formulary):
+    recommendations = {"medications": [
+        {"medication_name": "可乐必妥"},
+        {"medication_name": "0.01%低浓度阿托品滴眼液"},
+        {"medication_name": "布洛芬"},
+    ]}
+    medications = formulary.check(recommendations)["medications"]
+    assert medications[0] == {"medication_name": "左氧氟沙星滴眼液", "formulary_status": NORMALIZED,
+                              "original_name": "可乐必妥"}
+    assert medications[1] == {"medication_name": "0.01%低浓度阿托品滴眼液", "formulary_status": PARTIAL}
+    assert medications[2]["formulary_status"] == UNKNOWN
+
+def test_unknown_drugs_dropped(formulary):
+    formulary.unknown_action = "drop"
+    recommendations = formulary.check({"medications": [{"medication_name": "布洛芬"}, {"medication_name": "左氧氟沙星"}]})
+    assert [m["medication_name"] for m in recommendations["medications"]] == ["左氧氟沙星滴眼液"]
+
+def test_unchecked_formulary_fields_are_omitted():
+    medication = {"medication_name": "a", "dosage": "b", "frequency": "c"}
+    plan = {"treatment_type": "x", "treatment_detail": "y"}
+    unchecked = AIRecommendationResponse(medications=[medication], treatment_plan=plan).model_dump()
+    assert unchecked["medications"][0] == dict(medication, side_effects=None)
+    checked = AIRecommendationResponse(medications=[dict(medication, formulary_status=MATCHED)], treatment_plan=plan)
+    assert json.loads(checked.model_dump_json())["medications"][0]["formulary_status"] == MATCHED
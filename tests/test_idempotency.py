@@ -0,0 +1,121 @@
+import asyncio
+import gc
+import json
+
+from app.utils.idempotency import IdempotencyMiddleware, IdempotencyStore, _running_tasks
+
+PATH = "/api/eye-doctor/chat"
+
+
+class CountingApp:
+    """ASGI app answering with its call count, optionally waiting for a release"""
+
+    def __init__(self, status=200):
+        self.status = status
+        self.calls = 0
+        self.release = None
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        await receive()
+        if self.release is not None:
+            await self.release.wait()
+        await send({"type": "http.response.start", "status": self.status,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": json.dumps({"call": self.calls}).encode()})
+
+
+async def call(app, key, body=b'{"question": "q"}'):
+    scope = {"type": "http", "method": "POST", "path": PATH, "headers": [(b"idempotency-key", key.encode())]}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start = sent[0]
+    headers = dict(start.get("headers", []))
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    return start["status"], headers, json.loads(body)
+
+
+def test_retry_replays_the_recorded_response():
+    async def scenario():
+        inner = CountingApp()
+        app = IdempotencyMiddleware(inner, IdempotencyStore(max_entries=10, ttl_seconds=60))
+        first = await call(app, "k1")
+        second = await call(app, "k1")
+        return inner.calls, first, second
+
+    calls, first, second = asyncio.run(scenario())
+    assert calls == 1
+    assert first[2] == second[2] == {"call": 1}
+    assert b"idempotent-replayed" not in first[1]
+    assert second[1][b"idempotent-replayed"] == b"true"
+
+
+def test_key_reused_with_another_body_is_a_conflict():
+    async def scenario():
+        app = IdempotencyMiddleware(CountingApp(), IdempotencyStore(max_entries=10, ttl_seconds=60))
+        await call(app, "k1")
+        return await call(app, "k1", body=b'{"question": "other"}')
+
+    status, _, body = asyncio.run(scenario())
+    assert status == 422
+    assert "different request body" in body["message"]
+
+
+def test_server_errors_are_not_kept():
+    async def scenario():
+        inner = CountingApp(status=500)
+        app = IdempotencyMiddleware(inner, IdempotencyStore(max_entries=10, ttl_seconds=60))
+        await call(app, "k1")
+        await call(app, "k1")
+        return inner.calls
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_expired_recordings_are_dropped_from_the_head():
+    async def scenario():
+        store = IdempotencyStore(max_entries=10, ttl_seconds=60)
+        app = IdempotencyMiddleware(CountingApp(), store)
+        await call(app, "k1")
+        await call(app, "k2")
+        store.ttl_seconds = 0
+        await asyncio.sleep(0.01)
+        store.begin(PATH, "k3", "fingerprint")
+        return list(store._entries), len(store._finished)
+
+    keys, pending = asyncio.run(scenario())
+    assert keys == [(PATH, "k3")]
+    assert pending == 0
+
+
+def test_evicted_running_request_stays_referenced_until_done():
+    async def scenario():
+        inner = CountingApp()
+        inner.release = asyncio.Event()
+        store = IdempotencyStore(max_entries=1, ttl_seconds=60)
+        app = IdempotencyMiddleware(inner, store)
+        first = asyncio.create_task(call(app, "slow"))
+        await asyncio.sleep(0.01)
+        task = store._entries[(PATH, "slow")].task
+
+        # A second key evicts the recording while its request is still running
+        store.begin(PATH, "other", "fingerprint")
+        assert (PATH, "slow") not in store._entries
+        gc.collect()
+        assert task in _running_tasks
+
+        inner.release.set()
+        result = await first
+        await asyncio.sleep(0)
+        return task, result
+
+    task, result = asyncio.run(scenario())
+    assert task.done() and task not in _running_tasks
+    assert result[2] == {"call": 1}
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.main import app
+from app.services.job_queue import JobQueue, QueueFullError
+from app.services.llm_service import llm_service
+from app.utils.config import settings
+from app.utils.config_center import ConfigCenter
+
+RECOMMENDATIONS = {"medications": [], "treatment_plan": {"treatment_type": "观察", "treatment_detail": "定期复查"}}
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    """Recommendation calls wait for the gate; requests named "fail" raise"""
+    gate = {}
+
+    async def recommend(request, stream=False):
+        await gate["event"].wait()
+        if request == "fail":
+            raise Exception("upstream down")
+        return {"recommendations": RECOMMENDATIONS}
+
+    monkeypatch.setattr(llm_service, "get_eye_doctor_recommendations", recommend)
+    return gate
+
+
+def run_queue(scenario, **options):
+    async def run():
+        queue = JobQueue(**dict({"workers": 1, "max_queue": 1, "ttl_seconds": 60}, **options))
+        tasks = queue.start()
+        try:
+            return await scenario(queue)
+        finally:
+            for task in tasks:
+                task.cancel()
+    return asyncio.run(run())
+
+
+def test_jobs_run_and_long_poll_returns_when_done(gate):
+    async def scenario(queue):
+        gate["event"] = asyncio.Event()
+        job = queue.submit("ok")
+        await asyncio.sleep(0)
+        assert job.status == "running"
+        # Long-poll times out while the job is still running
+        assert (await queue.wait(job, 0.05)).status == "running"
+        asyncio.get_running_loop().call_later(0.05, gate["event"].set)
+        done = await queue.wait(job, 5)
+        assert done.status == "succeeded" and done.result == RECOMMENDATIONS
+        assert done.finished_at and done.request is None
+        assert queue.get(job.id) is job
+
+    run_queue(scenario)
+
+
+def test_failed_job_keeps_the_error(gate):
+    async def scenario(queue):
+        gate["event"] = asyncio.Event()
+        gate["event"].set()
+        job = await queue.wait(queue.submit("fail"), 5)
+        assert job.status == "failed" and "upstream down" in job.error
+
+    run_queue(scenario)
+
+
+def test_submit_beyond_the_queue_size_is_rejected(gate):
+    async def scenario(queue):
+        gate["event"] = asyncio.Event()
+        queue.submit("ok")
+        await asyncio.sleep(0)
+        # The worker holds the first job, the queue holds the second
+        queue.submit("ok")
+        with pytest.raises(QueueFullError):
+            queue.submit("ok")
+        gate["event"].set()
+
+    run_queue(scenario)
+
+
+def test_finished_jobs_expire_after_the_ttl(gate):
+    async def scenario(queue):
+        gate["event"] = asyncio.Event()
+        gate["event"].set()
+        finished = await queue.wait(queue.submit("ok"), 5)
+        queue.ttl_seconds = 60
+        queue.purge_expired()
+        assert queue.get(finished.id) is finished
+        queue.ttl_seconds = 0
+        await asyncio.sleep(0.01)
+        queue.purge_expired()
+        assert queue.get(finished.id) is None
+
+    run_queue(scenario)
+
+
+def test_full_queue_returns_429(monkeypatch):
+    def full(request):
+        raise QueueFullError("Recommendation job queue is full, please retry later")
+
+    monkeypatch.setattr(main.job_queue, "submit", full)
+    body = {"disease_name": "干眼症", "disease_category": "眼表疾病", "result": "轻度",
+            "patient_info": {"name": "张三", "sex": "男", "age": 30}}
+    response = TestClient(app).post("/api/eye-doctor/recommendations/jobs", json=body)
+    assert response.status_code == 429
+
+
+def test_unknown_job_is_404():
+    assert TestClient(app).get("/api/eye-doctor/recommendations/jobs/missing").status_code == 404
+
+
+@pytest.mark.parametrize("key", ["JOB_QUEUE_SIZE", "JOB_WORKERS"])
+def test_zero_queue_size_or_workers_is_rejected(key):
+    saved = dict(settings.__dict__)
+    try:
+        assert ConfigCenter(history_size=1).apply("file", f"{key}=0")["error"]
+    finally:
+        settings.__dict__.update(saved)
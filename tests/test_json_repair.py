@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from app.utils.json_repair import loads_lenient, repair_json
+from app.utils.structured_output import parse_recommendations
+
+COMPLETE = {
+    "medications": [{"medication_name": "人工泪液", "dosage": "1滴", "frequency": "每日4次", "side_effects": "无"}],
+    "treatment_plan": {"treatment_type": "药物治疗", "treatment_detail": "按时用药"},
+}
+
+
+def test_valid_json_is_not_repaired():
+    assert loads_lenient(json.dumps(COMPLETE)) == (COMPLETE, False)
+
+
+def test_code_fence_and_prose_are_stripped():
+    text = "以下是建议：\n```json\n" + json.dumps(COMPLETE, ensure_ascii=False) + "\n```\n希望对您有帮助。"
+    assert loads_lenient(text)[0] == COMPLETE
+
+
+def test_trailing_commas_are_dropped():
+    assert loads_lenient('{"a": [1, 2,], "b": {"c": 1,},}')[0] == {"a": [1, 2], "b": {"c": 1}}
+
+
+def test_raw_newlines_in_strings_are_escaped():
+    assert loads_lenient('{"detail": "第一行\n第二行"}')[0] == {"detail": "第一行\n第二行"}
+
+
+def test_truncated_string_value_is_kept_and_closed():
+    repaired, truncated = repair_json('{"treatment_plan": {"treatment_detail": "按时用')
+    assert truncated
+    assert json.loads(repaired) == {"treatment_plan": {"treatment_detail": "按时用"}}
+
+
+def test_truncated_key_is_cut_back_to_the_last_complete_value():
+    repaired, truncated = repair_json('{"a": 1, "b": [true, false], "trea')
+    assert truncated
+    assert json.loads(repaired) == {"a": 1, "b": [True, False]}
+
+
+def test_truncated_first_key_leaves_an_empty_object():
+    assert repair_json('{"medica') == ("{}", True)
+
+
+def test_output_without_an_object_is_rejected():
+    with pytest.raises(ValueError):
+        repair_json("抱歉，我无法给出建议")
+
+
+def test_cut_off_medication_is_dropped_by_parse_recommendations():
+    answer = {"treatment_plan": COMPLETE["treatment_plan"], "medications": COMPLETE["medications"]}
+    text = json.dumps(answer, ensure_ascii=False)[:-2] + ', {"medication_name": "玻璃酸钠", "dosage": "1滴", "freq'
+    result, repaired = parse_recommendations(text)
+    assert repaired
+    assert [med["medication_name"] for med in result["medications"]] == ["人工泪液"]
+    assert result["treatment_plan"]["treatment_detail"] == "按时用药"
@@ -0,0 +1,33 @@
+import pytest
+
+from app.utils.config import settings
+from app.utils.load_monitor import LoadMonitor
+from app.utils.metrics import metrics
+
+
+@pytest.fixture
+def monitor():
+    return LoadMonitor(max_in_flight=10, latency_target_seconds=10, hysteresis=0.2, min_weight=0.1)
+
+
+def test_unbounded_job_queue_is_left_out(monkeypatch, monitor):
+    monkeypatch.setattr(settings, "job_queue_size", 0)
+    monitor.update()
+    assert monitor.status()["score"] == 0.0
+
+
+def test_zero_limits_do_not_divide_by_zero():
+    monitor = LoadMonitor(max_in_flight=0, latency_target_seconds=0, hysteresis=0.2, min_weight=0.1)
+    monitor.update()
+    assert monitor.weight == 1.0
+
+
+def test_weight_change_is_taken_once(monitor):
+    metrics.gauge_add("upstream_in_flight", 8)
+    try:
+        assert monitor.update()
+    finally:
+        metrics.gauge_add("upstream_in_flight", -8)
+    assert monitor.weight == 0.2
+    assert monitor.take_weight_change()
+    assert not monitor.take_weight_change()
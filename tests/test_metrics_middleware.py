@@ -0,0 +1,32 @@
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.utils.metrics import metrics
+
+
+def counter_keys(name):
+    return [key for key in metrics.snapshot()["counters"] if key.startswith(name)]
+
+
+def test_unmatched_paths_share_one_label():
+    client = TestClient(app)
+    for i in range(3):
+        assert client.get(f"/wp-admin/probe-{i}.php").status_code == 404
+    keys = counter_keys("http_requests_total")
+    assert not any("probe-" in key for key in keys)
+    assert any("unmatched" in key for key in keys)
+
+
+def test_matched_paths_use_the_route_template():
+    TestClient(app).get("/health")
+    assert any("/health" in key for key in counter_keys("http_requests_total"))
+
+
+def test_deadline_rejections_use_route_labels():
+    client = TestClient(app)
+    headers = {"X-Request-Timeout": "0"}
+    assert client.get("/scan/random-1", headers=headers).status_code == 504
+    assert client.get("/health", headers=headers).status_code == 504
+    keys = counter_keys("deadline_rejected_total")
+    assert not any("random-1" in key for key in keys)
+    assert any("unmatched" in key for key in keys) and any("/health" in key for key in keys)
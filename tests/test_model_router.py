@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import main
+from app.models.eye_doctor import EyeDoctorRequest
+from app.services import model_router as router_module
+from app.services.model_router import SLO_MIN_SAMPLES, ModelRouter, parse_mapping
+
+TIERS = {"fast": "small-model", "balanced": "medium-model", "primary": "large-model"}
+
+
+@pytest.fixture
+def router():
+    return ModelRouter(
+        tiers=TIERS,
+        intent_tiers={"prevention": "fast", "medication": "balanced", "explanation": "missing-tier"},
+        long_question_chars=50,
+        long_history_turns=4,
+        slo_ttft_seconds=2.0,
+        slo_latency_seconds=10.0,
+        slo_percentile=95,
+        slo_window_seconds=60
+    )
+
+
+def request(question, **fields):
+    values = {"disease_name": "干眼症", "disease_category": "眼表疾病", "result": "轻度", "question": question}
+    values.update(fields)
+    return EyeDoctorRequest(**values)
+
+
+def observe(router, tier, kind, seconds, count=SLO_MIN_SAMPLES):
+    for _ in range(count):
+        router.observe(tier, kind, seconds)
+
+
+def test_parse_mapping_keeps_order_and_skips_malformed_items():
+    assert parse_mapping(" fast = a ,broken,=b,primary=c,") == {"fast": "a", "primary": "c"}
+
+
+@pytest.mark.parametrize("question, tier", [
+    ("日常生活要注意什么？", "fast"),
+    ("这个药有副作用吗？", "balanced"),
+    ("这个病怎么治？", "primary"),
+    ("为什么会得这个病？", "primary"),  # Mapped to a tier that isn't configured
+    ("你好", "primary"),
+])
+def test_intent_picks_the_tier(router, question, tier):
+    assert router.route(request(question)) == (tier, TIERS[tier])
+
+
+def test_long_questions_and_conversations_go_to_the_strongest_tier(router):
+    assert router.route(request("日常生活要注意什么？" + "。" * 50))[0] == "primary"
+    assert router.route(request("日常生活要注意什么？"), history_turns=5)[0] == "primary"
+
+
+def test_tier_over_its_slo_falls_back_to_the_next_faster_one(router):
+    observe(router, "primary", "latency", 12.0)
+    assert router.route(request("这个病怎么治？"))[0] == "balanced"
+    # Streaming requests are judged by time to first token, which is within its SLO
+    assert router.route(request("这个病怎么治？", stream=True))[0] == "primary"
+
+    observe(router, "balanced", "latency", 11.0)
+    assert router.route(request("这个病怎么治？"))[0] == "fast"
+    # The fastest tier is used even when it is over its SLO too
+    observe(router, "fast", "latency", 11.0)
+    assert router.route(request("这个病怎么治？"))[0] == "fast"
+
+
+def test_slo_uses_the_configured_percentile(router):
+    # 19 fast answers and one slow one: p95 is within the SLO, p100 wouldn't be
+    observe(router, "primary", "ttft", 0.5, count=19)
+    router.observe("primary", "ttft", 30.0)
+    assert router.route(request("这个病怎么治？", stream=True))[0] == "primary"
+    observe(router, "primary", "ttft", 30.0, count=2)
+    assert router.route(request("这个病怎么治？", stream=True))[0] == "balanced"
+
+
+def test_too_few_or_aged_out_samples_do_not_trigger_fallback(router, monkeypatch):
+    observe(router, "primary", "latency", 30.0, count=SLO_MIN_SAMPLES - 1)
+    assert router.route(request("这个病怎么治？"))[0] == "primary"
+    router.observe("primary", "latency", 30.0)
+    assert router.route(request("这个病怎么治？"))[0] == "balanced"
+
+    now = router_module.time.time()
+    monkeypatch.setattr(router_module, "time", SimpleNamespace(time=lambda: now + 61))
+    assert router.route(request("这个病怎么治？"))[0] == "primary"
+
+
+def test_disabled_slo_never_falls_back(router):
+    router.slo["latency"] = 0
+    observe(router, "primary", "latency", 300.0)
+    assert router.route(request("这个病怎么治？"))[0] == "primary"
+
+
+def test_explicit_model_overrides_routing(router, monkeypatch):
+    monkeypatch.setattr(main, "model_router", router)
+    assert main.route_model(request("日常生活要注意什么？", model="caller-model"), None) == ("caller-model", None)
+    assert main.route_model(request("日常生活要注意什么？"), None) == ("small-model", "fast")
+    history = [{"role": "user", "content": "你好"}] * 5
+    assert main.route_model(request("日常生活要注意什么？", previous_conversations=history), None) == \
+        ("large-model", "primary")
+
+
+def test_routing_is_off_without_tiers(monkeypatch):
+    monkeypatch.setattr(main, "model_router", ModelRouter({}, {}, 50, 4, 0, 0, 90, 60))
+    assert main.route_model(request("日常生活要注意什么？"), None) == (None, None)
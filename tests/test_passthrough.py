@@ -0,0 +1,124 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.circuit_breaker import circuit_breakers
+from app.services.passthrough import RelayStream, inspect_tail, passthrough_proxy
+from app.utils.config import settings
+from app.utils.metrics import metrics
+
+USAGE = {"prompt_tokens": 12, "completion_tokens": 3, "total_tokens": 15}
+
+# Provider-specific fields, comments and spacing must reach the client unchanged
+SSE = (
+    b'data: {"id":"c1","choices":[{"index":0,"delta":{"content":"\\u4f60"},"finish_reason":null}],"x_provider":1}\n\n'
+    b": keep-alive\n\n"
+    b'data:{"id":"c1","choices":[{"index":0,"delta":{"content":"\xe5\xa5\xbd"},"finish_reason":"stop"}]}\n\n'
+    b'data: {"id":"c1","choices":[],"usage":' + json.dumps(USAGE).encode() + b"}\n\n"
+    b"data: [DONE]\n\n"
+)
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Route the passthrough client to a handler set by the test; records the requests it got"""
+    requests = []
+
+    def install(handler):
+        def record(request):
+            requests.append(request)
+            return handler(request)
+        monkeypatch.setattr(passthrough_proxy, "_client", httpx.AsyncClient(transport=httpx.MockTransport(record)))
+        return requests
+
+    return install
+
+
+def post(payload):
+    return TestClient(app).post("/v1/chat/completions", json=payload)
+
+
+def payload(model, **fields):
+    return dict({"model": model, "messages": [{"role": "user", "content": "hi"}]}, **fields)
+
+
+def test_stream_is_relayed_byte_for_byte(upstream):
+    async def body():
+        for i in range(0, len(SSE), 37):
+            yield SSE[i:i + 37]
+
+    requests = upstream(lambda request: httpx.Response(200, content=body(),
+                                                       headers={"content-type": "text/event-stream"}))
+    in_flight = metrics.get_gauge("upstream_in_flight")
+
+    response = post(payload("relay-model", stream=True))
+
+    assert response.status_code == 200
+    assert response.content == SSE
+    sent = json.loads(requests[0].content)
+    assert sent["stream"] and sent["messages"] == [{"role": "user", "content": "hi"}]
+    assert metrics.get_gauge("upstream_in_flight") == in_flight
+
+
+def test_non_streaming_answer_is_relayed_unchanged(upstream):
+    body = json.dumps({"id": "c1", "choices": [{"index": 0, "message": {"role": "assistant", "content": "好"},
+                                                 "finish_reason": "stop"}], "usage": USAGE}).encode()
+    upstream(lambda request: httpx.Response(200, content=body, headers={"content-type": "application/json"}))
+    response = post(payload("relay-model"))
+    assert response.status_code == 200
+    assert response.content == body
+
+
+def test_tail_gives_usage_and_finish_reason():
+    assert inspect_tail(SSE) == (USAGE, "stop")
+    # The tail may start in the middle of an event
+    assert inspect_tail(SSE[20:]) == (USAGE, "stop")
+    assert inspect_tail(b'data: {"choices":[{"delta":{"content":"x"},"finish_reason":null}]}\n\n') == (None, None)
+
+
+@pytest.mark.parametrize("status_code, counted", [(500, True), (503, True), (400, False), (429, False)])
+def test_upstream_errors_are_relayed_and_only_server_errors_counted(upstream, status_code, counted):
+    error = {"error": {"message": "upstream says no", "type": "server_error"}}
+    upstream(lambda request: httpx.Response(status_code, json=error))
+    model = f"error-model-{status_code}"
+
+    response = post(payload(model, stream=True))
+
+    assert response.status_code == status_code
+    assert response.json() == error
+    outcomes = circuit_breakers.get(settings.openai_api_base, model)._outcomes
+    assert [ok for _, ok in outcomes] == ([False] if counted else [])
+
+
+@pytest.mark.parametrize("max_tokens", ["100", 1.5, True])
+def test_non_integer_max_tokens_is_rejected(upstream, max_tokens):
+    requests = upstream(lambda request: httpx.Response(200, json={}))
+    response = post(payload("relay-model", max_tokens=max_tokens))
+    assert response.status_code == 400
+    assert response.json()["error"]["type"] == "invalid_request_error"
+    assert not requests
+
+
+def test_relay_closed_before_it_started_ends_the_upstream_call():
+    class Call:
+        released = False
+
+        def release(self):
+            self.released = True
+
+    upstream = httpx.Response(200, content=SSE)
+    call = Call()
+    in_flight = metrics.get_gauge("upstream_in_flight")
+    metrics.gauge_add("upstream_in_flight", 1)
+    relay = RelayStream(upstream, call, "relay-model", 0.0, None, [])
+
+    asyncio.run(relay.aclose())
+    asyncio.run(relay.aclose())
+
+    assert call.released and upstream.is_closed
+    assert relay.result == "cancelled"
+    assert metrics.get_gauge("upstream_in_flight") == in_flight
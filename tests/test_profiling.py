@@ -0,0 +1,32 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.utils.config import settings
+from app.utils.profiling import LoopLagMonitor
+
+
+def test_unknown_sort_key_is_rejected_before_profiling(monkeypatch):
+    monkeypatch.setattr(settings, "admin_token", "admin")
+    client = TestClient(app)
+    response = client.get("/admin/profile", params={"mode": "cprofile", "sort": "bogus", "seconds": 5},
+                          headers={"X-Admin-Token": "admin"})
+    assert response.status_code == 400
+    assert "cumulative" in response.json()["detail"]
+
+
+def test_reconfigure_starts_and_stops_the_monitor():
+    async def scenario():
+        monitor = LoopLagMonitor(interval_seconds=0, threshold_seconds=0.2)
+        assert not monitor.running
+        monitor.reconfigure(0.01, 0.2)
+        assert monitor.running
+        task = monitor.start()
+        assert monitor.start() is task
+        await asyncio.sleep(0.05)
+        monitor.reconfigure(0, 0.2)
+        await asyncio.sleep(0)
+        assert not monitor.running and task.cancelled()
+
+    asyncio.run(scenario())
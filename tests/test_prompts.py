@@ -0,0 +1,54 @@
+import logging
+from collections import Counter
+
+import pytest
+
+from app.utils.prompts import choose_prompt_variant, parse_variant_weights
+
+
+@pytest.fixture(autouse=True)
+def fresh_parse_cache():
+    parse_variant_weights.cache_clear()
+
+
+@pytest.mark.parametrize("spec, weights", [
+    ("compact", (("compact", 1.0),)),
+    ("default=80,compact=20", (("default", 80.0), ("compact", 20.0))),
+    (" default = 3 , compact=1.5 ,", (("default", 3.0), ("compact", 1.5))),
+    ("default=0,compact=1", (("compact", 1.0),)),
+    ("", (("default", 1.0),)),
+])
+def test_weights_syntax(spec, weights):
+    assert parse_variant_weights(spec) == weights
+
+
+def test_unknown_names_and_bad_weights_are_skipped_with_a_warning(caplog):
+    with caplog.at_level(logging.WARNING, logger="app.utils.prompts"):
+        assert parse_variant_weights("default=80,verbose=20,compact=x") == (("default", 80.0),)
+    assert "verbose" in caplog.text and "compact=x" in caplog.text
+
+
+def test_unparsable_setting_falls_back_to_default_with_a_warning(caplog):
+    with caplog.at_level(logging.WARNING, logger="app.utils.prompts"):
+        assert choose_prompt_variant("compact:1") == "default"
+        assert choose_prompt_variant("compact:1", "session") == "default"
+    # Logged once per setting, not per request
+    assert caplog.text.count("names no usable variant") == 1
+
+
+def test_session_key_keeps_its_variant():
+    spec = "default=50,compact=50"
+    for key in ("session-a", "session-b", "session-c"):
+        assert len({choose_prompt_variant(spec, key) for _ in range(20)}) == 1
+
+
+def test_split_follows_the_weights():
+    counts = Counter(choose_prompt_variant("default=80,compact=20", f"session-{i}") for i in range(5000))
+    assert 0.77 < counts["default"] / 5000 < 0.83
+    counts = Counter(choose_prompt_variant("default=80,compact=20") for _ in range(5000))
+    assert 0.77 < counts["default"] / 5000 < 0.83
+
+
+def test_single_variant_needs_no_key():
+    assert choose_prompt_variant("compact") == "compact"
+    assert choose_prompt_variant("default=0,compact=5", "session") == "compact"
@@ -0,0 +1,32 @@
+import asyncio
+import types
+
+import httpx
+import pytest
+from openai import RateLimitError
+
+from app.services.circuit_breaker import circuit_breakers
+from app.services.llm_service import llm_service
+from app.utils.config import settings
+
+
+class ThrottledCompletions:
+    async def create(self, **kwargs):
+        request = httpx.Request("POST", "http://upstream/v1/chat/completions")
+        raise RateLimitError("slow down", response=httpx.Response(429, request=request), body=None)
+
+
+def test_rate_limit_is_not_a_breaker_failure(monkeypatch):
+    monkeypatch.setattr(llm_service, "client",
+                        types.SimpleNamespace(chat=types.SimpleNamespace(completions=ThrottledCompletions())))
+    model = "rate-limited-model"
+
+    for _ in range(settings.circuit_min_requests + 5):
+        with pytest.raises(Exception, match="Rate limit"):
+            asyncio.run(llm_service._create_completion(
+                messages=[{"role": "user", "content": "hi"}], model=model, temperature=0, max_tokens=None, stream=False
+            ))
+
+    breaker = circuit_breakers.get(settings.openai_api_base, model)
+    assert breaker.state == "closed"
+    assert not breaker._outcomes
@@ -0,0 +1,91 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.llm_service import llm_service
+from app.utils.config import settings
+from app.utils.reasoning import ReasoningFilter, strip_reasoning
+from conftest import FakeUpstream
+
+THOUGHT = "<think>\n患者问干眼症，需要解释病因。\n</think>\n\n干眼症是泪膜不稳定导致的。"
+
+# The chat endpoint sends content as raw SSE data, so keep newlines out of it
+INLINE_THOUGHT = "<think>患者问干眼症，需要解释病因。</think>干眼症是泪膜不稳定导致的。"
+
+
+def delta(content=None, reasoning_content=None):
+    return SimpleNamespace(content=content, reasoning_content=reasoning_content)
+
+
+def split(pieces):
+    """Feed content pieces through a filter; returns (reasoning, answer)"""
+    reasoning_filter = ReasoningFilter()
+    reasoning, answer = "", ""
+    for piece in pieces:
+        r, a = reasoning_filter.feed(delta(piece))
+        reasoning, answer = reasoning + r, answer + a
+    r, a = reasoning_filter.flush()
+    return reasoning + r, answer + a
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, len(THOUGHT)])
+def test_tags_split_across_chunks(size):
+    pieces = [THOUGHT[i:i + size] for i in range(0, len(THOUGHT), size)]
+    assert split(pieces) == ("\n患者问干眼症，需要解释病因。\n", "干眼症是泪膜不稳定导致的。")
+
+
+def test_partial_tag_is_held_back_until_resolved():
+    reasoning_filter = ReasoningFilter()
+    assert reasoning_filter.feed(delta("答案<thi")) == ("", "答案")
+    assert reasoning_filter.feed(delta("s is not a tag")) == ("", "<this is not a tag")
+    assert reasoning_filter.feed(delta("结尾<")) == ("", "结尾")
+    assert reasoning_filter.flush() == ("", "<")
+
+
+def test_unclosed_think_block_at_the_end_is_reasoning():
+    assert split(["<think>还在想", "</thi"]) == ("还在想</thi", "")
+
+
+def test_reasoning_content_deltas_are_kept_apart():
+    reasoning_filter = ReasoningFilter()
+    assert reasoning_filter.feed(delta(None, "先分析病情")) == ("先分析病情", "")
+    assert reasoning_filter.feed(delta("\n\n答案", None)) == ("", "答案")
+    assert reasoning_filter.reasoning_chars == len("先分析病情")
+
+
+def test_strip_reasoning_from_complete_text():
+    assert strip_reasoning(THOUGHT) == "干眼症是泪膜不稳定导致的。"
+    # The chat template may open the block in the prompt
+    assert strip_reasoning("只有结束标签</think>答案") == "答案"
+    assert strip_reasoning("没有思考") == "没有思考"
+
+
+@pytest.fixture
+def thinking_upstream(monkeypatch):
+    pieces = [INLINE_THOUGHT[i:i + 4] for i in range(0, len(INLINE_THOUGHT), 4)]
+    monkeypatch.setattr(llm_service, "client", FakeUpstream(pieces))
+
+
+def stream_chat():
+    response = TestClient(app).post("/api/chat/completions",
+                                    json={"messages": [{"role": "user", "content": "干眼症是什么？"}], "stream": True})
+    answer, reasoning = "", ""
+    for event in response.text.split("\n\n"):
+        if event.startswith("event: reasoning\n"):
+            reasoning += json.loads(event.split("data: ", 1)[1])["content"]
+        elif event.startswith("data: ") and event != "data: [DONE]":
+            answer += event[len("data: "):]
+    return reasoning, answer
+
+
+@pytest.mark.parametrize("mode, expected", [
+    ("drop", ("", "干眼症是泪膜不稳定导致的。")),
+    ("event", ("患者问干眼症，需要解释病因。", "干眼症是泪膜不稳定导致的。")),
+    ("keep", ("", INLINE_THOUGHT)),
+])
+def test_reasoning_modes(monkeypatch, thinking_upstream, mode, expected):
+    monkeypatch.setattr(settings, "reasoning_mode", mode)
+    assert stream_chat() == expected
@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+from openai.types.chat import ChatCompletion
+
+from conftest import collect, iterate, make_chunk
+from app.utils.recorder import TrafficRecorder
+from mock_upstream import ReplayStore, merge_deltas
+
+MESSAGES = [{"role": "user", "content": "眼睛干怎么办？"}]
+USAGE = {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13}
+
+
+def reasoning_chunk(text):
+    chunk = make_chunk()
+    chunk.choices[0].delta.reasoning_content = text
+    return chunk
+
+
+def test_stream_is_recorded_with_full_deltas_and_usage(tmp_path):
+    path = str(tmp_path / "recordings.jsonl")
+    recorder = TrafficRecorder(path)
+    upstream = [
+        reasoning_chunk("先想一想"),
+        make_chunk("多眨眼"),
+        make_chunk(finish_reason="stop"),
+        make_chunk(usage=USAGE, choices=False),
+    ]
+
+    async def scenario():
+        recorder.begin("/api/eye-doctor/chat", {"question": "眼睛干怎么办？", "stream": True})
+        stream = recorder.wrap_stream(MESSAGES, "test-model", 0.0, iterate(upstream))
+        return await collect(stream)
+
+    assert asyncio.run(scenario()) == upstream
+    recorder.close()
+
+    timeline = ReplayStore(path, speed=1).timeline(ReplayStore(path, speed=1).lookup(MESSAGES))
+    deltas = [delta for _, delta, _, _ in timeline]
+    assert deltas[:2] == [{"reasoning_content": "先想一想"}, {"content": "多眨眼"}]
+    assert deltas[3] is None and timeline[3][3] == USAGE
+    assert timeline[2][2] == "stop"
+    assert merge_deltas(delta for delta in deltas if delta)["reasoning_content"] == "先想一想"
+
+
+def test_non_streamed_response_keeps_the_whole_message(tmp_path):
+    path = str(tmp_path / "recordings.jsonl")
+    recorder = TrafficRecorder(path)
+    response = ChatCompletion.model_validate({
+        "id": "c", "object": "chat.completion", "created": 0, "model": "test-model",
+        "choices": [{"index": 0, "finish_reason": "length",
+                     "message": {"role": "assistant", "content": "<think>嗯</think>多眨眼", "reasoning_content": "嗯"}}],
+        "usage": USAGE,
+    })
+
+    async def scenario():
+        recorder.begin("/api/eye-doctor/chat", {"question": "眼睛干怎么办？"})
+        recorder.record_response(MESSAGES, "test-model", 0.5, response)
+
+    asyncio.run(scenario())
+    recorder.close()
+
+    with open(path, encoding="utf-8") as f:
+        upstream = json.loads(f.readline())["upstream"]
+    assert upstream["message"]["reasoning_content"] == "嗯"
+    assert upstream["message"]["content"] == "<think>嗯</think>多眨眼"
+    assert upstream["finish_reason"] == "length"
+    assert upstream["usage"] == USAGE
+
+
+def test_legacy_recordings_still_replay(tmp_path):
+    path = tmp_path / "recordings.jsonl"
+    legacy = {"key": "k", "model": "m", "stream": True, "chunks": [[0.1, "你好", None], [0.2, "", "stop"]]}
+    path.write_text(json.dumps({"upstream": legacy}) + "\n", encoding="utf-8")
+    timeline = ReplayStore(str(path), speed=2).timeline(legacy)
+    assert timeline == [(0.05, {"content": "你好"}, None, None), (0.1, {"content": ""}, "stop", None)]
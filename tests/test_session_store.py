@@ -0,0 +1,83 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+from app.models.eye_doctor import EyeDoctorRequest
+from app.services.session_store import SessionStore
+
+
+def request(session_id, **fields):
+    values = {"session_id": session_id, "question": "还需要复查吗？"}
+    values.update(fields)
+    return EyeDoctorRequest(**values)
+
+
+def first_request(session_id, **fields):
+    return request(session_id, disease_name="干眼症", disease_category="眼表疾病", result="BUT 3s", **fields)
+
+
+def test_trims_by_message_and_keeps_history_starting_with_a_question():
+    store = SessionStore(max_sessions=10, max_turns=5, max_chars=10000, ttl_seconds=0)
+    history = [{"role": "assistant", "content": "您好"}, {"role": "user", "content": "眼睛干"}]
+    asyncio.run(store.prepare(first_request("s", previous_conversations=history)))
+    for i in range(3):
+        store.append("s", f"q{i}", f"a{i}")
+
+    _, turns = asyncio.run(store.prepare(request("s")))
+    assert [turn.content for turn in turns] == ["q1", "a1", "q2", "a2"]
+    assert turns[0].role == "user"
+
+
+def test_char_limit_keeps_latest_exchange():
+    store = SessionStore(max_sessions=10, max_turns=100, max_chars=10, ttl_seconds=0)
+    asyncio.run(store.prepare(first_request("s")))
+    store.append("s", "q" * 20, "a" * 20)
+    _, turns = asyncio.run(store.prepare(request("s")))
+    assert [turn.role for turn in turns] == ["user", "assistant"]
+
+
+def test_spill_round_trip_runs_off_the_event_loop(tmp_path):
+    store = SessionStore(max_sessions=1, max_turns=10, max_chars=10000, ttl_seconds=3600,
+                         spill_path=str(tmp_path / "sessions.db"))
+    threads = set()
+    original = store._connect
+
+    def connect():
+        threads.add(threading.current_thread())
+        return original()
+
+    store._connect = connect
+
+    async def scenario():
+        await store.prepare(first_request("a"))
+        store.append("a", "q", "a")
+        await store.prepare(first_request("b"))
+        # "a" was evicted to the spill file, appending goes there too
+        store.append("a", "q2", "a2")
+        restored, turns = await store.prepare(request("a"))
+        return restored, turns
+
+    restored, turns = asyncio.run(scenario())
+    store.close()
+    assert restored.disease_name == "干眼症"
+    assert [turn.content for turn in turns] == ["q", "a", "q2", "a2"]
+    assert threads and threading.main_thread() not in threads
+
+
+def test_expired_spilled_sessions_are_pruned(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SessionStore(max_sessions=1, max_turns=10, max_chars=10000, ttl_seconds=3600, spill_path=path)
+
+    async def scenario():
+        await store.prepare(first_request("old"))
+        store._sessions["old"].updated_at = time.time() - 1800
+        await store.prepare(first_request("new"))
+
+    asyncio.run(scenario())
+    store.close()
+
+    store = SessionStore(max_sessions=1, max_turns=10, max_chars=10000, ttl_seconds=60, spill_path=path)
+    store.close()
+    count = sqlite3.connect(path).execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+    assert count == 0
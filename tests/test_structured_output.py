@@ -0,0 +1,47 @@
+import json
+
+from app.utils.structured_output import MAX_PREAMBLE_CHARS, RecommendationStreamValidator
+
+ANSWER = json.dumps({
+    "medications": [{"medication_name": "人工泪液", "dosage": "1滴", "frequency": "每日4次", "side_effects": "无"}],
+    "treatment_plan": {"treatment_type": "药物治疗", "treatment_detail": "按时用药"},
+}, ensure_ascii=False)
+
+
+def feed(text, step=3):
+    validator = RecommendationStreamValidator()
+    for i in range(0, len(text), step):
+        error = validator.feed(text[i:i + step])
+        if error:
+            return error
+    return None
+
+
+def test_valid_answer_passes_in_small_pieces():
+    assert feed(ANSWER, step=1) is None
+    assert feed(ANSWER, step=7) is None
+
+
+def test_think_block_and_code_fence_are_ignored():
+    assert feed("<think>先分析{病情}</think>\n```json\n" + ANSWER + "\n```") is None
+
+
+def test_truncated_answer_is_not_an_error():
+    assert feed(ANSWER[:ANSWER.index("dosage")]) is None
+
+
+def test_wrong_top_level_type_is_reported():
+    assert feed('{"medications": "人工泪液", "treatment_plan": {}}')
+
+
+def test_wrong_treatment_plan_type_is_reported():
+    assert feed('{"medications": [], "treatment_plan": {"treatment_type": ["药物治疗"]}}')
+
+
+def test_unquoted_key_is_reported():
+    assert feed('{medications: []}')
+
+
+def test_long_prose_without_json_is_reported():
+    assert feed("x" * MAX_PREAMBLE_CHARS) is None
+    assert feed("x" * (MAX_PREAMBLE_CHARS + 10)) == "no JSON object in output"
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from app.services import llm_service as llm_module
+from app.services.token_budget import TokenBudget, ADAPTIVE, FIXED
+from conftest import make_chunk, iterate, collect
+
+@pytest.fixture
+def budget(monkeypatch):
+    budget = TokenBudget(budget_percentile=99, headroom=0.25, min_samples=1, window=10, min_tokens=1, max_tokens=4096)
+    monkeypatch.setattr(llm_module, "token_budget", budget)
+    return budget
+
+def run_stream(chunks, source=FIXED):
+    stream = llm_module.BudgetStream(iterate(chunks), "general", "test-model", source)
+    return asyncio.run(collect(stream))
+
+def test_stream_without_usage_is_not_sampled(budget):
+    chunks = [make_chunk("一段很长的回答"), make_chunk("结束", finish_reason="stop")]
+    assert len(run_stream(chunks)) == 2
+    assert budget.limit("general", "test-model") is None
+
+def test_stream_with_usage_is_sampled(budget):
+    usage = {"prompt_tokens": 10, "completion_tokens": 400, "total_tokens": 410}
+    run_stream([make_chunk("回答", finish_reason="stop"), make_chunk(choices=False, usage=usage)])
+    assert budget.limit("general", "test-model") == 500
+
+def test_unfinished_stream_is_not_observed(budget):
+    run_stream([make_chunk("回答")])
+    assert budget.limit("general", "test-model") is None
+
+def test_stream_passes_truncated_through(budget):
+    class Truncated:
+        truncated = True
+
+        def __aiter__(self):
+            return iterate([make_chunk("部分回答")])
+
+    stream = llm_module.BudgetStream(Truncated(), "general", "test-model", FIXED)
+    assert len(asyncio.run(collect(stream))) == 1
+    assert stream.truncated
+    assert not llm_module.BudgetStream(iterate([]), "general", "test-model", FIXED).truncated
+
+def test_truncation_samples_only_under_adaptive_budget(budget):
+    budget.observe("general", "test-model", 100, "length", FIXED)
+    assert budget.limit("general", "test-model") is None
+    budget.observe("general", "test-model", 100, "length", ADAPTIVE)
+    assert budget.limit("general", "test-model") == 125
+
+def test_caller_max_tokens_wins(budget):
+    budget.observe("general", "test-model", 100, "stop", FIXED)
+    assert budget.resolve(50, "general", "test-model") == (50, "caller")
+    assert budget.resolve(None, "general", "test-model") == (125, "adaptive")
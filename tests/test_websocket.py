@@ -0,0 +1,40 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.utils.metrics import metrics
+
+
+@pytest.fixture
+def websocket():
+    with TestClient(app).websocket_connect("/ws/eye-doctor") as websocket:
+        yield websocket
+
+
+@pytest.mark.parametrize("frame", ["[]", "42", '"chat"', "null"])
+def test_non_object_frame_gets_error_and_keeps_connection(websocket, frame):
+    websocket.send_text(frame)
+    assert websocket.receive_json() == {"type": "error", "request_id": None, "error": "Message must be a JSON object"}
+
+    websocket.send_json({"type": "ping", "request_id": "r1"})
+    reply = websocket.receive_json()
+    assert reply["type"] == "error" and reply["request_id"] == "r1"
+
+
+def test_invalid_json_gets_error(websocket):
+    websocket.send_text("{not json")
+    assert websocket.receive_json()["error"] == "Invalid JSON message"
+
+
+def test_non_string_request_id_is_rejected(websocket):
+    websocket.send_json({"type": "chat", "request_id": ["a"], "request": {}})
+    assert websocket.receive_json() == {"type": "error", "request_id": None, "error": "Missing or duplicate request_id"}
+
+
+def test_unknown_message_types_share_one_label(websocket):
+    websocket.send_json({"type": "x-random-1", "request_id": "r1"})
+    websocket.receive_json()
+    websocket.send_json({"type": "x-random-2", "request_id": "r2"})
+    websocket.receive_json()
+    labels = [key for key in metrics.snapshot()["counters"] if key.startswith("ws_messages_total")]
+    assert not any("x-random" in key for key in labels)